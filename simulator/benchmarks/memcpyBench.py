@@ -0,0 +1,72 @@
+import os
+import struct
+import sys
+import tempfile
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from pylib import memManage
+
+# conv5_weights copy from lenetFPGA.ISA (memcpy2device conv5_weights 45904 48000)
+ADDRESS = 45904
+SIZE = 48000
+MEMORY_SIZE = 4 * 1024 * 1024
+
+# per byte implementations memManage used before the bulk hex codec, kept as the baseline
+def legacyReadArrayFromMemory(mainMemoryFile, address, size, dtype='f'):
+    array = np.zeros(size, dtype=np.float32)
+    with open(mainMemoryFile, 'r') as mem_file:
+        mem_file.seek(address * 3)
+        for i in range(size):
+            bytes_value = bytearray()
+            for j in range(4):
+                byte_str = mem_file.readline().strip()
+                bytes_value.append(int(byte_str, 16))
+            array[i] = struct.unpack(dtype, bytes_value)[0]
+    return array
+
+def legacyWriteFloatArrayToMemory(mainMemoryFile, numpyData, address, size):
+    array = numpyData.flatten()
+    with open(mainMemoryFile, 'r+') as mem_file:
+        lines = mem_file.readlines()
+        for i in range(size):
+            bytes_value = struct.pack('f', array[i])
+            for j in range(4):
+                lines[address + 4 * i + j] = f'{bytes_value[j]:02X}\n'
+        mem_file.seek(0)
+        mem_file.writelines(lines)
+    return address + 4 * size
+
+def timeit(function, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+if __name__ == "__main__":
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+    weights = np.random.default_rng(0).standard_normal(SIZE).astype(np.float32)
+
+    with tempfile.TemporaryDirectory() as workDir:
+        legacyFile = os.path.join(workDir, "legacy")
+        bulkFile = os.path.join(workDir, "bulk")
+        memManage.setupMemory(MEMORY_SIZE, legacyFile)
+        memManage.setupMemory(MEMORY_SIZE, bulkFile)
+
+        legacyWrite, _ = timeit(lambda: legacyWriteFloatArrayToMemory(legacyFile, weights, ADDRESS, SIZE), repeat)
+        bulkWrite, _ = timeit(lambda: memManage.writeFloatArrayToMemory(bulkFile, weights, ADDRESS, SIZE), repeat)
+        with open(legacyFile, 'rb') as legacy, open(bulkFile, 'rb') as bulk:
+            assert legacy.read() == bulk.read(), "bulk write is not byte identical to the legacy write"
+
+        legacyRead, legacyData = timeit(lambda: legacyReadArrayFromMemory(legacyFile, ADDRESS, SIZE), repeat)
+        bulkRead, bulkData = timeit(lambda: memManage.readArrayFromMemory(bulkFile, ADDRESS, SIZE), repeat)
+        assert np.array_equal(legacyData, weights) and np.array_equal(bulkData, weights)
+
+    print(f"conv5_weights copy, {SIZE} floats at address {ADDRESS}, best of {repeat}")
+    print(f"{'':6} {'legacy':>10} {'bulk':>10} {'speedup':>8}")
+    print(f"{'write':6} {legacyWrite * 1e3:8.1f}ms {bulkWrite * 1e3:8.2f}ms {legacyWrite / bulkWrite:7.0f}x")
+    print(f"{'read':6} {legacyRead * 1e3:8.1f}ms {bulkRead * 1e3:8.2f}ms {legacyRead / bulkRead:7.0f}x")
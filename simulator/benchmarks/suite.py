@@ -0,0 +1,271 @@
+import argparse
+import datetime
+import hashlib
+import json
+import os
+import struct
+import subprocess
+import sys
+import tempfile
+import numpy as np
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCHMARK_DIR)
+sys.path.insert(0, ROOT)
+
+import run
+from memcpyBench import timeit
+from pylib import backends
+from pylib import isa
+from pylib import kernels
+from pylib import memManage
+from pylib import readbins
+
+# output digests every benchmark is checked against, committed with the code
+GOLDEN_FILE = os.path.join(BENCHMARK_DIR, "golden.json")
+# per machine: one JSON line per suite run, and the timings regressions are measured against
+HISTORY_FILE = os.path.join(BENCHMARK_DIR, "history.jsonl")
+BASELINE_FILE = os.path.join(BENCHMARK_DIR, "baseline.json")
+
+MEMORY_SIZE = 4 * 1024 * 1024
+STREAM_DEPTH = 1 * 1024 * 1024
+NUM_IMAGES = 256
+SEED = 526
+
+# LeNet layers of lenetFPGA.ISA as single memory to memory tile instructions, conv5 is one of its two tiles
+LENET_TILES = {
+    "conv1": ("convR8_32_5", dict(inputChannels=1, height=32, width=32, outputChannels=6)),
+    "maxp2": ("maxp2_2", dict(inputChannels=6, height=28, width=28, poolSize=2, stride=2)),
+    "conv3": ("convR8_32_5", dict(inputChannels=6, height=14, width=14, outputChannels=16)),
+    "maxp4": ("maxp2_2", dict(inputChannels=16, height=10, width=10, poolSize=2, stride=2)),
+    "conv5": ("convR8_32_5", dict(inputChannels=16, height=5, width=5, outputChannels=60)),
+    "fc6": ("fc128_64", dict(inputChannels=120, outputChannels=10)),
+}
+
+def digest(output):
+    """Golden entry of a benchmark output: shape, dtype, hash of the bytes and the first values to eyeball."""
+    output = np.ascontiguousarray(output)
+    return {"shape": list(output.shape), "dtype": str(output.dtype),
+            "sha256": hashlib.sha256(output.tobytes()).hexdigest(),
+            "head": [float(value) for value in output.reshape(-1)[:8]]}
+
+def writeDataset(dataDir, numImages, rng):
+    """MNIST format images.bin and labels.bin of random digits, params.bin is the repo's."""
+    images = rng.integers(0, 256, numImages * 28 * 28, dtype=np.uint8)
+    labels = rng.integers(0, 10, numImages, dtype=np.uint8)
+    with open(os.path.join(dataDir, "images.bin"), 'wb') as file:
+        file.write(struct.pack('>IIII', 2051, numImages, 28, 28) + images.tobytes())
+    with open(os.path.join(dataDir, "labels.bin"), 'wb') as file:
+        file.write(struct.pack('>II', 2049, numImages) + labels.tobytes())
+
+def loadDataObjects(dataDir, paramsFile):
+    dataObjects = {}
+    images, _ = readbins.parse_mnist_images(os.path.join(dataDir, "images.bin"))
+    labels = readbins.parse_mnist_labels(os.path.join(dataDir, "labels.bin"))
+    (dataObjects['conv1_weights'], dataObjects['conv1_bias'], dataObjects['conv3_weights'], dataObjects['conv3_bias'],
+     dataObjects['conv5_weights'], dataObjects['conv5_bias'], dataObjects['fc6_weights'], dataObjects['fc6_bias']
+     ) = readbins.parse_parameters(paramsFile)
+    dataObjects['image'] = readbins.get_image(images, 0)
+    return dataObjects, images, labels
+
+def tileInstruction(kernel, arguments, address=0):
+    """A memory to memory instruction on tile 1 with its input, parameters and output packed from address."""
+    fields = dict(arguments, tile=1, destTiles=(1,), streamSetting="MM")
+    instructionType = isa.OPCODES[kernel]
+    # sizes need the dimensions only, addresses are filled in below
+    probe = instructionType(**{field: fields.get(field, 0) for field in instructionType._fields})
+    fields["inputAddress"] = address
+    address += 4 * probe.inputSize
+    if kernel != "maxp2_2":
+        (_, weightSize), (_, biasSize) = probe.parameterRanges()
+        fields["weightAddress"] = address
+        fields["biasAddress"] = address + 4 * weightSize
+        address += 4 * (weightSize + biasSize)
+    fields["outputAddress"] = address
+    return instructionType(**{field: fields[field] for field in instructionType._fields})
+
+def tileBenchmark(backend, mainMemoryFile, memoryDir, instruction, rng):
+    """Set up main memory with random input and parameters for instruction, return a function running it."""
+    command = instruction.commandLine(os.path.join(ROOT, "src/"), mainMemoryFile, memoryDir)
+    backend.setupMemory(MEMORY_SIZE, mainMemoryFile)
+    # the input stream of the command, in the format of mainMemoryFile
+    backend.setupStream(STREAM_DEPTH, command[2])
+    for address, size in [(instruction.inputAddress, instruction.inputSize)] + instruction.parameterRanges():
+        backend.writeMemory(mainMemoryFile, rng.standard_normal(size).astype(np.float32) * 0.5, address, size)
+
+    def runTile():
+        backend.run(command)
+        return backend.readMemory(mainMemoryFile, instruction.outputAddress, instruction.outputSize)
+    return runTile
+
+def memoryBenchmarks(workDir, rng):
+    """Setup, write and read of both memory formats, every size has its own range written up front so
+    each benchmark gives the same output run alone (--filter) or after the others."""
+    benchmarks = []
+    for memoryFormat in ("text", "binary"):
+        setupFile = memManage.mainMemoryPath(os.path.join(workDir, memoryFormat + "-setup-"), memoryFormat)
+        for megabytes in (1, 4):
+            def setup(memorySize=megabytes * 1024 * 1024):
+                memManage.setupMemory(memorySize, setupFile)
+                return np.array([os.path.getsize(setupFile)])
+            benchmarks.append((f"memManage setup {megabytes}MB {memoryFormat}", setup, None))
+
+        memoryFile = memManage.mainMemoryPath(os.path.join(workDir, memoryFormat + "-"), memoryFormat)
+        memManage.setupMemory(MEMORY_SIZE, memoryFile)
+        address = 4096
+        # the largest is a whole stream worth of floats
+        for size in (1024, 48000, kernels.MAX_STREAM_ELEMENTS):
+            data = rng.standard_normal(size).astype(np.float32)
+            memManage.writeFloatArrayToMemory(memoryFile, data, address, size)
+
+            def write(memoryFile=memoryFile, data=data, address=address, size=size):
+                memManage.writeFloatArrayToMemory(memoryFile, data, address, size)
+                return memManage.readArrayFromMemory(memoryFile, address, size)
+
+            def read(memoryFile=memoryFile, address=address, size=size):
+                return memManage.readArrayFromMemory(memoryFile, address, size)
+            benchmarks.append((f"memManage write {size} {memoryFormat}", write, None))
+            benchmarks.append((f"memManage read {size} {memoryFormat}", read, None))
+            address += 4 * size
+    return benchmarks
+
+def buildBenchmarks(workDir, paramsFile):
+    """(name, function returning the output checked against the golden, images per call for a throughput or None)."""
+    rng = np.random.default_rng(SEED)
+    dataDir = os.path.join(workDir, "data")
+    os.makedirs(dataDir)
+    writeDataset(dataDir, NUM_IMAGES, rng)
+    dataObjects, images, labels = loadDataObjects(dataDir, paramsFile)
+    binDir = os.path.join(ROOT, "src/")
+    with open(os.path.join(ROOT, "lenetFPGA.ISA")) as file:
+        program = isa.compileISA(file.read(), MEMORY_SIZE, "lenetFPGA.ISA")
+
+    benchmarks = memoryBenchmarks(workDir, rng)
+
+    benchmarks += [
+        ("readbins images", lambda: readbins.parse_mnist_images(os.path.join(dataDir, "images.bin"))[0], None),
+        ("readbins labels", lambda: np.frombuffer(readbins.parse_mnist_labels(os.path.join(dataDir, "labels.bin")),
+                                                  dtype=np.uint8), None),
+        ("readbins params", lambda: np.concatenate([np.ravel(array) for array in readbins.parse_parameters(paramsFile)]),
+         None),
+        ("readbins get_images", lambda: readbins.get_images(images, np.arange(NUM_IMAGES)), None),
+    ]
+
+    # each tile program alone at its LeNet shape, the C binary and the bit exact NumPy kernel on the same data
+    for backendName, backend, memoryFormat in (("subprocess", backends.FileBackend(verbose=False), "binary"),
+                                               ("numpy", backends.NumpyBackend(exact=True), "binary")):
+        memoryDir = os.path.join(workDir, "tile-" + backendName) + "/"
+        os.makedirs(memoryDir)
+        for layer, (kernel, arguments) in LENET_TILES.items():
+            instruction = tileInstruction(kernel, arguments)
+            # every layer gets its own memory so the tiles do not overwrite each other's data
+            mainMemoryFile = memManage.mainMemoryPath(memoryDir + layer + "-", memoryFormat)
+            tileRng = np.random.default_rng([SEED, list(LENET_TILES).index(layer)])
+            benchmarks.append((f"tile {layer} {kernel} {backendName}",
+                               tileBenchmark(backend, mainMemoryFile, memoryDir, instruction, tileRng), None))
+
+    # the whole program on one image, weights copied every time as run.py --no-snapshot does
+    for backendName, backend, memoryFormat in (("subprocess", backends.FileBackend(verbose=False), "text"),
+                                               ("subprocess", backends.FileBackend(verbose=False), "binary"),
+                                               ("numpy", backends.NumpyBackend(exact=True), "binary")):
+        memoryDir = os.path.join(workDir, f"isa-{backendName}-{memoryFormat}") + "/"
+        os.makedirs(memoryDir)
+
+        def runProgram(backend=backend, memoryDir=memoryDir, memoryFormat=memoryFormat):
+            backend.setupMemory(MEMORY_SIZE, memManage.mainMemoryPath(memoryDir, memoryFormat))
+            return run.parseISA(program, binDir, dataDir, memoryDir, STREAM_DEPTH, dict(dataObjects), memoryFormat,
+                                backend)['output']
+        benchmarks.append((f"parseISA lenet {backendName} {memoryFormat}", runProgram, None))
+
+    # multi-image throughput, weights copied once per call
+    for backendName, backend, numImages, batchSize in (("subprocess", backends.FileBackend(verbose=False), 4, 1),
+                                                       ("persistent", backends.PersistentBackend(verbose=False), 4, 1),
+                                                       ("numpy", backends.NumpyBackend(exact=True), NUM_IMAGES, 64)):
+        memoryDir = os.path.join(workDir, f"batch-{backendName}") + "/"
+        os.makedirs(memoryDir)
+
+        def runImages(backend=backend, memoryDir=memoryDir, numImages=numImages, batchSize=batchSize):
+            backend.setupMemory(MEMORY_SIZE, memManage.mainMemoryPath(memoryDir, "binary"))
+            outputs, _, _ = run.runBatch(program, binDir, dataDir, memoryDir, STREAM_DEPTH, dict(dataObjects), images, labels,
+                                         numImages, batchSize, "binary", backend)
+            return outputs
+        benchmarks.append((f"runBatch lenet {backendName} {numImages} images", runImages, numImages))
+    return benchmarks
+
+def loadJson(path, default):
+    if not os.path.exists(path):
+        return default
+    with open(path) as file:
+        return json.load(file)
+
+def gitCommit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time the simulator and check every result against the golden outputs")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per benchmark, the best is kept (default: 3)")
+    parser.add_argument("--filter", default="", help="only run benchmarks whose name contains this")
+    parser.add_argument("--params", default=os.path.join(ROOT, "data", "params.bin"), help="network parameters (default: data/params.bin)")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="slowdown against the baseline flagged as a regression (default: 0.25 = 25%%)")
+    parser.add_argument("--update-golden", action="store_true", help="store the outputs of this run as the golden outputs")
+    parser.add_argument("--save-baseline", action="store_true", help="store the timings of this run as the baseline")
+    parser.add_argument("--no-history", action="store_true", help="do not append this run to the history file")
+    args = parser.parse_args()
+
+    golden = loadJson(GOLDEN_FILE, {})
+    baseline = loadJson(BASELINE_FILE, {})
+    results = {}
+    failures = []
+    with tempfile.TemporaryDirectory() as workDir:
+        benchmarks = [benchmark for benchmark in buildBenchmarks(workDir, args.params) if args.filter in benchmark[0]]
+        print(f"{'benchmark':<44} {'best ms':>10} {'baseline':>10} {'images/s':>9}  check")
+        for name, function, numImages in benchmarks:
+            seconds, output = timeit(function, args.repeat)
+            entry = digest(output)
+            results[name] = {"seconds": seconds}
+            if numImages:
+                results[name]["imagesPerSecond"] = numImages / seconds
+
+            if args.update_golden:
+                golden[name] = entry
+                check = "stored"
+            elif name not in golden:
+                check = "no golden"
+            elif {key: golden[name][key] for key in ("shape", "dtype", "sha256")} != {key: entry[key] for key in ("shape", "dtype", "sha256")}:
+                check = "MISMATCH"
+                failures.append(f"{name}: output {entry['shape']} {entry['dtype']} {entry['head']} differs from "
+                                f"golden {golden[name]['shape']} {golden[name]['dtype']} {golden[name]['head']}")
+            else:
+                check = "ok"
+
+            if name in baseline and seconds > baseline[name] * (1 + args.tolerance):
+                check += f", REGRESSION {seconds / baseline[name]:.2f}x"
+                failures.append(f"{name}: {seconds * 1e3:.2f}ms, baseline {baseline[name] * 1e3:.2f}ms")
+            baselineText = f"{baseline[name] * 1e3:8.2f}ms" if name in baseline else f"{'-':>10}"
+            rateText = f"{numImages / seconds:9.1f}" if numImages else f"{'':>9}"
+            print(f"{name:<44} {seconds * 1e3:8.2f}ms {baselineText} {rateText}  {check}")
+
+    if args.update_golden:
+        with open(GOLDEN_FILE, 'w') as file:
+            json.dump(golden, file, indent=1, sort_keys=True)
+            file.write("\n")
+    if args.save_baseline:
+        baseline.update({name: result["seconds"] for name, result in results.items()})
+        with open(BASELINE_FILE, 'w') as file:
+            json.dump(baseline, file, indent=1, sort_keys=True)
+            file.write("\n")
+    if not args.no_history:
+        with open(HISTORY_FILE, 'a') as file:
+            file.write(json.dumps({"time": datetime.datetime.now().isoformat(timespec="seconds"), "commit": gitCommit(),
+                                   "repeat": args.repeat, "results": results}) + "\n")
+
+    if failures:
+        print(f"{len(failures)} failed:")
+        for failure in failures:
+            print(" ", failure)
+        sys.exit(1)
@@ -0,0 +1,647 @@
+import os
+import shutil
+import subprocess
+import threading
+import time
+import numpy as np
+
+from pylib import kernels
+from pylib import memManage
+from pylib import precision as reducedPrecision
+from pylib import profiler
+from pylib import streams
+
+# argument count of each tile program (program name included), any extra argument is another stream destination
+TILE_ARGUMENTS = {"convR8_32_5": 13, "maxp2_2": 12, "fc128_64": 11}
+
+# the int8 scales of a NumpyBackend snapshot, next to its codes
+SCALES_SUFFIX = ".scales.npy"
+
+def exeCommand(command, verbose=True, env=None):
+    # print("Executing command:", ' '.join(command))
+    # return
+
+    result = subprocess.run(command, capture_output=True, text=True, env=env)
+    # Check if the command was executed successfully
+    if result.returncode == 0:
+        # Command executed successfully, print stdout
+        if verbose:
+            print("Output:")
+            print(result.stdout)
+    else:
+        # There was an error, print stderr
+        print("Error:")
+        print(result.stderr)
+    return result
+
+def checkLimit(value, limit, condition):
+    # the tile programs assert their limits, an exception keeps the check under python -O
+    if value > limit:
+        raise ValueError(f"{condition} failed, {value} > {limit}")
+
+def splitTileCommand(command):
+    """Split a tile program command line the same way main() of the tile programs does."""
+    program = os.path.basename(command[0])
+    extraDest = len(command) - TILE_ARGUMENTS[program]
+    mainMemoryFile = command[1]
+    streamInput = command[2]
+    streamDest = command[3 : 4 + extraDest]
+    streamingSetting = int(command[4 + extraDest])
+    arguments = [int(argument) for argument in command[5 + extraDest:]]
+    return program, mainMemoryFile, streamInput, streamDest, streamingSetting, arguments
+
+def tileRanges(command):
+    """(address, size in floats) of the parameters, the input and the output of a tile program command."""
+    program, mainMemoryFile, streamInput, streamDest, streamingSetting, arguments = splitTileCommand(command)
+    if program == "convR8_32_5":
+        inputAddress, weightAddress, biasAddress, outputAddress, inputChannels, height, width, outputChannels = arguments
+        inputSize = inputChannels * height * width
+        outputSize = outputChannels * (height - kernels.FILTER_SIZE + 1) * (width - kernels.FILTER_SIZE + 1)
+        parameters = [(weightAddress, outputChannels * inputChannels * kernels.FILTER_SIZE ** 2), (biasAddress, outputChannels)]
+    elif program == "maxp2_2":
+        inputAddress, outputAddress, inputChannels, height, width, poolSize, stride = arguments
+        inputSize = inputChannels * height * width
+        outputSize = inputChannels * ((height - poolSize) // stride + 1) * ((width - poolSize) // stride + 1)
+        parameters = []
+    else:
+        inputAddress, weightAddress, biasAddress, outputAddress, inputChannels, outputChannels = arguments
+        inputSize = inputChannels
+        outputSize = outputChannels
+        parameters = [(weightAddress, outputChannels * inputChannels), (biasAddress, outputChannels)]
+    return parameters, (inputAddress, inputSize), (outputAddress, outputSize)
+
+class FileBackend:
+    """Runs the tile programs in src/ as subprocesses on the memory and stream files."""
+
+    def __init__(self, verbose=True):
+        self.verbose = verbose
+        self.mappedMemories = {}
+        # set by profiler.ProfilingBackend, run() then returns the phases the tile reports
+        self.profiling = False
+
+    def setupMemory(self, memorySize, mainMemoryFile):
+        memManage.setupMemory(memorySize, mainMemoryFile)
+        self.mappedMemories.pop(mainMemoryFile, None)
+
+    def setupStream(self, streamDepth, streamFile):
+        streams.Stream.create(streamDepth, streamFile)
+
+    def setupSharedStream(self, streamDepth, streamFiles):
+        """One multicast stream for a fan-out, written once and read by each tile through its own cursor."""
+        streams.Stream.createShared(streamDepth, streamFiles)
+
+    def snapshotSuffix(self, mainMemoryFile):
+        # a snapshot is a copy of the memory file, so it keeps the file's format
+        return memManage.BINARY_SUFFIX if memManage.isBinaryMemory(mainMemoryFile) else ".txt"
+
+    def saveMemory(self, mainMemoryFile, snapshotFile):
+        memManage.cloneFile(mainMemoryFile, snapshotFile)
+
+    def loadMemory(self, snapshotFile, mainMemoryFile):
+        memManage.cloneFile(snapshotFile, mainMemoryFile)
+        self.mappedMemories.pop(mainMemoryFile, None)
+
+    def moveStream(self, sourceFile, streamFile):
+        """Append every packet of sourceFile to streamFile and empty sourceFile."""
+        streams.Stream(sourceFile).moveTo(streams.Stream(streamFile))
+
+    def removeStream(self, streamFile):
+        os.remove(streamFile)
+
+    def streamPackets(self, streamFile, consume=False):
+        """Every packet of a stream as (srcTiles, values), consume empties it like a tile reading it."""
+        return streams.Stream(streamFile).read(consume)
+
+    def appendStreams(self, streamFiles, srcTiles, values):
+        """Append the same packets to each stream, once to a multicast stream several of them share."""
+        written = set()
+        for streamFile in streamFiles:
+            stat = os.stat(streamFile)
+            if (stat.st_dev, stat.st_ino) in written:
+                continue
+            written.add((stat.st_dev, stat.st_ino))
+            streams.Stream(streamFile).write(srcTiles, values)
+
+    def hostMemory(self, mainMemoryFile):
+        # binary memory is mapped once, host copies are then plain slice assignments
+        if not memManage.isBinaryMemory(mainMemoryFile):
+            return mainMemoryFile
+        if mainMemoryFile not in self.mappedMemories:
+            self.mappedMemories[mainMemoryFile] = memManage.openMemory(mainMemoryFile)
+        return self.mappedMemories[mainMemoryFile]
+
+    def writeMemory(self, mainMemoryFile, data, address, size):
+        return memManage.writeFloatArrayToMemory(self.hostMemory(mainMemoryFile), data, address, size)
+
+    def exportTextMemory(self, mainMemoryFile, textMemoryFile):
+        """Dump main memory in the one hex byte per line debug format, a text memory already is."""
+        if memManage.isBinaryMemory(mainMemoryFile):
+            memManage.exportTextMemory(self.hostMemory(mainMemoryFile), textMemoryFile)
+        else:
+            shutil.copyfile(mainMemoryFile, textMemoryFile)
+
+    def writeBatchMemory(self, mainMemoryFile, data, address, size):
+        """The tile binaries run one image at a time, so a batch here always holds a single sample."""
+        if len(data) != 1:
+            raise ValueError(f"{type(self).__name__} runs one image per pass, got a batch of {len(data)}")
+        return self.writeMemory(mainMemoryFile, data[0], address, size)
+
+    def readMemory(self, mainMemoryFile, address, size):
+        return memManage.readArrayFromMemory(self.hostMemory(mainMemoryFile), address, size)
+
+    def transferBytes(self, mainMemoryFile, size):
+        # a text memory holds each byte as a "XX\n" line
+        return 4 * size if memManage.isBinaryMemory(mainMemoryFile) else 4 * size * memManage.HEX_LINE_SIZE
+
+    def run(self, command):
+        if not self.profiling:
+            exeCommand(command, self.verbose)
+            return None
+        result = exeCommand(command, self.verbose, env=dict(os.environ, TILE_PROFILE="1"))
+        return profiler.parseTileProfile(result.stdout)
+
+    def close(self):
+        """Release the backend, the subprocess tiles keep nothing running between instructions."""
+
+class TileWorker:
+    """One long-lived "<program> --serve" tile process, fed a command line at a time over its stdin."""
+
+    def __init__(self, program, env=None):
+        self.process = subprocess.Popen([program, "--serve"], stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                        text=True, env=env)
+        self.lock = threading.Lock()
+        # (mainMemoryFile, [(address, bytes)]) of the resident parameters, stale once the host wrote over them
+        self.parameters = None
+        self.stale = True
+
+    def run(self, command, parameters):
+        """Run one tile command, returns its status and the output the tile printed for it."""
+        # clear stale before sending, a write over the parameters during the command marks them again
+        reload, self.stale = self.stale, False
+        self.process.stdin.write(f"{int(reload)} {' '.join(command[1:])}\n")
+        self.process.stdin.flush()
+        self.parameters = parameters
+        lines = []
+        for line in self.process.stdout:
+            if line.startswith("done "):
+                return int(line.split()[1]), "".join(lines)
+            lines.append(line)
+        raise RuntimeError(f"tile worker {self.process.args[0]} exited with status {self.process.wait()}")
+
+    def close(self):
+        self.process.stdin.close()
+        self.process.wait()
+
+class PersistentBackend(FileBackend):
+    """FileBackend that runs every programmed tile as one long-lived tile process.
+
+    The first instruction of a tile starts "<program> --serve", every later one is sent to that
+    process, which keeps its weights and biases in memory between commands instead of
+    re-reading them from main memory. Host writes and tile outputs to main memory mark the
+    workers whose resident parameters they overlap, those re-read them on their next command."""
+
+    def __init__(self, verbose=True):
+        super().__init__(verbose)
+        self.workers = {}
+        self.workersLock = threading.Lock()
+
+    def worker(self, command):
+        # a tile is named by its input stream, a reprogrammed tile gets a worker for its new program
+        key = (command[0], command[2])
+        with self.workersLock:
+            if key not in self.workers:
+                env = dict(os.environ, TILE_PROFILE="1") if self.profiling else None
+                self.workers[key] = TileWorker(command[0], env)
+            return self.workers[key]
+
+    def invalidate(self, mainMemoryFile, address=0, size=None):
+        """Mark the workers with parameters in [address, address + size) bytes of mainMemoryFile, all of it for size None."""
+        with self.workersLock:
+            for worker in self.workers.values():
+                if worker.parameters is None or worker.parameters[0] != mainMemoryFile:
+                    continue
+                if size is None or any(address < resident + residentSize and resident < address + size
+                                       for resident, residentSize in worker.parameters[1]):
+                    worker.stale = True
+
+    def setupMemory(self, memorySize, mainMemoryFile):
+        super().setupMemory(memorySize, mainMemoryFile)
+        self.invalidate(mainMemoryFile)
+
+    def loadMemory(self, snapshotFile, mainMemoryFile):
+        super().loadMemory(snapshotFile, mainMemoryFile)
+        self.invalidate(mainMemoryFile)
+
+    def writeMemory(self, mainMemoryFile, data, address, size):
+        self.invalidate(mainMemoryFile, address, 4 * size)
+        return super().writeMemory(mainMemoryFile, data, address, size)
+
+    def run(self, command):
+        mainMemoryFile, streamingSetting = command[1], splitTileCommand(command)[4]
+        parameters, _, (outputAddress, outputSize) = tileRanges(command)
+        worker = self.worker(command)
+        with worker.lock:
+            status, stdout = worker.run(command, (mainMemoryFile, [(address, 4 * size) for address, size in parameters]))
+        if status != 0:
+            print("Error:")
+            print(stdout)
+        elif self.verbose:
+            print("Output:")
+            print(stdout)
+        if streamingSetting % 10 == 0:
+            self.invalidate(mainMemoryFile, outputAddress, 4 * outputSize)
+        return profiler.parseTileProfile(stdout) if self.profiling else None
+
+    def close(self):
+        """Stop the tile workers, they exit once their stdin is closed."""
+        with self.workersLock:
+            workers, self.workers = list(self.workers.values()), {}
+        for worker in workers:
+            worker.close()
+
+class NumpyBackend:
+    """Runs the tile programs in-process with the NumPy kernels.
+
+    Main memory and streams are kept in memory under the file names parseISA uses, a stream
+    is a list of (srcTile, codes, scale) packets that is emptied when a tile reads it. With exact
+    the sums are accumulated in the order of the C loops so results match the binaries bit for bit.
+
+    After setBatch(n) every tile runs on n images at once. Ranges written with writeBatchMemory
+    or by a tile in MM/SM mode are per-sample: every sample has its own copy (one row of
+    sampleMemories), everything else (the weights) is shared by the whole batch. Stream packets
+    then carry a leading batch dimension.
+
+    Values are stored at the backend's precision (see pylib.precision): the float32 at device
+    address a is element a // 4 of a memory holding elementBytes per element, fp16 or int8 codes
+    for a reduced precision, and int8 keeps one scale per tensor written (per sample in a batch).
+    Snapshots and stream packets hold the same codes, reads dequantize them and the tiles
+    compute in float32. traffic counts the bytes stored to main memory and to streams."""
+
+    def __init__(self, exact=False, precision="fp32"):
+        self.exact = exact
+        self.precision = precision
+        self.elementBytes = reducedPrecision.elementBytes(precision)
+        self.dtype = reducedPrecision.STORAGE_DTYPES[precision]
+        self.memories = {}
+        self.scales = {}
+        self.streams = {}
+        # tiles scheduled concurrently may add per-sample ranges at the same time
+        self.sampleLock = threading.Lock()
+        self.traffic = {"memory": 0, "stream": 0}
+        self.trafficLock = threading.Lock()
+        self.profiling = False
+        self.setBatch(None)
+
+    def setBatch(self, batchSize):
+        """Run batchSize images per pass from now on (None for a single unbatched image)."""
+        self.batchSize = batchSize
+        # mainMemoryFile -> [(start, end, offset)] per-sample device ranges and their (batchSize, bytes) storage
+        self.sampleRegions = {}
+        self.sampleMemories = {}
+        self.sampleScales = {}
+
+    def storageAddress(self, address):
+        # element address // 4 at elementBytes each, the identity at fp32
+        if self.elementBytes == 4:
+            return address
+        if address % 4:
+            raise ValueError(f"address {address} is not float aligned, {self.precision} memory stores whole elements")
+        return address // 4 * self.elementBytes
+
+    def countTraffic(self, kind, bytes):
+        with self.trafficLock:
+            self.traffic[kind] += bytes
+        return bytes
+
+    def setupMemory(self, memorySize, mainMemoryFile):
+        self.memories[mainMemoryFile] = np.zeros(memorySize // 4 * self.elementBytes, dtype=np.uint8)
+        self.scales[mainMemoryFile] = reducedPrecision.ScaleMap()
+        self.sampleRegions.pop(mainMemoryFile, None)
+        self.sampleMemories.pop(mainMemoryFile, None)
+        self.sampleScales.pop(mainMemoryFile, None)
+
+    def setupStream(self, streamDepth, streamFile):
+        self.streams[streamFile] = []
+
+    def setupSharedStream(self, streamDepth, streamFiles):
+        # a fan-out already appends one packet array to every destination, no copies to share
+        for streamFile in streamFiles:
+            self.setupStream(streamDepth, streamFile)
+
+    def snapshotSuffix(self, mainMemoryFile):
+        # the weights of a snapshot are stored at the backend's precision
+        if self.precision != "fp32":
+            return "-" + self.precision + memManage.BINARY_SUFFIX
+        return memManage.BINARY_SUFFIX
+
+    def saveMemory(self, mainMemoryFile, snapshotFile):
+        # the int8 scales go next to the codes first, a snapshot that exists always has them
+        if self.precision == "int8":
+            regions = np.array([(start, end, scale) for start, end, scale in self.scales[mainMemoryFile].regions],
+                               dtype=np.float64).reshape(-1, 3)
+            temporaryFile = f"{snapshotFile}.{os.getpid()}.tmp.npy"
+            np.save(temporaryFile, regions)
+            os.replace(temporaryFile, snapshotFile + SCALES_SUFFIX)
+        temporaryFile = f"{snapshotFile}.{os.getpid()}.tmp"
+        self.memories[mainMemoryFile].tofile(temporaryFile)
+        os.replace(temporaryFile, snapshotFile)
+
+    def loadMemory(self, snapshotFile, mainMemoryFile):
+        # private mapping: pages are shared with the snapshot until a write copies them
+        self.memories[mainMemoryFile] = memManage.openMemory(snapshotFile, 'c')
+        regions = np.load(snapshotFile + SCALES_SUFFIX) if self.precision == "int8" else []
+        self.scales[mainMemoryFile] = reducedPrecision.ScaleMap(
+            (int(start), int(end), np.float32(scale)) for start, end, scale in regions)
+        self.sampleRegions.pop(mainMemoryFile, None)
+        self.sampleMemories.pop(mainMemoryFile, None)
+        self.sampleScales.pop(mainMemoryFile, None)
+
+    def moveStream(self, sourceFile, streamFile):
+        self.streams[streamFile].extend(self.streams[sourceFile])
+        self.streams[sourceFile].clear()
+
+    def removeStream(self, streamFile):
+        del self.streams[streamFile]
+
+    def close(self):
+        """Release the backend, everything it holds is plain NumPy arrays."""
+
+    def codes(self, mainMemoryFile, address, size):
+        """View of the stored codes of size elements of shared memory from device address on."""
+        start = self.storageAddress(address)
+        return self.memories[mainMemoryFile][start : start + size * self.elementBytes].view(self.dtype)
+
+    def sampleView(self, mainMemoryFile, address, size, create=False):
+        """(batchSize, size) view of the stored codes of a per-sample range, None if the range is shared."""
+        with self.sampleLock:
+            return self.lockedSampleView(mainMemoryFile, address, size, create)
+
+    def lockedSampleView(self, mainMemoryFile, address, size, create):
+        end = address + 4 * size
+        regions = self.sampleRegions.setdefault(mainMemoryFile, [])
+        overlapping = [region for region in regions if address < region[1] and region[0] < end]
+        for start, stop, offset in overlapping:
+            if start <= address and end <= stop:
+                break
+        else:
+            if not create and not overlapping:
+                return None
+            # ranges written piece by piece (a split layer) or straddled by a reused buffer are merged
+            # into one, elements no sample wrote yet start out as the shared memory (with its scales)
+            start = min([address] + [region[0] for region in overlapping])
+            stop = max([end] + [region[1] for region in overlapping])
+            storageStart, storageStop = self.storageAddress(start), self.storageAddress(stop)
+            sampleMemory = self.sampleMemories.get(mainMemoryFile, np.zeros((self.batchSize, 0), dtype=np.uint8))
+            offset = sampleMemory.shape[1]
+            sampleMemory = np.pad(sampleMemory, ((0, 0), (0, storageStop - storageStart)))
+            sampleMemory[:, offset:] = self.memories[mainMemoryFile][storageStart:storageStop]
+            sampleScales = self.sampleScales.setdefault(mainMemoryFile, reducedPrecision.ScaleMap())
+            kept = [piece for region in overlapping for piece in sampleScales.overlapping(region[0] // 4, region[1] // 4)]
+            for pieceStart, pieceEnd, scale in self.scales[mainMemoryFile].overlapping(start // 4, stop // 4):
+                sampleScales.set(pieceStart, pieceEnd, scale)
+            for pieceStart, pieceEnd, scale in kept:
+                sampleScales.set(pieceStart, pieceEnd, scale)
+            for region in overlapping:
+                regionStart, regionStop, regionOffset = region
+                length = self.storageAddress(regionStop - regionStart)
+                destination = offset + self.storageAddress(regionStart - start)
+                sampleMemory[:, destination : destination + length] = sampleMemory[:, regionOffset : regionOffset + length]
+                regions.remove(region)
+            regions.append((start, stop, offset))
+            self.sampleMemories[mainMemoryFile] = sampleMemory
+
+        offset += self.storageAddress(address - start)
+        return self.sampleMemories[mainMemoryFile][:, offset : offset + size * self.elementBytes].view(self.dtype)
+
+    def storeMemory(self, mainMemoryFile, data, address, size):
+        """Store a (size,) tensor in shared memory at the backend's precision, returns the bytes stored."""
+        codes, scale = reducedPrecision.quantize(data, self.precision)
+        self.codes(mainMemoryFile, address, size)[:] = codes
+        if scale is not None:
+            self.scales[mainMemoryFile].set(address // 4, address // 4 + size, scale)
+        return self.countTraffic("memory", reducedPrecision.storedBytes(codes, scale))
+
+    def storeSamples(self, mainMemoryFile, data, address, size):
+        """Store a (batchSize, size) tensor per sample, one int8 scale per sample, returns the bytes stored."""
+        codes, scale = reducedPrecision.quantize(data, self.precision, perSample=True)
+        self.sampleView(mainMemoryFile, address, size, create=True)[:] = codes
+        if scale is not None:
+            with self.sampleLock:
+                self.sampleScales[mainMemoryFile].set(address // 4, address // 4 + size, scale)
+        return self.countTraffic("memory", reducedPrecision.storedBytes(codes, scale))
+
+    def loadMemory32(self, mainMemoryFile, address, size):
+        """float32 values of a shared range, a view of the memory itself at fp32."""
+        codes = self.codes(mainMemoryFile, address, size)
+        if self.precision == "fp32":
+            return codes
+        return self.scales[mainMemoryFile].apply(codes.astype(np.float32), address // 4)
+
+    def loadSamples(self, mainMemoryFile, address, size):
+        """(batchSize, size) float32 values of a per-sample range, None if the range is shared."""
+        codes = self.sampleView(mainMemoryFile, address, size)
+        if codes is None or self.precision == "fp32":
+            return codes
+        with self.sampleLock:
+            return self.sampleScales[mainMemoryFile].apply(codes.astype(np.float32), address // 4)
+
+    def writeMemory(self, mainMemoryFile, data, address, size):
+        # a data object is one tensor, quantized as a whole
+        self.storeMemory(mainMemoryFile, np.asarray(data, dtype=np.float32).reshape(-1)[:size], address, size)
+        return address + 4 * size
+
+    def writeBatchMemory(self, mainMemoryFile, data, address, size):
+        """Copy one (size,) slice of data per sample, data has the batch as leading dimension."""
+        data = np.asarray(data, dtype=np.float32).reshape(self.batchSize, -1)[:, :size]
+        self.storeSamples(mainMemoryFile, data, address, size)
+        return address + 4 * size
+
+    def readMemory(self, mainMemoryFile, address, size):
+        if self.batchSize is not None:
+            samples = self.loadSamples(mainMemoryFile, address, size)
+            if samples is not None:
+                return samples.copy()
+        return self.loadMemory32(mainMemoryFile, address, size).copy()
+
+    def exportTextMemory(self, mainMemoryFile, textMemoryFile):
+        """Dump the shared memory as text in the float32 layout of the tile programs, dequantized."""
+        elements = self.memories[mainMemoryFile].size // self.elementBytes
+        memManage.exportTextMemory(self.loadMemory32(mainMemoryFile, 0, elements).view(np.uint8), textMemoryFile)
+
+    def storedBytes(self, mainMemoryFile, address, size):
+        """Bytes a shared range takes in memory, its codes and the int8 scales of the tensors in it."""
+        return self.codes(mainMemoryFile, address, size).nbytes + self.scales[mainMemoryFile].nbytes(address // 4,
+                                                                                                        address // 4 + size)
+
+    def memoryBytes(self, mainMemoryFile):
+        """Bytes main memory takes: the shared memory, the per-sample copies and all int8 scales."""
+        sampleMemory = self.sampleMemories.get(mainMemoryFile)
+        sampleScales = self.sampleScales.get(mainMemoryFile)
+        return (self.memories[mainMemoryFile].nbytes + self.scales[mainMemoryFile].nbytes()
+                + (0 if sampleMemory is None else sampleMemory.nbytes) + (0 if sampleScales is None else sampleScales.nbytes()))
+
+    def transferBytes(self, mainMemoryFile, size):
+        # one tensor (per sample in a batch), the codes plus an int8 scale
+        samples = self.batchSize or 1
+        return samples * (self.elementBytes * size + (4 if self.precision == "int8" else 0))
+
+    def packetValues(self, packets):
+        # float32 values of stream packets, concatenated along the last axis
+        if not packets:
+            return np.zeros((0,) if self.batchSize is None else (self.batchSize, 0), dtype=np.float32)
+        return np.concatenate([reducedPrecision.dequantize(codes, scale, self.precision) for _, codes, scale in packets],
+                              axis=-1)
+
+    def readStream(self, streamFile):
+        """Every value of a stream as float32 and the bytes read, the stream is emptied."""
+        packets = self.streams[streamFile]
+        data = self.packetValues(packets)
+        if data.shape[-1] > kernels.MAX_STREAM_ELEMENTS:
+            raise ValueError("Size read from file exceeds the maximum array size.")
+        bytes = sum(reducedPrecision.storedBytes(codes, scale) for _, codes, scale in packets)
+        # reset stream size to 0
+        packets.clear()
+        return data, bytes
+
+    def writeStreams(self, streamFiles, srcTile, data):
+        """Append data as one packet to every stream, quantized once, returns the bytes stored."""
+        batchShape = () if self.batchSize is None else (self.batchSize,)
+        data = np.asarray(data, dtype=np.float32).reshape(batchShape + (-1,))
+        codes, scale = reducedPrecision.quantize(data, self.precision, perSample=self.batchSize is not None)
+        for streamFile in streamFiles:
+            self.streams[streamFile].append((srcTile, codes, scale))
+        return self.countTraffic("stream", len(streamFiles) * reducedPrecision.storedBytes(codes, scale))
+
+    def streamPackets(self, streamFile, consume=False):
+        """Every packet of a stream as (srcTiles, values), values has the batch as leading dimension."""
+        packets = self.streams[streamFile]
+        srcTiles = np.concatenate([np.full(codes.shape[-1], srcTile, dtype=np.uint8) for srcTile, codes, _ in packets]
+                                  or [np.zeros(0, dtype=np.uint8)])
+        values = self.packetValues(packets)
+        if consume:
+            packets.clear()
+        return srcTiles, values
+
+    def appendStreams(self, streamFiles, srcTiles, values):
+        # one packet per run of values from the same tile
+        srcTiles = np.asarray(srcTiles, dtype=np.uint8).reshape(-1)
+        bounds = [0] + list(np.flatnonzero(np.diff(srcTiles)) + 1) + [srcTiles.size]
+        for start, end in zip(bounds, bounds[1:]):
+            if end > start:
+                self.writeStreams(streamFiles, int(srcTiles[start]), values[..., start:end])
+
+    def run(self, command):
+        program, mainMemoryFile, streamInput, streamDest, streamingSetting, arguments = splitTileCommand(command)
+        tileNumber = streams.streamTile(streamInput)
+
+        # streamingSetting
+        #  00 -> read write data from memory
+        #  01 -> read data from memory and write data to stream
+        #  10 -> read data from stream and write data to memory
+        #  11 -> read write data from stream
+        readStream = streamingSetting // 10
+        writeStream = streamingSetting % 10
+
+        # profiled phases as the tile binaries report them, weights are views so using them is compute
+        phases = []
+        start = time.monotonic()
+
+        def readInput(address, size):
+            readStart = time.monotonic()
+            if readStream == 0:
+                if self.batchSize is None:
+                    data = self.loadMemory32(mainMemoryFile, address, size)
+                else:
+                    data = self.loadSamples(mainMemoryFile, address, size)
+                    if data is None:
+                        # shared data read as a batch input, every sample sees the same values
+                        data = np.broadcast_to(self.loadMemory32(mainMemoryFile, address, size), (self.batchSize, size))
+                inputFile = mainMemoryFile
+                bytes = self.transferBytes(mainMemoryFile, size)
+            else:
+                data, bytes = self.readStream(streamInput)
+                if data.shape[-1] < size:
+                    raise ValueError(f"{streamInput} holds {data.shape[-1]} values, {program} needs {size}")
+                data = data[..., :size]
+                inputFile = streamInput
+            if self.profiling:
+                phases.append(profiler.Phase("read", inputFile, bytes, readStart, time.monotonic()))
+            return data
+
+        try:
+            if program == "convR8_32_5":
+                output, outputAddress = self.convolution(mainMemoryFile, readInput, *arguments)
+            elif program == "maxp2_2":
+                output, outputAddress = self.maxPooling(readInput, *arguments)
+            else:
+                output, outputAddress = self.fullyConnected(mainMemoryFile, readInput, *arguments)
+        except ValueError as error:
+            print("Error:")
+            print(f"{program}: {error}")
+            return phases if self.profiling else None
+        if self.profiling:
+            phases.append(profiler.Phase("compute", "-", 0, phases[-1].end if phases else start, time.monotonic()))
+
+        # output, stored at the backend's precision
+        writeStart = time.monotonic()
+        if writeStream == 0:
+            if self.batchSize is None:
+                bytes = self.storeMemory(mainMemoryFile, output.reshape(-1), outputAddress, output.size)
+            else:
+                output = output.reshape(self.batchSize, -1)
+                bytes = self.storeSamples(mainMemoryFile, output, outputAddress, output.shape[1])
+            if self.profiling:
+                phases.append(profiler.Phase("write", mainMemoryFile, bytes, writeStart, time.monotonic()))
+        else:
+            bytes = self.writeStreams(streamDest, tileNumber, output)
+            if self.profiling:
+                for streamFile in streamDest:
+                    phases.append(profiler.Phase("write", streamFile, bytes // len(streamDest), writeStart, time.monotonic()))
+        return phases if self.profiling else None
+
+    def convolution(self, mainMemoryFile, readInput, inputAddress, convWeightAddress, convBiasAddress, outputAddress,
+                    inputChannels, height, width, outputChannels):
+        limits = kernels.TILE_LIMITS["convR8_32_5"]
+        checkLimit(inputChannels, limits["inputChannels"], "inputChannels <= MAX_INPUT_CHANNELS")
+        checkLimit(height, limits["height"], "height <= MAX_IMAGE_HEIGHT")
+        checkLimit(width, limits["width"], "width <= MAX_IMAGE_WIDTH")
+        checkLimit(outputChannels, limits["outputChannels"], "outputChannels <= MAX_OUTPUT_CHANNELS")
+
+        filterSize = kernels.FILTER_SIZE
+        inputImage = readInput(inputAddress, inputChannels * height * width)
+        inputImage = inputImage.reshape(inputImage.shape[:-1] + (inputChannels, height, width))
+        convWeight = self.loadMemory32(mainMemoryFile, convWeightAddress, outputChannels * inputChannels * filterSize * filterSize)
+        convBias = self.loadMemory32(mainMemoryFile, convBiasAddress, outputChannels)
+        convWeight = convWeight.reshape(outputChannels, inputChannels, filterSize, filterSize)
+        return kernels.convolution(inputImage, convWeight, convBias, self.exact), outputAddress
+
+    def maxPooling(self, readInput, inputAddress, outputAddress, inputChannels, height, width, poolSize, stride):
+        limits = kernels.TILE_LIMITS["maxp2_2"]
+        checkLimit(inputChannels, limits["inputChannels"], "inputChannels <= MAX_INPUT_CHANNELS")
+        checkLimit(height, limits["height"], "height <= MAX_IMAGE_HEIGHT")
+        checkLimit(width, limits["width"], "width <= MAX_IMAGE_WIDTH")
+
+        inputImage = readInput(inputAddress, inputChannels * height * width)
+        inputImage = inputImage.reshape(inputImage.shape[:-1] + (inputChannels, height, width))
+        return kernels.maxPooling(inputImage, poolSize, stride), outputAddress
+
+    def fullyConnected(self, mainMemoryFile, readInput, inputAddress, fcWeightAddress, fcBiasAddress, outputAddress,
+                       inputChannels, outputChannels):
+        limits = kernels.TILE_LIMITS["fc128_64"]
+        checkLimit(inputChannels, limits["inputChannels"], "inputChannels <= MAX_INPUT_CHANNELS")
+        checkLimit(outputChannels, limits["outputChannels"], "outputChannels <= MAX_OUTPUT_CHANNELS")
+
+        inputData = readInput(inputAddress, inputChannels)
+        fcWeight = self.loadMemory32(mainMemoryFile, fcWeightAddress, outputChannels * inputChannels).reshape(outputChannels, inputChannels)
+        fcBias = self.loadMemory32(mainMemoryFile, fcBiasAddress, outputChannels)
+        return kernels.fullyConnected(inputData, fcWeight, fcBias, self.exact), outputAddress
+
+BACKENDS = {"subprocess": FileBackend, "persistent": PersistentBackend, "numpy": NumpyBackend}
+
+def makeBackend(name, verbose=True, exact=False, precision="fp32"):
+    """The backend called name in BACKENDS, exact and precision apply to numpy, verbose to the tile program backends."""
+    if name == "numpy":
+        return NumpyBackend(exact, precision)
+    if precision != "fp32":
+        raise ValueError(f"the {name} backend runs the float32 tile programs, precision {precision} needs the numpy backend")
+    return BACKENDS[name](verbose)
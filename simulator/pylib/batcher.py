@@ -0,0 +1,159 @@
+import collections
+import queue
+import threading
+import time
+from concurrent.futures import Future
+import numpy as np
+
+# latencies kept for the percentiles, the most recent requests
+LATENCY_WINDOW = 10000
+
+class Request:
+    def __init__(self, image):
+        self.image = image
+        self.future = Future()
+        self.arrival = time.perf_counter()
+        self.batchSize = 0
+        self.queueTime = 0.0
+
+class DynamicBatcher:
+    """Groups concurrently submitted single images into batches for one run function.
+
+    A batch starts with the oldest waiting request and takes whatever else arrives until it holds
+    maxBatchSize images or maxWait seconds passed since that request arrived, then
+    runFunction((N, ...) images) runs on the batcher thread and its N output rows resolve the
+    requests' futures. Only one batch runs at a time, the device memory and streams are
+    those of a single program. stats() reports latency percentiles (queueing plus run), the
+    histogram of batch sizes and the depth of the queue."""
+
+    def __init__(self, runFunction, maxBatchSize=32, maxWait=0.005):
+        self.runFunction = runFunction
+        self.maxBatchSize = max(1, maxBatchSize)
+        self.maxWait = maxWait
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.latencies = collections.deque(maxlen=LATENCY_WINDOW)
+        self.queueTimes = collections.deque(maxlen=LATENCY_WINDOW)
+        self.batchSizes = collections.Counter()
+        self.depthSamples = collections.deque(maxlen=LATENCY_WINDOW)
+        self.requests = 0
+        self.failures = 0
+        self.runTime = 0.0
+        # the span from the first request to the last batch, throughput leaves out the idle time before
+        self.firstArrival = None
+        self.lastDone = None
+        self.stopping = threading.Event()
+        # held while submit checks stopping and queues, and while close drains, so no request is queued unseen
+        self.submitLock = threading.Lock()
+        self.thread = threading.Thread(target=self.serve, name="dynamic-batcher", daemon=True)
+        self.thread.start()
+
+    def submit(self, image):
+        """Queue one image, its Request's future resolves to its output row (batchSize and queueTime are set by then)."""
+        request = Request(image)
+        with self.submitLock:
+            if self.stopping.is_set():
+                raise RuntimeError("the batcher is closed")
+            self.queue.put(request)
+        return request
+
+    def nextBatch(self):
+        # blocks for the first request, then fills the batch until it is full or the oldest request waited maxWait
+        while not self.stopping.is_set():
+            try:
+                batch = [self.queue.get(timeout=0.1)]
+                break
+            except queue.Empty:
+                continue
+        else:
+            return []
+        deadline = batch[0].arrival + self.maxWait
+        while len(batch) < self.maxBatchSize:
+            remaining = deadline - time.perf_counter()
+            try:
+                batch.append(self.queue.get(timeout=remaining) if remaining > 0 else self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def serve(self):
+        while True:
+            batch = self.nextBatch()
+            if not batch:
+                return
+            depth = self.queue.qsize()
+            start = time.perf_counter()
+            try:
+                outputs = self.runFunction(np.stack([request.image for request in batch]))
+                if len(outputs) != len(batch):
+                    raise RuntimeError(f"the run function returned {len(outputs)} outputs for a batch of {len(batch)}")
+            except Exception as error:
+                with self.lock:
+                    self.failures += len(batch)
+                for request in batch:
+                    request.future.set_exception(error)
+                continue
+            end = time.perf_counter()
+            with self.lock:
+                self.requests += len(batch)
+                self.batchSizes[len(batch)] += 1
+                self.depthSamples.append(depth)
+                self.runTime += end - start
+                self.firstArrival = batch[0].arrival if self.firstArrival is None else self.firstArrival
+                self.lastDone = end
+                for request in batch:
+                    self.latencies.append(end - request.arrival)
+                    self.queueTimes.append(start - request.arrival)
+            for request, output in zip(batch, outputs):
+                request.batchSize = len(batch)
+                request.queueTime = start - request.arrival
+                request.future.set_result(output)
+
+    def close(self):
+        """Stop the batcher thread after the batch it is running, requests still queued fail."""
+        with self.submitLock:
+            self.stopping.set()
+        self.thread.join()
+        while True:
+            try:
+                request = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            request.future.set_exception(RuntimeError("the batcher is closed"))
+
+    def stats(self):
+        with self.lock:
+            latencies = np.array(self.latencies) * 1e3
+            queueTimes = np.array(self.queueTimes) * 1e3
+            batchSizes = dict(sorted(self.batchSizes.items()))
+            depths = list(self.depthSamples) or [0]
+            requests, failures, runTime = self.requests, self.failures, self.runTime
+            wallTime = self.lastDone - self.firstArrival if self.firstArrival is not None else 0.0
+        batches = sum(batchSizes.values())
+
+        def percentiles(values):
+            if not len(values):
+                return {"p50": 0.0, "p90": 0.0, "p99": 0.0, "max": 0.0}
+            p50, p90, p99 = np.percentile(values, [50, 90, 99])
+            return {"p50": float(p50), "p90": float(p90), "p99": float(p99), "max": float(values.max())}
+
+        return {"requests": requests, "failures": failures, "batches": batches,
+                "maxBatchSize": self.maxBatchSize, "maxWaitMs": self.maxWait * 1e3,
+                "meanBatchSize": requests / batches if batches else 0.0,
+                "batchSizes": {str(size): count for size, count in batchSizes.items()},
+                "latencyMs": percentiles(latencies), "queueMs": percentiles(queueTimes),
+                "queueDepth": self.queue.qsize(), "meanQueueDepth": sum(depths) / len(depths),
+                "maxQueueDepth": max(depths), "busy": runTime / wallTime if wallTime > 0 else 0.0,
+                "imagesPerSecond": requests / wallTime if wallTime > 0 else 0.0}
+
+    def printStats(self):
+        stats = self.stats()
+        latency = stats["latencyMs"]
+        print(f"batcher: {stats['requests']} requests in {stats['batches']} batches (mean size "
+              f"{stats['meanBatchSize']:.1f} of {stats['maxBatchSize']}), {stats['failures']} failed, "
+              f"{stats['imagesPerSecond']:.1f} images/s, device busy {stats['busy'] * 100:.1f}%")
+        print(f"batcher: latency p50 {latency['p50']:.2f}ms p90 {latency['p90']:.2f}ms p99 {latency['p99']:.2f}ms "
+              f"max {latency['max']:.2f}ms, queued p50 {stats['queueMs']['p50']:.2f}ms")
+        print(f"batcher: queue depth now {stats['queueDepth']}, mean {stats['meanQueueDepth']:.1f} "
+              f"max {stats['maxQueueDepth']} when a batch started")
+        print("batch sizes:", ", ".join(f"{size}x{count}" for size, count in stats["batchSizes"].items()) or "none")
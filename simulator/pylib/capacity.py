@@ -0,0 +1,71 @@
+import threading
+
+from pylib import backends
+from pylib import isa
+from pylib import profiler
+from pylib import streams
+
+class CapacityMonitor(profiler.BackendWrapper):
+    """Wraps a backend and records the high-water marks of main memory and of every stream.
+
+    Main memory's mark is the end of the highest range a host copy or a tile touched, a stream's
+    the most packets it held after a tile or a scheduler gather appended to it (staging streams
+    count for the stream they are gathered into). printReport compares them with what
+    isa.streamCapacities and isa.memoryHighWater planned from the program."""
+
+    def __init__(self, backend):
+        super().__init__(backend)
+        self.lock = threading.Lock()
+        self.memoryHighWater = 0
+        self.streamHighWater = {}
+
+    def touchMemory(self, address, size):
+        with self.lock:
+            self.memoryHighWater = max(self.memoryHighWater, address + 4 * size)
+
+    def measureStream(self, streamFile):
+        values = len(self.backend.streamPackets(streamFile)[0])
+        tile = streams.streamTile(streamFile)
+        with self.lock:
+            self.streamHighWater[tile] = max(self.streamHighWater.get(tile, 0), values)
+
+    def writeMemory(self, mainMemoryFile, data, address, size):
+        self.touchMemory(address, size)
+        return self.backend.writeMemory(mainMemoryFile, data, address, size)
+
+    def writeBatchMemory(self, mainMemoryFile, data, address, size):
+        self.touchMemory(address, size)
+        return self.backend.writeBatchMemory(mainMemoryFile, data, address, size)
+
+    def readMemory(self, mainMemoryFile, address, size):
+        self.touchMemory(address, size)
+        return self.backend.readMemory(mainMemoryFile, address, size)
+
+    def moveStream(self, sourceFile, streamFile):
+        result = self.backend.moveStream(sourceFile, streamFile)
+        self.measureStream(streamFile)
+        return result
+
+    def run(self, command):
+        result = self.backend.run(command)
+        _, _, streamInput, streamDest, streamingSetting, _ = backends.splitTileCommand(command)
+        parameters, (inputAddress, inputSize), (outputAddress, outputSize) = backends.tileRanges(command)
+        ranges = parameters + ([] if streamingSetting // 10 else [(inputAddress, inputSize)])
+        if streamingSetting % 10:
+            for streamFile in streamDest:
+                self.measureStream(streamFile)
+        else:
+            ranges.append((outputAddress, outputSize))
+        for address, size in ranges:
+            self.touchMemory(address, size)
+        return result
+
+    def printReport(self, program, memorySize, streamDepth):
+        """Measured high-water marks against the plan, memorySize and streamDepth are the limits it was planned within."""
+        planned = isa.memoryHighWater(program)
+        print(f"main memory: {self.memoryHighWater} bytes high-water, {planned} planned ({memorySize} at most)"
+              + (" OVER THE PLAN" if self.memoryHighWater > planned else ""))
+        for tile, planned in sorted(isa.streamCapacities(program).items()):
+            used = self.streamHighWater.get(tile, 0)
+            print(f"stream{tile}: {used} values high-water, {planned} planned ({streamDepth // 4} at most)"
+                  + (" OVER THE PLAN" if used > planned else ""))
@@ -0,0 +1,135 @@
+import queue
+import threading
+import time
+
+from pylib import readbins
+
+# images read and preprocessed per step of the feeder thread, one vectorized get_images call
+READ_CHUNK = 256
+
+class ImageFeeder:
+    """Reads and preprocesses images on a background thread ahead of the run, through a bounded queue.
+
+    Images first..first + numImages of a memory-mapped images array (parse_mnist_images or a
+    preprocessed set) are read in chunks of chunkSize, preprocessed with readbins.get_images and
+    queued as batches of batchSize, at most depth batches ahead of the consumer. Memory stays at
+    depth batches plus one chunk whatever the dataset size. Iterating yields (indices, batch) in
+    order, stats() reports the queue depth, the time the consumer stalled on an empty queue and
+    the sustained images per second. With depth 0 there is no thread, every batch is read when
+    the consumer asks for it and the whole read counts as stalled."""
+
+    def __init__(self, images, numImages, batchSize=1, depth=4, first=0, chunkSize=None):
+        self.images = images
+        self.numImages = numImages
+        self.batchSize = batchSize
+        self.depth = depth
+        self.first = first
+        # whole batches per chunk, so a batch never spans two reads
+        chunkSize = chunkSize or max(batchSize, READ_CHUNK)
+        self.chunkSize = max(batchSize, chunkSize // batchSize * batchSize)
+        self.queue = queue.Queue(maxsize=depth)
+        self.stopping = threading.Event()
+        self.thread = None
+        self.readTime = 0.0
+        self.blockedTime = 0.0
+        self.stallTime = 0.0
+        self.depthSamples = []
+        self.batches = 0
+        self.consumed = 0
+        self.start = None
+        self.end = None
+
+    def readBatches(self):
+        last = self.first + self.numImages
+        for chunkFirst in range(self.first, last, self.chunkSize):
+            start = time.perf_counter()
+            chunkIndices = range(chunkFirst, min(chunkFirst + self.chunkSize, last))
+            chunk = readbins.get_images(self.images, chunkIndices)
+            self.readTime += time.perf_counter() - start
+            for offset in range(0, len(chunkIndices), self.batchSize):
+                yield chunkIndices[offset : offset + self.batchSize], chunk[offset : offset + self.batchSize]
+
+    def produce(self):
+        try:
+            for item in self.readBatches():
+                if not self.put(item):
+                    return
+            self.put(None)
+        except Exception as error:
+            self.put(error)
+
+    def put(self, item):
+        # blocks while the queue is full (the run is the bottleneck), gives up once the consumer stopped
+        start = time.perf_counter()
+        while not self.stopping.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                self.blockedTime += time.perf_counter() - start
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def __iter__(self):
+        if self.depth == 0:
+            yield from self.iterateSynchronously()
+            return
+        self.thread = threading.Thread(target=self.produce, name="image-feeder", daemon=True)
+        self.thread.start()
+        self.start = time.perf_counter()
+        try:
+            while True:
+                self.depthSamples.append(self.queue.qsize())
+                waitStart = time.perf_counter()
+                item = self.queue.get()
+                self.stallTime += time.perf_counter() - waitStart
+                if item is None:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                self.batches += 1
+                self.consumed += len(item[0])
+                yield item
+        finally:
+            self.end = time.perf_counter()
+            self.close()
+
+    def iterateSynchronously(self):
+        self.start = time.perf_counter()
+        batches = self.readBatches()
+        try:
+            while True:
+                self.depthSamples.append(0)
+                waitStart = time.perf_counter()
+                item = next(batches, None)
+                self.stallTime += time.perf_counter() - waitStart
+                if item is None:
+                    break
+                self.batches += 1
+                self.consumed += len(item[0])
+                yield item
+        finally:
+            self.end = time.perf_counter()
+
+    def close(self):
+        """Stop the feeder thread, also when the consumer stopped early."""
+        self.stopping.set()
+        if self.thread is not None:
+            self.thread.join()
+
+    def stats(self):
+        wallTime = (self.end or time.perf_counter()) - self.start if self.start is not None else 0.0
+        depths = self.depthSamples or [0]
+        return {"images": self.consumed, "batches": self.batches, "depth": self.depth,
+                "meanDepth": sum(depths) / len(depths), "maxDepth": max(depths), "wallTime": wallTime,
+                "stallTime": self.stallTime, "readTime": self.readTime, "blockedTime": self.blockedTime,
+                "imagesPerSecond": self.consumed / wallTime if wallTime > 0 else 0.0}
+
+    def printStats(self):
+        stats = self.stats()
+        stallShare = stats["stallTime"] / stats["wallTime"] * 100 if stats["wallTime"] > 0 else 0.0
+        print(f"feeder: {stats['images']} images in {stats['batches']} batches, queue depth mean "
+              f"{stats['meanDepth']:.1f} max {stats['maxDepth']} of {stats['depth']}")
+        print(f"feeder: stalled {stats['stallTime']:.3f}s ({stallShare:.1f}% of {stats['wallTime']:.3f}s), "
+              f"read/preprocess {stats['readTime']:.3f}s, blocked on a full queue {stats['blockedTime']:.3f}s, "
+              f"{stats['imagesPerSecond']:.1f} images/s sustained")
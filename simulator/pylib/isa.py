@@ -0,0 +1,410 @@
+import hashlib
+import pickle
+import sys
+from collections import namedtuple
+
+from pylib import kernels
+from pylib import memManage
+
+# stream setting mnemonic -> setting argument of the tile programs (read from / write to Memory or Stream)
+STREAM_SETTINGS = {"MM": "00", "MS": "01", "SM": "10", "SS": "11"}
+
+NUM_TILES = 16
+MAIN_MEMORY_SIZE = 4 * 1024 * 1024
+
+# bump when the instruction classes or the checks change so stale cache files are recompiled
+CACHE_VERSION = 2
+
+class ISAError(ValueError):
+    """An ISA program that does not compile, the message starts with file:line."""
+
+def streamPath(memoryDir, tile, memoryFormat="text"):
+    # streams follow the main memory format, binary memory runs on binary ring streams
+    if memoryFormat == "binary":
+        return memoryDir + "stream" + str(tile) + memManage.BINARY_SUFFIX
+    return memoryDir + "stream" + str(tile)
+
+class ProgramTile(namedtuple("ProgramTile", "tile kernel")):
+    opcode = "program"
+
+class Memcpy2Device(namedtuple("Memcpy2Device", "name address size")):
+    opcode = "memcpy2device"
+
+class Memcpy2Host(namedtuple("Memcpy2Host", "name address size")):
+    opcode = "memcpy2host"
+
+class TileInstruction:
+    """Fields shared by the tile instructions: tile, destTiles, streamSetting, then the kernel arguments."""
+
+    @property
+    def readsStream(self):
+        return self.streamSetting[0] == "S"
+
+    @property
+    def writesStream(self):
+        return self.streamSetting[1] == "S"
+
+    def arguments(self):
+        return self[3:]
+
+    def memoryReads(self):
+        """(address, size in floats) ranges read from main memory."""
+        reads = list(self.parameterRanges())
+        if not self.readsStream:
+            reads.append((self.inputAddress, self.inputSize))
+        return reads
+
+    def memoryWrites(self):
+        return [] if self.writesStream else [(self.outputAddress, self.outputSize)]
+
+    def commandLine(self, binDir, mainMemoryFile, memoryDir):
+        memoryFormat = "binary" if memManage.isBinaryMemory(mainMemoryFile) else "text"
+        command = [binDir + self.opcode, mainMemoryFile, streamPath(memoryDir, self.tile, memoryFormat)]
+        command += [streamPath(memoryDir, tile, memoryFormat) for tile in self.destTiles]
+        command.append(STREAM_SETTINGS[self.streamSetting])
+        command += [str(value) for value in self.arguments()]
+        return command
+
+    def checkLimits(self):
+        for field, limit in kernels.TILE_LIMITS[self.opcode].items():
+            if getattr(self, field) > limit:
+                raise ValueError(f"{field} {getattr(self, field)} exceeds the {self.opcode} limit of {limit}")
+
+class Conv(TileInstruction, namedtuple("Conv", "tile destTiles streamSetting inputAddress weightAddress biasAddress "
+                                               "outputAddress inputChannels height width outputChannels")):
+    opcode = "convR8_32_5"
+
+    @property
+    def inputSize(self):
+        return self.inputChannels * self.height * self.width
+
+    @property
+    def outputShape(self):
+        return (self.outputChannels, self.height - kernels.FILTER_SIZE + 1, self.width - kernels.FILTER_SIZE + 1)
+
+    @property
+    def outputSize(self):
+        channels, height, width = self.outputShape
+        return channels * height * width
+
+    def parameterRanges(self):
+        weightSize = self.outputChannels * self.inputChannels * kernels.FILTER_SIZE * kernels.FILTER_SIZE
+        return [(self.weightAddress, weightSize), (self.biasAddress, self.outputChannels)]
+
+class MaxPool(TileInstruction, namedtuple("MaxPool", "tile destTiles streamSetting inputAddress outputAddress "
+                                                     "inputChannels height width poolSize stride")):
+    opcode = "maxp2_2"
+
+    @property
+    def inputSize(self):
+        return self.inputChannels * self.height * self.width
+
+    @property
+    def outputShape(self):
+        return (self.inputChannels, (self.height - self.poolSize) // self.stride + 1,
+                (self.width - self.poolSize) // self.stride + 1)
+
+    @property
+    def outputSize(self):
+        channels, height, width = self.outputShape
+        return channels * height * width
+
+    def parameterRanges(self):
+        return []
+
+class FullyConnected(TileInstruction, namedtuple("FullyConnected", "tile destTiles streamSetting inputAddress weightAddress "
+                                                                   "biasAddress outputAddress inputChannels outputChannels")):
+    opcode = "fc128_64"
+
+    @property
+    def inputSize(self):
+        return self.inputChannels
+
+    @property
+    def outputShape(self):
+        return (self.outputChannels,)
+
+    @property
+    def outputSize(self):
+        return self.outputChannels
+
+    def parameterRanges(self):
+        return [(self.weightAddress, self.outputChannels * self.inputChannels), (self.biasAddress, self.outputChannels)]
+
+OPCODES = {instruction.opcode: instruction for instruction in (ProgramTile, Memcpy2Device, Memcpy2Host, Conv, MaxPool, FullyConnected)}
+TILE_INSTRUCTIONS = (Conv, MaxPool, FullyConnected)
+
+def parseField(field, token):
+    if field == "destTiles":
+        return tuple(int(tile) for tile in token.split("-"))
+    if field == "streamSetting":
+        if token not in STREAM_SETTINGS:
+            raise ValueError(f"invalid stream configuration {token}, expected one of {', '.join(STREAM_SETTINGS)}")
+        return token
+    if field in ("kernel", "name"):
+        return token
+    return int(token)
+
+def checkRange(address, size, memorySize, what):
+    if size <= 0:
+        raise ValueError(f"{what} has size {size}")
+    if address < 0 or address + 4 * size > memorySize:
+        raise ValueError(f"{what} {address}..{address + 4 * size} is outside main memory (0..{memorySize})")
+
+def checkTile(tile):
+    if not 0 <= tile < NUM_TILES:
+        raise ValueError(f"tile {tile} does not exist (0..{NUM_TILES - 1})")
+
+def checkInstruction(instruction, programmedTiles, memorySize):
+    """Validate one instruction against the tiles programmed so far, raises ValueError."""
+    if isinstance(instruction, ProgramTile):
+        checkTile(instruction.tile)
+        if instruction.kernel not in kernels.TILE_LIMITS:
+            raise ValueError(f"unknown tile program {instruction.kernel}")
+        programmedTiles[instruction.tile] = instruction.kernel
+    elif isinstance(instruction, (Memcpy2Device, Memcpy2Host)):
+        checkRange(instruction.address, instruction.size, memorySize, instruction.name)
+    else:
+        checkTile(instruction.tile)
+        if programmedTiles[instruction.tile] != instruction.opcode:
+            raise ValueError(f"tile {instruction.tile} is programmed with {programmedTiles[instruction.tile]}, "
+                             f"not {instruction.opcode}")
+        for tile in instruction.destTiles:
+            checkTile(tile)
+            if instruction.writesStream and programmedTiles[tile] is None:
+                raise ValueError(f"destination tile {tile} is not programmed")
+        instruction.checkLimits()
+        for address, size in instruction.memoryReads():
+            checkRange(address, size, memorySize, "input")
+        for address, size in instruction.memoryWrites():
+            checkRange(address, size, memorySize, "output")
+
+# compiled ISA file, instructions[i] comes from line lineNumbers[i] of source
+Program = namedtuple("Program", "instructions lineNumbers source")
+
+def compileISA(text, memorySize=MAIN_MEMORY_SIZE, source="<isa>"):
+    """Decode and validate ISA text into a Program, raises ISAError at the first bad line."""
+    instructions = []
+    lineNumbers = []
+    programmedTiles = [None] * NUM_TILES
+    for lineNumber, line in enumerate(text.splitlines(), 1):
+        tokens = line.split()
+        # skip empty lines and comments
+        if not tokens or tokens[0].startswith('#'):
+            continue
+
+        location = f"{source}:{lineNumber}"
+        instructionType = OPCODES.get(tokens[0])
+        if instructionType is None:
+            raise ISAError(f"{location}: invalid instruction {tokens[0]}")
+        fields = instructionType._fields
+        if len(tokens) - 1 != len(fields):
+            raise ISAError(f"{location}: {tokens[0]} takes {len(fields)} arguments ({' '.join(fields)}), "
+                           f"got {len(tokens) - 1}")
+        try:
+            instruction = instructionType(*(parseField(field, token) for field, token in zip(fields, tokens[1:])))
+            checkInstruction(instruction, programmedTiles, memorySize)
+        except ValueError as error:
+            raise ISAError(f"{location}: {error}") from None
+
+        instructions.append(instruction)
+        lineNumbers.append(lineNumber)
+
+    # a stream that would hold more than a tile reads in one go fails before anything runs
+    for index, tile, values in streamLevels(instructions):
+        if values > kernels.MAX_STREAM_ELEMENTS:
+            raise ISAError(f"{source}:{lineNumbers[index]}: stream{tile} would hold {values} values, "
+                           f"a tile reads at most {kernels.MAX_STREAM_ELEMENTS}")
+    return Program(tuple(instructions), tuple(lineNumbers), source)
+
+def streamLevels(instructions):
+    """(index, tile, values) after every write to a stream: what is waiting in it at that point.
+
+    A tile reading its stream empties it and programming a tile sets its stream up again."""
+    live = {}
+    for index, instruction in enumerate(instructions):
+        if isinstance(instruction, ProgramTile):
+            live.pop(instruction.tile, None)
+        elif isinstance(instruction, TileInstruction):
+            if instruction.readsStream:
+                live.pop(instruction.tile, None)
+            if instruction.writesStream:
+                for tile in instruction.destTiles:
+                    live[tile] = live.get(tile, 0) + instruction.outputSize
+                    yield index, tile, live[tile]
+
+def streamCapacities(program):
+    """Values each tile's stream must hold, its peak over one run of program (0 for streams never written)."""
+    capacities = {instruction.tile: 0 for instruction in program.instructions if isinstance(instruction, ProgramTile)}
+    for _, tile, values in streamLevels(program.instructions):
+        capacities[tile] = max(capacities.get(tile, 0), values)
+    return capacities
+
+def memoryHighWater(program):
+    """Bytes of main memory program uses, the end of the highest range it copies, reads or writes."""
+    ends = [0]
+    for instruction in program.instructions:
+        if isinstance(instruction, (Memcpy2Device, Memcpy2Host)):
+            ends.append(instruction.address + 4 * instruction.size)
+        elif isinstance(instruction, TileInstruction):
+            ends += [address + 4 * size for address, size in instruction.memoryReads() + instruction.memoryWrites()]
+    return max(ends)
+
+def sharedStreams(program):
+    """Fan-outs whose destination streams can be one multicast stream: tile -> destination tiles.
+
+    A group shares a stream when its tiles are programmed once and the fan-out instruction is the
+    only writer of their streams, so every packet in the shared stream is meant for all of them."""
+    programs = {}
+    writers = {}
+    for index, instruction in enumerate(program.instructions):
+        if isinstance(instruction, ProgramTile):
+            programs[instruction.tile] = programs.get(instruction.tile, 0) + 1
+        elif isinstance(instruction, TileInstruction) and instruction.writesStream:
+            for tile in instruction.destTiles:
+                writers.setdefault(tile, set()).add(index)
+    groups = {}
+    for index, instruction in enumerate(program.instructions):
+        if isinstance(instruction, TileInstruction) and instruction.writesStream and len(instruction.destTiles) > 1:
+            group = tuple(instruction.destTiles)
+            if len(set(group)) == len(group) and all(writers[tile] == {index} and programs.get(tile) == 1
+                                                     for tile in group):
+                groups.update((tile, group) for tile in group)
+    return groups
+
+def loadProgram(source_file_path, memorySize=MAIN_MEMORY_SIZE, cache=True):
+    """Compile an ISA file, reusing the pickled program next to it while the source hash matches."""
+    with open(source_file_path, 'rb') as file:
+        text = file.read()
+    key = (CACHE_VERSION, hashlib.sha256(text).hexdigest(), memorySize)
+    cacheFile = source_file_path + ".cache"
+
+    if cache:
+        try:
+            with open(cacheFile, 'rb') as file:
+                cachedKey, program = pickle.load(file)
+            if cachedKey == key:
+                return program
+        except (OSError, EOFError, pickle.UnpicklingError, ValueError, AttributeError):
+            pass
+
+    program = compileISA(text.decode(), memorySize, source_file_path)
+    if cache:
+        try:
+            with open(cacheFile, 'wb') as file:
+                pickle.dump((key, program), file)
+        except OSError:
+            pass
+    return program
+
+class Executor:
+    """Runs compiled programs on a backend, each instruction type goes through the dispatch table."""
+
+    def __init__(self, backend, binDir, memoryDir, streamDepth, dataObjects, memoryFormat="text",
+                 batchObjects=(), residentObjects=None, scheduler=None):
+        self.backend = backend
+        self.binDir = binDir
+        self.memoryDir = memoryDir
+        self.streamDepth = streamDepth
+        self.dataObjects = dataObjects
+        self.memoryFormat = memoryFormat
+        self.mainMemoryFile = memManage.mainMemoryPath(memoryDir, memoryFormat)
+        # batch objects are copied once per sample, resident objects (weights of an earlier pass) not at all
+        self.batchObjects = batchObjects
+        self.residentObjects = residentObjects
+        self.scheduler = scheduler
+        self.outdata = {}
+        # binary streams of a fan-out are one multicast stream, set up by the first program of the group
+        self.sharedStreams = {}
+        self.sharedSetup = set()
+        self.streamCapacities = {}
+
+    def run(self, program):
+        # every stream is set up for the values the program puts in it, none may need more than streamDepth
+        self.streamCapacities = streamCapacities(program)
+        for tile, values in sorted(self.streamCapacities.items()):
+            if 4 * values > self.streamDepth:
+                raise ISAError(f"{program.source}: stream{tile} needs {values} values, "
+                               f"streams hold {self.streamDepth // 4}")
+        if self.memoryFormat == "binary":
+            self.sharedStreams = sharedStreams(program)
+        for instruction in program.instructions:
+            self.dispatch[type(instruction)](self, instruction)
+        if self.scheduler is not None:
+            self.scheduler.run()
+        return self.outdata
+
+    def issue(self, name, action, **accesses):
+        # run right away, or queue for the dataflow scheduler with the memory/streams it touches
+        if self.scheduler is None:
+            action()
+        else:
+            self.scheduler.add(name, action, **accesses)
+
+    def programTile(self, instruction):
+        group = self.sharedStreams.get(instruction.tile)
+        if group is not None:
+            if group in self.sharedSetup:
+                return
+            self.sharedSetup.add(group)
+            streamFiles = [streamPath(self.memoryDir, tile, self.memoryFormat) for tile in group]
+            streamDepth = max(self.streamBytes(tile) for tile in group)
+            self.issue(f"program {instruction.tile} {instruction.kernel}",
+                       lambda: self.backend.setupSharedStream(streamDepth, streamFiles), streamReads=streamFiles)
+            return
+        streamFile = streamPath(self.memoryDir, instruction.tile, self.memoryFormat)
+        streamDepth = self.streamBytes(instruction.tile)
+        self.issue(f"program {instruction.tile} {instruction.kernel}",
+                   lambda: self.backend.setupStream(streamDepth, streamFile), streamReads=[streamFile])
+
+    def streamBytes(self, tile):
+        # 4 bytes per value like streamDepth, a stream nothing writes still holds one
+        return 4 * max(self.streamCapacities.get(tile, 0), 1)
+
+    def memcpy2device(self, instruction):
+        name, address, size = instruction
+        if name in self.batchObjects:
+            write = self.backend.writeBatchMemory
+        else:
+            write = self.backend.writeMemory
+            if self.residentObjects is not None:
+                if name in self.residentObjects:
+                    return
+                self.residentObjects.add(name)
+        data = self.dataObjects[name]
+        self.issue(f"memcpy2device {name}", lambda: write(self.mainMemoryFile, data, address, size),
+                   memoryWrites=[(address, 4 * size)])
+
+    def memcpy2host(self, instruction):
+        name, address, size = instruction
+
+        def copy():
+            self.outdata[name] = self.backend.readMemory(self.mainMemoryFile, address, size)
+
+        self.issue(f"memcpy2host {name}", copy, memoryReads=[(address, 4 * size)])
+
+    def tile(self, instruction):
+        command = instruction.commandLine(self.binDir, self.mainMemoryFile, self.memoryDir)
+        if self.scheduler is None:
+            self.backend.run(command)
+        else:
+            self.scheduler.addTile(f"{instruction.opcode} {instruction.tile}", command)
+
+    dispatch = {
+        ProgramTile: programTile,
+        Memcpy2Device: memcpy2device,
+        Memcpy2Host: memcpy2host,
+        Conv: tile,
+        MaxPool: tile,
+        FullyConnected: tile,
+    }
+
+if __name__ == "__main__":
+    # python -m pylib.isa program.ISA: check a program and list its decoded instructions
+    try:
+        program = compileISA(open(sys.argv[1]).read(), source=sys.argv[1])
+    except ISAError as error:
+        print("Error:", error)
+        sys.exit(1)
+    for lineNumber, instruction in zip(program.lineNumbers, program.instructions):
+        print(f"{lineNumber:4d} {instruction}")
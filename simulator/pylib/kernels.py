@@ -0,0 +1,54 @@
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+# compile time limits of the tile programs in src/ (MAX_* defines)
+TILE_LIMITS = {
+    "convR8_32_5": {"inputChannels": 16, "outputChannels": 64, "height": 256, "width": 256},
+    "maxp2_2": {"inputChannels": 32, "height": 256, "width": 256},
+    "fc128_64": {"inputChannels": 128, "outputChannels": 64},
+}
+
+# convR8_32_5 is a 5x5 valid convolution with stride 1
+FILTER_SIZE = 5
+
+# streams are sized in text lines, MAX_STREAM_SIZE / sizeof(dataType) in the tile programs
+MAX_STREAM_ELEMENTS = 1 * 1024 * 1024 // 4
+
+def accumulate(columns, weight):
+    """columns @ weight.T summed tap by tap in float32, the order of the loops in the tile programs.
+
+    Bit exact with the C tiles where a GEMM is only exact to rounding, at the cost of one NumPy
+    operation per tap."""
+    total = np.zeros(columns.shape[:-1] + weight.shape[:1], dtype=np.float32)
+    for tap in range(columns.shape[-1]):
+        total += columns[..., tap, None] * weight[:, tap]
+    return total
+
+def convolution(inputImage, convWeight, convBias, exact=False):
+    """convR8_32_5: valid stride 1 convolution with ReLU as im2col + GEMM.
+
+    inputImage is (..., C, H, W), leading dimensions are kept (batch)."""
+    outputChannels, inputChannels, filterHeight, filterWidth = convWeight.shape
+    batchShape = inputImage.shape[:-3]
+
+    # (..., C, hout, wout, fh, fw) -> (..., hout * wout, C * fh * fw) columns
+    windows = sliding_window_view(inputImage, (filterHeight, filterWidth), axis=(-2, -1))
+    hout, wout = windows.shape[-4], windows.shape[-3]
+    columns = np.moveaxis(windows, -5, -3).reshape(*batchShape, hout * wout, inputChannels * filterHeight * filterWidth)
+
+    convWeight = convWeight.reshape(outputChannels, -1)
+    output = (accumulate(columns, convWeight) if exact else columns @ convWeight.T) + convBias
+    output = np.moveaxis(output, -1, -2).reshape(*batchShape, outputChannels, hout, wout)
+
+    # relu
+    return np.maximum(output, 0)
+
+def maxPooling(inputImage, poolSize, stride):
+    """maxp2_2: max pooling over a strided window view of (..., C, H, W), no relu (same as the tile)."""
+    windows = sliding_window_view(inputImage, (poolSize, poolSize), axis=(-2, -1))[..., ::stride, ::stride, :, :]
+    return windows.max(axis=(-2, -1))
+
+def fullyConnected(inputData, fcWeight, fcBias, exact=False):
+    """fc128_64: matmul with bias and ReLU, inputData is (..., inputChannels)."""
+    output = accumulate(inputData, fcWeight) if exact else inputData @ fcWeight.T
+    return np.maximum(output + fcBias, 0)
@@ -1,67 +1,157 @@
-import struct
+import os
+import shutil
 import numpy as np
 
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# ioctl of linux/fs.h sharing the extents of one file with another (copy-on-write clone, btrfs/xfs)
+FICLONE = 0x40049409
+
+# main memory files ending in this suffix hold raw little-endian bytes instead of one hex byte per line
+BINARY_SUFFIX = '.bin'
+
+# text memory is one "XX\n" line per byte, these tables convert whole blocks of lines at once
+HEX_LINE_SIZE = 3
+HEX_DIGITS = np.frombuffer(b'0123456789ABCDEF', dtype=np.uint8)
+HEX_VALUES = np.zeros(256, dtype=np.uint8)
+HEX_VALUES[HEX_DIGITS] = np.arange(16, dtype=np.uint8)
+HEX_VALUES[np.frombuffer(b'abcdef', dtype=np.uint8)] = np.arange(10, 16, dtype=np.uint8)
+
+def isBinaryMemory(mainMemoryFile):
+    """True for an open memory array or a raw binary memory file."""
+    return isinstance(mainMemoryFile, np.ndarray) or mainMemoryFile.endswith(BINARY_SUFFIX)
+
+def mainMemoryPath(memoryDir, memoryFormat='text'):
+    if memoryFormat == 'binary':
+        return memoryDir + "mainmemory" + BINARY_SUFFIX
+    return memoryDir + "mainmemory"
+
+def encodeHex(data):
+    """Encode a uint8 array as text memory lines (two upper case hex digits plus a newline per byte)."""
+    data = np.asarray(data, dtype=np.uint8).reshape(-1)
+    lines = np.empty((data.size, HEX_LINE_SIZE), dtype=np.uint8)
+    lines[:, 0] = HEX_DIGITS[data >> 4]
+    lines[:, 1] = HEX_DIGITS[data & 0x0F]
+    lines[:, 2] = ord('\n')
+    return lines.tobytes()
+
+def decodeHex(text):
+    """Decode a block of text memory lines back into a uint8 array."""
+    lines = np.frombuffer(text, dtype=np.uint8).reshape(-1, HEX_LINE_SIZE)
+    return (HEX_VALUES[lines[:, 0]] << 4) | HEX_VALUES[lines[:, 1]]
+
 def setupMemory(memory_size, filename):
-    with open(filename, 'w') as mem_file:
-        for _ in range(memory_size):
-            mem_file.write('00\n')  # Write each byte in hex format, new line as a separator
-            
+    if isBinaryMemory(filename):
+        setupBinaryMemory(memory_size, filename)
+        return
+    with open(filename, 'wb') as mem_file:
+        mem_file.write(b'00\n' * memory_size)  # Write each byte in hex format, new line as a separator
+
+def setupBinaryMemory(memory_size, filename):
+    with open(filename, 'wb') as mem_file:
+        mem_file.truncate(memory_size)  # zero filled (sparse) file of memory_size bytes
+
+def openMemory(filename, mode='r+'):
+    """Memory-map a binary main memory file as a flat uint8 array."""
+    return np.memmap(filename, dtype=np.uint8, mode=mode)
+
+def floatView(memory, address, size):
+    """float32 view of size floats starting at byte address, writes go straight to memory."""
+    return memory[address : address + 4 * size].view(np.float32)
+
 def write_float_to_memory(mainMemoryFile, address, value):
     """Write a float value to a specific starting address in the memory."""
-    # Convert the float to 4 bytes
-    bytes_value = struct.pack('f', value)
-    with open(mainMemoryFile, 'r+') as mem_file:
-        lines = mem_file.readlines()
-        for i in range(4):  # Assuming a float is 4 bytes
-            # Extract each byte from the bytes object and write it to memory
-            byte_str = f'{bytes_value[i]:02X}\n'
-            lines[address + i] = byte_str
-            
-        mem_file.seek(0)
-        mem_file.writelines(lines)
-        
+    writeFloatArrayToMemory(mainMemoryFile, np.float32(value), address, 1)
+
 def read_float_from_memory(mainMemoryFile, address):
     """Read a float value from a specific starting address in the memory."""
-    bytes_value = bytearray()
-    with open(mainMemoryFile, 'r') as mem_file:
-        lines = mem_file.readlines()
-        for i in range(4):  # Assuming a float is 4 bytes
-            byte_str = lines[address + i].strip()
-            bytes_value.append(int(byte_str, 16))
-    # Convert the 4 bytes back into a float
-    return struct.unpack('f', bytes_value)[0]
+    return readArrayFromMemory(mainMemoryFile, address, 1)[0]
 
 def readArrayFromMemory(mainMemoryFile, address, size, dtype='f'):
-    array = np.zeros(size, dtype=np.float32)  # Assuming dtype='f' corresponds to np.float32
-    with open(mainMemoryFile, 'r') as mem_file:
+    if isBinaryMemory(mainMemoryFile):
+        memory = mainMemoryFile if isinstance(mainMemoryFile, np.ndarray) else openMemory(mainMemoryFile, 'r')
+        return floatView(memory, address, size).copy()
+
+    itemSize = np.dtype(dtype).itemsize
+    with open(mainMemoryFile, 'rb') as mem_file:
         # Move to the position where we want to start reading
-        mem_file.seek(address * 3)  # Each byte is 2 hex digits plus a newline
-        
-        for i in range(size):
-            bytes_value = bytearray()
-            for j in range(4):  # Assuming the data type is 4 bytes
-                byte_str = mem_file.readline().strip()
-                bytes_value.append(int(byte_str, 16))
-            
-            # Unpack the bytes to the specified dtype and store in the array
-            array[i] = struct.unpack(dtype, bytes_value)[0]
-    
-    return array
+        mem_file.seek(address * HEX_LINE_SIZE)  # Each byte is 2 hex digits plus a newline
+        text = mem_file.read(size * itemSize * HEX_LINE_SIZE)
+
+    return decodeHex(text).view(dtype).copy()
 
 def writeFloatArrayToMemory(mainMemoryFile, numpyData, address, size):
-    array = numpyData.flatten()
-    with open(mainMemoryFile, 'r+') as mem_file:
-        lines = mem_file.readlines()
-        for i in range(size):
-            # floats are 4 bytes            
-            bytes_value = struct.pack('f', array[i])
-            
-            for j in range(4):  # Assuming a float is 4 bytes
-                # Extract each byte from the bytes object and write it to memory
-                byte_str = f'{bytes_value[j]:02X}\n'
-                lines[address + 4 * i + j] = byte_str
-            
-        mem_file.seek(0)
-        mem_file.writelines(lines)
-        
-    return address + 4 * size
\ No newline at end of file
+    array = np.asarray(numpyData, dtype=np.float32).reshape(-1)[:size]
+    if isBinaryMemory(mainMemoryFile):
+        memory = mainMemoryFile if isinstance(mainMemoryFile, np.ndarray) else openMemory(mainMemoryFile)
+        floatView(memory, address, size)[:] = array
+        if isinstance(memory, np.memmap):
+            memory.flush()
+        return address + 4 * size
+
+    # only the lines of the written range are touched, the rest of the file stays as is
+    with open(mainMemoryFile, 'r+b') as mem_file:
+        mem_file.seek(address * HEX_LINE_SIZE)
+        mem_file.write(encodeHex(array.view(np.uint8)))
+
+    return address + 4 * size
+
+def exportTextMemory(binaryMemoryFile, textMemoryFile):
+    """Dump a binary main memory (file or open array) into the one hex byte per line debug format."""
+    memory = binaryMemoryFile if isinstance(binaryMemoryFile, np.ndarray) else openMemory(binaryMemoryFile, 'r')
+    with open(textMemoryFile, 'wb') as mem_file:
+        mem_file.write(encodeHex(memory))
+
+def importTextMemory(textMemoryFile, binaryMemoryFile):
+    """Convert a text main memory into the raw binary format."""
+    with open(textMemoryFile, 'rb') as mem_file:
+        data = decodeHex(mem_file.read())
+    with open(binaryMemoryFile, 'wb') as mem_file:
+        mem_file.write(data.tobytes())
+
+def cloneFile(sourceFile, destinationFile):
+    """Copy a memory file, as a copy-on-write reflink where the file system supports it.
+
+    The copy goes to a temporary file that then replaces destinationFile, so a mapping of the
+    old file is never truncated under a reader and concurrent writers never see half a file."""
+    temporaryFile = f"{destinationFile}.{os.getpid()}.tmp"
+    with open(sourceFile, 'rb') as source, open(temporaryFile, 'wb') as destination:
+        try:
+            fcntl.ioctl(destination.fileno(), FICLONE, source.fileno())
+        except (AttributeError, OSError):
+            shutil.copyfileobj(source, destination, 1024 * 1024)
+    os.replace(temporaryFile, destinationFile)
+
+# text stream files: "%08X\n" packet count, then one srcTile byte and 4 data bytes per packet, all as hex lines
+STREAM_HEADER_SIZE = 9
+STREAM_RECORD_SIZE = 5 * HEX_LINE_SIZE
+
+def readStreamCount(stream_file):
+    # the header is "%08X\n" once a tile wrote it, "00\n00\n00\n" straight after setupMemory
+    return int(stream_file.read(STREAM_HEADER_SIZE).split(b'\n')[0], 16)
+
+def readStreamFile(streamFile, consume=True):
+    """Read every packet of a text stream as (srcTiles, data), consume empties it like readArrayFromStream."""
+    with open(streamFile, 'r+b') as stream_file:
+        count = readStreamCount(stream_file)
+        records = decodeHex(stream_file.read(count * STREAM_RECORD_SIZE)).reshape(count, 5)
+        if consume:
+            stream_file.seek(0)
+            stream_file.write(b'%08X\n' % 0)
+    return records[:, 0].copy(), records[:, 1:].copy().view(np.float32).reshape(count)
+
+def appendStreamFile(streamFile, srcTiles, data):
+    """Append packets to a text stream the way writeArrayToStream does."""
+    data = np.asarray(data, dtype=np.float32).reshape(-1)
+    records = np.empty((data.size, 5), dtype=np.uint8)
+    records[:, 0] = srcTiles
+    records[:, 1:] = data.view(np.uint8).reshape(-1, 4)
+    with open(streamFile, 'r+b') as stream_file:
+        count = readStreamCount(stream_file)
+        stream_file.seek(0)
+        stream_file.write(b'%08X\n' % (count + data.size))
+        stream_file.seek(STREAM_HEADER_SIZE + count * STREAM_RECORD_SIZE)
+        stream_file.write(encodeHex(records))
@@ -0,0 +1,134 @@
+from pylib import partition
+
+# modeled time to load another tile program into a tile, a partial reconfiguration of its region
+RECONFIGURE_SECONDS = 500e-6
+
+# timeline mark of a tile running each tile program
+KERNEL_MARKS = {"convR8_32_5": "C", "maxp2_2": "P", "fc128_64": "F"}
+
+class TileOverflow(ValueError):
+    """More parts hold a tile at step than there are tiles."""
+
+    def __init__(self, step, parts, numTiles):
+        super().__init__(f"{len(parts)} layer parts hold a tile at step {step}, only {numTiles} tiles are available")
+        self.step = step
+        self.parts = parts
+
+def streamProducers(part):
+    """Parts whose output goes to part's input stream, none when it reads main memory."""
+    if not part.layer.readsStream:
+        return []
+    producer = part.layer.inputLayer
+    return [producer.parts[part.index]] if partition.takesSlice(part.layer) else list(producer.parts)
+
+def holdIntervals(parts):
+    """(first, last) step each part holds its tile, from the first packet streamed to it until it runs.
+
+    Parts run one per step in order. A tile that reads main memory is only held while it runs,
+    one that reads a stream from the step of its first producer on: reprogramming the tile in
+    between would set up its stream again and drop the packets already in it."""
+    steps = {part: step for step, part in enumerate(parts)}
+    return {part: (min([steps[part]] + [steps[producer] for producer in streamProducers(part)]), steps[part])
+            for part in parts}
+
+class TileSchedule:
+    """Tiles 1..numTiles shared by the parts of a program over time.
+
+    programs lists (step, tile, kernel) in program order, step -1 is the initial programming at
+    the top of the program and any later step a reconfiguration right before that step's part."""
+
+    def __init__(self, parts, numTiles, intervals, programs):
+        self.parts = parts
+        self.numTiles = numTiles
+        self.intervals = intervals
+        self.programs = programs
+
+    @property
+    def reconfigurations(self):
+        return [program for program in self.programs if program[0] >= 0]
+
+    @property
+    def multiplexed(self):
+        """Whether some tile runs more than one part."""
+        return len({part.tile for part in self.parts}) < len(self.parts)
+
+    def timeline(self):
+        """tile -> one mark per step: the kernel's letter while running, '-' while waiting on its stream, '.' idle."""
+        rows = {tile: ["."] * len(self.parts) for tile in range(1, self.numTiles + 1)}
+        for step, part in enumerate(self.parts):
+            first, last = self.intervals[part]
+            for holding in range(first, last):
+                rows[part.tile][holding] = "-"
+            rows[part.tile][step] = KERNEL_MARKS[part.layer.kernel]
+        return {tile: "".join(row) for tile, row in rows.items()}
+
+    def printReport(self):
+        steps = len(self.parts)
+        reconfigurations = self.reconfigurations
+        print(f"tiles: {steps} layer parts on {self.numTiles} tiles, {len(reconfigurations)} reconfigurations "
+              f"({len(reconfigurations) * RECONFIGURE_SECONDS * 1e3:.2f}ms modeled per image)")
+        for step, tile, kernel in reconfigurations:
+            print(f"  before step {step} ({self.parts[step].name}): tile {tile} -> {kernel}")
+        timeline = self.timeline()
+        print("timeline: C conv, P maxpool, F fc running, - waiting on its stream, . idle")
+        print(f"{'tile':>4}  {'step':<{steps}}  {'runs':>4} {'held':>5}")
+        for tile, row in timeline.items():
+            runs = sum(mark not in "-." for mark in row)
+            held = sum(mark != "." for mark in row)
+            print(f"{tile:4d}  {row:<{steps}}  {runs:4d} {held / steps * 100:4.0f}%")
+        held = [sum(row[step] != "." for row in timeline.values()) for step in range(steps)]
+        print(f"tiles held per step: mean {sum(held) / steps:.1f}, max {max(held)} of {self.numTiles}")
+
+def multiplexTiles(parts, numTiles):
+    """Assign tiles 1..numTiles to parts, reprogramming tiles when there are more parts than tiles.
+
+    Parts take tiles in the order they start holding one. A never programmed tile is taken
+    while enough are left for the programs later parts need that no tile has yet, it is
+    programmed once at the top of the program and spreads the parts over the tiles so they can
+    overlap on the dataflow scheduler. Then the free tile already running the part's program
+    that has been free the longest is reused as it is, else the free tile whose program is
+    needed again the latest (or never) is reprogrammed, so programs that come back soon stay
+    loaded (Belady's choice, the fewest reconfigurations for the order of the parts).
+    Raises TileOverflow when more than numTiles parts hold a tile at the same step."""
+    intervals = holdIntervals(parts)
+    order = sorted(parts, key=lambda part: intervals[part])
+    kernels = [None] * (numTiles + 1)
+    freeFrom = [0] * (numTiles + 1)
+    programs = []
+
+    def nextUse(kernel, index):
+        return next((intervals[part][0] for part in order[index:] if part.layer.kernel == kernel), len(parts))
+
+    for index, part in enumerate(order):
+        first, last = intervals[part]
+        free = [tile for tile in range(1, numTiles + 1) if freeFrom[tile] <= first]
+        if not free:
+            holding = [other for other in parts if intervals[other][0] <= first <= intervals[other][1]]
+            raise TileOverflow(first, holding, numTiles)
+        kernel = part.layer.kernel
+        unused = [tile for tile in free if kernels[tile] is None]
+        loaded = [tile for tile in free if kernels[tile] == kernel]
+        missing = {later.layer.kernel for later in order[index + 1:]} - set(kernels) - {kernel}
+        if unused and (len(unused) > len(missing) or not loaded):
+            tile = unused[0]
+            programs.append((-1, tile, kernel))
+        elif loaded:
+            tile = min(loaded, key=lambda tile: freeFrom[tile])
+        else:
+            tile = max(free, key=lambda tile: nextUse(kernels[tile], index))
+            programs.append((first, tile, kernel))
+        part.tile = tile
+        kernels[tile] = kernel
+        freeFrom[tile] = last + 1
+    # initial programs first in tile order, reconfigurations in step order
+    programs.sort(key=lambda program: (program[0], program[1] if program[0] < 0 else 0))
+    return TileSchedule(parts, numTiles, intervals, programs)
+
+def spillLayer(overflow):
+    """The streaming layer to send through main memory instead, the one holding the most tile steps at the overflow."""
+    held = {}
+    for part in overflow.parts:
+        producer = part.layer.inputLayer if part.layer.readsStream else None
+        if producer is not None:
+            held[producer] = held.get(producer, 0) + 1
+    return max(held, key=held.get) if held else None
@@ -0,0 +1,395 @@
+import argparse
+import sys
+
+from pylib import isa
+from pylib import kernels
+from pylib import memManage
+from pylib import multiplex
+from pylib import partition
+
+# layer description lines, fields after the layer type (same comment/blank line rules as the ISA),
+# tile layers take an optional last field: the number of tiles to split them over
+LAYER_FIELDS = {
+    "input": ("name", "channels", "height", "width"),
+    "conv": ("name", "input", "outputChannels", "weights", "bias"),
+    "maxpool": ("name", "input", "poolSize", "stride"),
+    "fc": ("name", "input", "outputChannels", "weights", "bias"),
+    "output": ("name", "input"),
+}
+INTEGER_FIELDS = ("channels", "height", "width", "outputChannels", "poolSize", "stride", "tiles")
+
+# tile program running each layer type
+LAYER_KERNELS = {"conv": "convR8_32_5", "maxpool": "maxp2_2", "fc": "fc128_64"}
+
+class NetError(ValueError):
+    """A layer description that does not compile, the message starts with file:line."""
+
+class Layer:
+    def __init__(self, kind, fields, inputLayer, lineNumber):
+        self.kind = kind
+        self.name = fields["name"]
+        self.fields = fields
+        self.inputLayer = inputLayer
+        self.lineNumber = lineNumber
+        self.consumers = []
+        self.kernel = LAYER_KERNELS.get(kind)
+        self.inputShape = inputLayer.outputShape if inputLayer is not None else None
+        self.outputShape = self.inferShape()
+        # filled in by the compiler
+        self.parts = []
+        self.readsStream = False
+        self.writesStream = False
+        self.outputAddress = -1
+        self.weightAddress = -1
+        self.biasAddress = -1
+
+    def inferShape(self):
+        if self.kind == "input":
+            return (self.fields["channels"], self.fields["height"], self.fields["width"])
+        if self.kind == "output":
+            return self.inputShape
+        if self.kind == "fc":
+            return (self.fields["outputChannels"],)
+
+        if len(self.inputShape) != 3:
+            raise ValueError(f"{self.kind} needs a (channels, height, width) input, {self.inputLayer.name} is {self.inputShape}")
+        channels, height, width = self.inputShape
+        if self.kind == "conv":
+            if height < kernels.FILTER_SIZE or width < kernels.FILTER_SIZE:
+                raise ValueError(f"input {height}x{width} is smaller than the {kernels.FILTER_SIZE}x{kernels.FILTER_SIZE} filter")
+            return (self.fields["outputChannels"], height - kernels.FILTER_SIZE + 1, width - kernels.FILTER_SIZE + 1)
+        poolSize, stride = self.fields["poolSize"], self.fields["stride"]
+        if height < poolSize or width < poolSize or stride < 1:
+            raise ValueError(f"pool {poolSize} stride {stride} does not fit a {height}x{width} input")
+        return (channels, (height - poolSize) // stride + 1, (width - poolSize) // stride + 1)
+
+    @property
+    def inputSize(self):
+        return size(self.inputShape)
+
+    @property
+    def outputSize(self):
+        return size(self.outputShape)
+
+    def kernelArguments(self):
+        """The tile program dimensions, named like the fields of isa.TILE_INSTRUCTIONS and kernels.TILE_LIMITS."""
+        if self.kind == "fc":
+            return {"inputChannels": self.inputSize, "outputChannels": self.fields["outputChannels"]}
+        channels, height, width = self.inputShape
+        arguments = {"inputChannels": channels, "height": height, "width": width}
+        if self.kind == "conv":
+            arguments["outputChannels"] = self.fields["outputChannels"]
+        else:
+            arguments.update(poolSize=self.fields["poolSize"], stride=self.fields["stride"])
+        return arguments
+
+    def parameterSizes(self):
+        """(dataObject, floats) of the weights and bias the layer reads."""
+        if self.kind == "conv":
+            outputChannels, channels = self.fields["outputChannels"], self.inputShape[0]
+            weightSize = outputChannels * channels * kernels.FILTER_SIZE * kernels.FILTER_SIZE
+        elif self.kind == "fc":
+            outputChannels = self.fields["outputChannels"]
+            weightSize = outputChannels * self.inputSize
+        else:
+            return []
+        return [(self.fields["weights"], weightSize), (self.fields["bias"], outputChannels)]
+
+def size(shape):
+    total = 1
+    for dimension in shape:
+        total *= dimension
+    return total
+
+def parseNet(text, source="<net>"):
+    """Parse a layer description into Layers in file order, every layer names an earlier layer as input."""
+    layers = {}
+    for lineNumber, line in enumerate(text.splitlines(), 1):
+        tokens = line.split()
+        # skip empty lines and comments
+        if not tokens or tokens[0].startswith('#'):
+            continue
+
+        location = f"{source}:{lineNumber}"
+        kind = tokens[0]
+        if kind not in LAYER_FIELDS:
+            raise NetError(f"{location}: invalid layer {kind}")
+        names = LAYER_FIELDS[kind]
+        if kind in LAYER_KERNELS and len(tokens) - 1 == len(names) + 1:
+            names += ("tiles",)
+        if len(tokens) - 1 != len(names):
+            raise NetError(f"{location}: {kind} takes {len(names)} arguments ({' '.join(names)}), got {len(tokens) - 1}")
+        try:
+            fields = {name: int(token) if name in INTEGER_FIELDS else token for name, token in zip(names, tokens[1:])}
+            if fields["name"] in layers:
+                raise ValueError(f"layer {fields['name']} is defined twice")
+            inputLayer = None
+            if "input" in fields:
+                inputLayer = layers.get(fields["input"])
+                if inputLayer is None or inputLayer.kind == "output":
+                    raise ValueError(f"input {fields['input']} is not an earlier layer")
+            layer = Layer(kind, fields, inputLayer, lineNumber)
+        except ValueError as error:
+            raise NetError(f"{location}: {error}") from None
+
+        if inputLayer is not None:
+            inputLayer.consumers.append(layer)
+        layers[layer.name] = layer
+    return list(layers.values())
+
+class BufferAllocator:
+    """First fit placement of buffers in main memory given the steps they are live in.
+
+    A buffer is live from the step that writes it to the last step that reads it, two buffers
+    share addresses only if their steps do not overlap."""
+
+    def __init__(self, base):
+        self.base = base
+        self.placed = []
+
+    def allocate(self, size, start, end):
+        live = sorted((address, address + bytes) for address, bytes, first, last in self.placed
+                      if first <= end and start <= last)
+        address = self.base
+        for liveStart, liveEnd in live:
+            if address + size <= liveStart:
+                break
+            address = max(address, liveEnd)
+        self.placed.append((address, size, start, end))
+        return address
+
+    @property
+    def end(self):
+        return max((address + bytes for address, bytes, _, _ in self.placed), default=self.base)
+
+class CompiledNet:
+    """ISA text of a compiled network plus the numbers of its footprint report."""
+
+    def __init__(self, layers, text, memory, streams, schedule, spilled):
+        self.layers = layers
+        self.text = text
+        self.memory = memory
+        self.streams = streams
+        self.schedule = schedule
+        self.spilled = spilled
+
+    def printReport(self):
+        print(f"{'layer':<12} {'kernel':<12} {'tile':>4} {'mode':>4} {'input':>14} {'output':>14} {'channels':>9}")
+        for layer in self.layers:
+            for part in layer.parts:
+                mode = ("S" if layer.readsStream else "M") + ("S" if layer.writesStream else "M")
+                print(f"{part.name:<12} {layer.kernel:<12} {part.tile:4d} {mode:>4} "
+                      f"{'x'.join(map(str, layer.inputShape)):>14} {'x'.join(map(str, layer.outputShape)):>14} "
+                      f"{part.first:4d}+{part.count:<4d}")
+        memory = self.memory
+        print(f"main memory: {memory['total']} bytes (parameters {memory['parameters']}, inputs/outputs/activations "
+              f"{memory['buffers']}, {memory['buffersWithoutReuse']} without buffer reuse)")
+        for tile, elements in sorted(self.streams['perStream'].items()):
+            print(f"stream{tile}: {elements} values peak ({streamBytes(elements)} bytes)")
+        print(f"streams: {self.streams['peak']} values live at most ({streamBytes(self.streams['peak'])} bytes)")
+        if self.spilled:
+            print(f"spilled to main memory to free tiles: {', '.join(self.spilled)}")
+        if self.schedule.multiplexed:
+            self.schedule.printReport()
+
+def streamBytes(elements):
+    # text stream file: count header plus one hex record per value
+    return memManage.STREAM_HEADER_SIZE + elements * memManage.STREAM_RECORD_SIZE
+
+def assignTiles(parts, numTiles=isa.NUM_TILES - 1):
+    """A tile per part while they fit, numbered from 1 like lenetFPGA.ISA, else tiles time-multiplexed
+    by multiplex.multiplexTiles (raises multiplex.TileOverflow)."""
+    if len(parts) > numTiles:
+        return multiplex.multiplexTiles(parts, numTiles)
+    for tile, part in enumerate(parts, 1):
+        part.tile = tile
+    return multiplex.TileSchedule(parts, numTiles, multiplex.holdIntervals(parts),
+                                  [(-1, part.tile, part.layer.kernel) for part in parts])
+
+def chooseModes(tileLayers, memoryLayers=()):
+    """Stream a layer's output when every consumer part can take it from a stream, memory otherwise
+    (network outputs, oversized data, split layers whose channels do not line up, memoryLayers)."""
+    for layer in tileLayers:
+        layer.writesStream = (layer.name not in memoryLayers
+                              and all(partition.canStream(layer, consumer) for consumer in layer.consumers)
+                              and layer.outputSize <= kernels.MAX_STREAM_ELEMENTS)
+    for layer in tileLayers:
+        layer.readsStream = layer.inputLayer.kernel is not None and layer.inputLayer.writesStream
+
+def connectParts(tileLayers):
+    """Destination tiles of every part, once the tiles are assigned."""
+    for layer in tileLayers:
+        for part in layer.parts:
+            # a memory writing tile still names a destination, its own tile like the hand written fc6
+            part.destTiles = partition.destinationTiles(part, layer.consumers) if layer.writesStream else [part.tile]
+
+def compileNet(text, memorySize=isa.MAIN_MEMORY_SIZE, source="<net>", tiles=None, memoryLayers=(),
+               numTiles=isa.NUM_TILES - 1):
+    """Compile a layer description into a CompiledNet whose text is a complete ISA program.
+
+    Tile layers are split by channel over as many tiles as their limits (or their tiles field)
+    ask for, each part gets its own tile in file order. A layer streams to its consumers when all
+    of them are tiles, and writes main memory when the host reads it. Network inputs and
+    outputs keep their own buffers, activations that go through memory share addresses with
+    those not live at the same time, and the parameters are packed after them.
+
+    With more parts than numTiles tiles the tiles are time-multiplexed: the program reprograms
+    tiles between parts (see multiplex.py), and where more streams wait for their consumers than
+    there are tiles the streaming layer holding the most of them writes main memory instead.
+
+    tiles (layer name -> tiles) overrides the tiles fields and memoryLayers names layers that
+    write main memory even when they could stream, to try other mappings of the same network."""
+    layers = parseNet(text, source)
+    tiles = tiles or {}
+    names = {layer.name for layer in layers if layer.kernel is not None}
+    unknown = sorted((set(tiles) | set(memoryLayers)) - names)
+    if unknown:
+        raise NetError(f"{source}: no tile layer {', '.join(unknown)}")
+    tileLayers = [layer for layer in layers if layer.kernel is not None]
+    inputs = [layer for layer in layers if layer.kind == "input"]
+    outputs = [layer for layer in layers if layer.kind == "output"]
+
+    def fail(layer, message):
+        raise NetError(f"{source}:{layer.lineNumber}: {message}")
+
+    for layer in layers:
+        if layer.kind != "output" and not layer.consumers:
+            fail(layer, f"{layer.name} is never used")
+        if layer.kernel is not None:
+            try:
+                layer.parts = partition.partitionLayer(layer, tiles.get(layer.name, layer.fields.get("tiles", 1)))
+            except ValueError as error:
+                fail(layer, f"{layer.name}: {error}")
+    for layer in outputs:
+        if layer.inputLayer.kernel is None:
+            fail(layer, f"output {layer.name} must come from a tile layer")
+    parts = [part for layer in tileLayers for part in layer.parts]
+    memoryLayers = set(memoryLayers)
+    spilled = []
+    chooseModes(tileLayers, memoryLayers)
+    while True:
+        try:
+            schedule = assignTiles(parts, numTiles)
+            break
+        except multiplex.TileOverflow as overflow:
+            # stream data that would wait across reconfigurations goes through main memory instead
+            layer = multiplex.spillLayer(overflow)
+            if layer is None:
+                raise NetError(f"{source}: {overflow}") from None
+            memoryLayers.add(layer.name)
+            spilled.append(layer.name)
+            chooseModes(tileLayers, memoryLayers)
+    connectParts(tileLayers)
+
+    # step of each part, network inputs are written before step 0 and outputs read after the last step
+    steps = {part: step for step, part in enumerate(parts)}
+    lastStep = len(parts)
+    allocator = BufferAllocator(0)
+    for layer in inputs:
+        layer.outputAddress = allocator.allocate(4 * layer.outputSize, -1, lastStep)
+    for layer in outputs:
+        if layer.inputLayer.outputAddress < 0:
+            layer.inputLayer.outputAddress = allocator.allocate(4 * layer.outputSize, steps[layer.inputLayer.parts[0]], lastStep)
+    for layer in tileLayers:
+        if not layer.writesStream and layer.outputAddress < 0:
+            lastRead = max(steps[consumer.parts[-1]] for consumer in layer.consumers)
+            layer.outputAddress = allocator.allocate(4 * layer.outputSize, steps[layer.parts[0]], lastRead)
+    bufferEnd = allocator.end
+
+    # parameters stay resident for the whole program, packed in layer order
+    parameters = {}
+    address = bufferEnd
+    for layer in tileLayers:
+        for name, floats in layer.parameterSizes():
+            if name in parameters and parameters[name][1] != floats:
+                fail(layer, f"{name} is used with {parameters[name][1]} and {floats} values")
+            if name not in parameters:
+                parameters[name] = (address, floats)
+                address += 4 * floats
+        if layer.parameterSizes():
+            (weights, _), (bias, _) = layer.parameterSizes()
+            layer.weightAddress, layer.biasAddress = parameters[weights][0], parameters[bias][0]
+    if address > memorySize:
+        raise NetError(f"{source}: the network needs {address} bytes of main memory, {memorySize} are available")
+
+    memory = {"total": address, "parameters": address - bufferEnd, "buffers": bufferEnd,
+              "buffersWithoutReuse": sum(size for _, size, _, _ in allocator.placed)}
+    streams = streamFootprint(parts)
+    return CompiledNet(layers, emitISA(layers, parts, parameters, source, schedule.programs), memory, streams,
+                       schedule, spilled)
+
+def streamFootprint(parts):
+    """Peak values held by each input stream, and by all streams at once, over the run of the program."""
+    perStream = {}
+    live = {}
+    peak = 0
+    for part in parts:
+        if part.layer.readsStream:
+            live.pop(part.tile, None)
+        if part.layer.writesStream:
+            for tile in part.destTiles:
+                live[tile] = live.get(tile, 0) + part.outputSize
+                perStream[tile] = max(perStream.get(tile, 0), live[tile])
+        peak = max(peak, sum(live.values()))
+    return {"perStream": perStream, "peak": peak}
+
+def emitISA(layers, parts, parameters, source, programs):
+    lines = [f"# compiled from {source} by pylib/netCompiler.py", "",
+             "# program FPGA tile (emulator setups stream files)", "# (inst=program, tileNumb, programName)"]
+    lines += [f"program {tile} {kernel}" for step, tile, kernel in programs if step < 0]
+
+    lines += ["", "# (inst=memcpy2device, dataObject in run.py program, addr, size)"]
+    lines += [f"memcpy2device {layer.name} {layer.outputAddress} {layer.outputSize}" for layer in layers if layer.kind == "input"]
+    lines += [f"memcpy2device {name} {address} {floats}" for name, (address, floats) in parameters.items()]
+
+    lines += ["",
+              "# (inst=convR8_32_5, tile, outTiles, streamSettins, inputAdrr, convAddr, convBiasAddr, outputAddr, inputChan, inputHeight, inputWidth, outputChan)",
+              "# (inst=maxp2_2, tile, outTiles, streamSettins, inputAdrr, outputAddr, inputChan, inputHeight, inputWidth, poolSize, stride)",
+              "# (inst=fc128_64, tile, outTiles, streamSettins, inputAdrr, fcAddr, fcBiasAddr, outputAddr, inputChan, outputChan)"]
+    for step, part in enumerate(parts):
+        # time-multiplexed tiles are reprogrammed right before the first part that needs them
+        lines += [f"program {tile} {kernel}" for programStep, tile, kernel in programs if programStep == step]
+        lines.append(" ".join(map(str, instructionFields(part))))
+
+    lines += ["", "# (inst=memcpy2host, dataObject in run.py program, addr, size)"]
+    lines += [f"memcpy2host {layer.name} {layer.inputLayer.outputAddress} {layer.outputSize}" for layer in layers if layer.kind == "output"]
+    return "\n".join(lines) + "\n"
+
+def instructionFields(part):
+    layer = part.layer
+    setting = ("S" if layer.readsStream else "M") + ("S" if layer.writesStream else "M")
+    inputAddress = -1 if layer.readsStream else layer.inputLayer.outputAddress + part.inputOffset()
+    outputAddress = -1 if layer.writesStream else layer.outputAddress + part.outputOffset()
+    if layer.kind == "maxpool":
+        addresses = [inputAddress, outputAddress]
+    else:
+        weightOffset, biasOffset = part.parameterOffsets()
+        addresses = [inputAddress, layer.weightAddress + weightOffset, layer.biasAddress + biasOffset, outputAddress]
+    return ([layer.kernel, part.tile, "-".join(map(str, part.destTiles)), setting] + addresses
+            + list(part.kernelArguments().values()))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compile a layer description into an ISA program")
+    parser.add_argument("net", help="layer description file")
+    parser.add_argument("-o", "--output", help="ISA file to write (default: print it)")
+    parser.add_argument("--tiles", type=int, default=isa.NUM_TILES - 1,
+                        help=f"tiles available, more layer parts than that time-multiplex them (default: {isa.NUM_TILES - 1})")
+    args = parser.parse_args()
+
+    if not 1 <= args.tiles <= isa.NUM_TILES - 1:
+        print(f"Error: --tiles must be 1..{isa.NUM_TILES - 1}, tile 0 is not used")
+        sys.exit(1)
+    try:
+        compiled = compileNet(open(args.net).read(), source=args.net, numTiles=args.tiles)
+        # the emitted program must pass the same checks as a hand written one
+        isa.compileISA(compiled.text, source=args.output or "<compiled>")
+    except (NetError, isa.ISAError) as error:
+        print("Error:", error)
+        sys.exit(1)
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(compiled.text)
+    else:
+        print(compiled.text)
+    compiled.printReport()
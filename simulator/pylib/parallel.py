@@ -0,0 +1,49 @@
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+# tmpfs keeps the memory and stream files of a worker off the disk
+SHARED_MEMORY_DIR = "/dev/shm"
+
+def makeWorkspace(prefix="tilesim-"):
+    """Create a private memory/stream directory for one worker, returned with a trailing slash like memoryDir."""
+    baseDir = SHARED_MEMORY_DIR if os.path.isdir(SHARED_MEMORY_DIR) else None
+    return tempfile.mkdtemp(prefix=prefix, dir=baseDir) + os.sep
+
+def removeWorkspace(workspace):
+    shutil.rmtree(workspace, ignore_errors=True)
+
+def shardRanges(numImages, numShards):
+    """Split range(numImages) into numShards contiguous (first, count) shards of near equal size."""
+    numShards = max(1, min(numShards, numImages))
+    base, extra = divmod(numImages, numShards)
+    shards = []
+    first = 0
+    for shard in range(numShards):
+        count = base + (shard < extra)
+        shards.append((first, count))
+        first += count
+    return shards
+
+def runSharded(shardFunction, shards, numWorkers, *args, shardData=None):
+    """Run shardFunction(first, count, *args) for every shard on a pool of worker processes.
+
+    shardData(first, count) gives arguments only that shard needs (its slice of the images), they
+    go before args so a worker is sent its own data instead of all of it.
+    Returns the shard results in shard order and the wall time of the whole pool."""
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=numWorkers) as pool:
+        futures = [pool.submit(shardFunction, first, count, *(shardData(first, count) if shardData else ()), *args)
+                   for first, count in shards]
+        results = [future.result() for future in futures]
+    return results, time.perf_counter() - start
+
+def printShardTimings(results, wallTime):
+    print(f"{'shard':>5} {'pid':>7} {'first':>6} {'images':>6} {'setup s':>8} {'run s':>8} {'images/s':>9}")
+    for shard, result in enumerate(results):
+        print(f"{shard:5d} {result['pid']:7d} {result['first']:6d} {result['count']:6d} "
+              f"{result['setupTime']:8.3f} {result['runTime']:8.3f} {result['throughput']:9.1f}")
+    numImages = sum(result['count'] for result in results)
+    print(f"{len(results)} shards, {numImages} images in {wallTime:.3f}s wall: {numImages / wallTime:.1f} images/s")
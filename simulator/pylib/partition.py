@@ -0,0 +1,95 @@
+from pylib import kernels
+from pylib import parallel
+
+# dimension each layer type is split along: every tile gets whole channels, so its weights, bias,
+# input (maxpool) and output are one contiguous slice of the layer's and need no copy
+SPLIT_FIELDS = {"conv": "outputChannels", "maxpool": "inputChannels", "fc": "outputChannels"}
+
+class Part:
+    """The slice of a layer one tile runs, channels first..first+count of its split dimension."""
+
+    def __init__(self, layer, index, first, count):
+        self.layer = layer
+        self.index = index
+        self.first = first
+        self.count = count
+        # filled in by the compiler
+        self.tile = None
+        self.destTiles = []
+
+    @property
+    def name(self):
+        return self.layer.name if len(self.layer.parts) == 1 else f"{self.layer.name}[{self.index}]"
+
+    def kernelArguments(self):
+        arguments = dict(self.layer.kernelArguments())
+        arguments[SPLIT_FIELDS[self.layer.kind]] = self.count
+        return arguments
+
+    @property
+    def inputSize(self):
+        return self.count * self.layer.inputSize // self.layer.inputShape[0] if self.layer.kind == "maxpool" else self.layer.inputSize
+
+    @property
+    def outputSize(self):
+        return self.count * self.layer.outputSize // self.layer.outputShape[0]
+
+    def inputOffset(self):
+        # byte offset of the part's input in the layer input, a maxpool part pools its own channels
+        return 4 * self.first * (self.layer.inputSize // self.layer.inputShape[0]) if self.layer.kind == "maxpool" else 0
+
+    def outputOffset(self):
+        return 4 * self.first * (self.layer.outputSize // self.layer.outputShape[0])
+
+    def parameterOffsets(self):
+        """Byte offsets of the part's weight rows and bias values in the layer's weights and bias."""
+        (_, weightSize), (_, biasSize) = self.layer.parameterSizes()
+        return 4 * self.first * (weightSize // biasSize), 4 * self.first
+
+def partitionLayer(layer, numTiles=1):
+    """Split layer over the fewest tiles (at least numTiles) that keep every part within the tile limits.
+
+    Only the channel dimension is split. A band of rows is not contiguous in a CHW tensor and
+    the tiles take one start address per tensor, and splitting the input channels of a conv or
+    fc would need the partial sums added up after the ReLU, which no tile program does, so
+    those limits stay hard errors."""
+    arguments = layer.kernelArguments()
+    limits = kernels.TILE_LIMITS[layer.kernel]
+    splitField = SPLIT_FIELDS[layer.kind]
+    for field, value in arguments.items():
+        if field != splitField and field in limits and value > limits[field]:
+            raise ValueError(f"{field} {value} exceeds the {layer.kernel} limit of {limits[field]}, "
+                             f"only {splitField} can be split across tiles")
+
+    channels = arguments[splitField]
+    numParts = max(numTiles, -(-channels // limits[splitField]))
+    if numParts > channels:
+        raise ValueError(f"{channels} {splitField} cannot be split over {numParts} tiles")
+    return [Part(layer, index, first, count) for index, (first, count) in enumerate(parallel.shardRanges(channels, numParts))]
+
+def slices(layer):
+    return [(part.first, part.count) for part in layer.parts]
+
+def takesSlice(consumer):
+    """A split maxpool only reads its own channels, every other part reads the whole input."""
+    return consumer.kind == "maxpool" and len(consumer.parts) > 1
+
+def canStream(producer, consumer):
+    """Whether producer's parts can feed consumer's parts through their input streams.
+
+    A tile reads the whole stream, so a part taking a slice can only be fed by the producer
+    part holding exactly those channels. Whole-input parts get every producer part appended
+    to their stream in channel order (the gather)."""
+    if consumer.kernel is None:
+        return False
+    return not takesSlice(consumer) or slices(producer) == slices(consumer)
+
+def destinationTiles(part, consumers):
+    """Input stream tiles a streaming part writes to, the fan-out to every consumer part."""
+    tiles = []
+    for consumer in consumers:
+        if takesSlice(consumer):
+            tiles.append(consumer.parts[part.index].tile)
+        else:
+            tiles += [consumerPart.tile for consumerPart in consumer.parts]
+    return tiles
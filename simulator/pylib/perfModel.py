@@ -0,0 +1,264 @@
+import argparse
+import sys
+from collections import namedtuple
+
+from pylib import isa
+from pylib import kernels
+from pylib import multiplex
+from pylib import netCompiler
+from pylib import snapshot
+from pylib import scheduler as dataflow
+
+# what the FPGA design is assumed to sustain, every rate is per tile except the shared main memory
+# opsPerCycle: MACs per cycle of the conv and fc tiles, comparisons per cycle of the maxpool tile
+# reconfigureSeconds: loading another tile program into a tile of a time-multiplexed program
+ModelParameters = namedtuple("ModelParameters", "clockMHz opsPerCycle memoryGBps streamGBps hostGBps startupCycles "
+                                                "reconfigureSeconds")
+
+DEFAULT_PARAMETERS = ModelParameters(
+    clockMHz=200,
+    # one 5x5 window per cycle, one 2x2 window per cycle, an 8 wide dot product
+    opsPerCycle={"convR8_32_5": kernels.FILTER_SIZE * kernels.FILTER_SIZE, "maxp2_2": 4, "fc128_64": 8},
+    memoryGBps=6.4,
+    # one float per cycle on a stream link
+    streamGBps=0.8,
+    hostGBps=4.0,
+    startupCycles=100,
+    reconfigureSeconds=multiplex.RECONFIGURE_SECONDS,
+)
+
+# modeled cost of one instruction, bytes are 4 per float as the hardware moves them (not the simulator's text files)
+Estimate = namedtuple("Estimate", "name tile kernel mode ops memoryBytes streamInBytes streamOutBytes seconds bound")
+
+def tileOps(instruction):
+    """MACs of a conv or fc tile, window comparisons of a maxpool tile."""
+    if isinstance(instruction, isa.Conv):
+        return instruction.outputSize * instruction.inputChannels * kernels.FILTER_SIZE * kernels.FILTER_SIZE
+    if isinstance(instruction, isa.MaxPool):
+        return instruction.outputSize * instruction.poolSize * instruction.poolSize
+    return instruction.inputChannels * instruction.outputChannels
+
+def estimateTile(instruction, parameters):
+    """A tile overlaps its reads, compute and writes, so it takes as long as the slowest of them."""
+    memoryBytes = 4 * sum(size for _, size in instruction.memoryReads() + instruction.memoryWrites())
+    streamInBytes = 4 * instruction.inputSize if instruction.readsStream else 0
+    # the output is written to every destination stream in turn
+    streamOutBytes = 4 * instruction.outputSize * len(instruction.destTiles) if instruction.writesStream else 0
+    ops = tileOps(instruction)
+
+    clock = parameters.clockMHz * 1e6
+    times = {"compute": ops / (parameters.opsPerCycle[instruction.opcode] * clock),
+             "memory": memoryBytes / (parameters.memoryGBps * 1e9),
+             "stream": max(streamInBytes, streamOutBytes) / (parameters.streamGBps * 1e9)}
+    bound = max(times, key=times.get)
+    seconds = parameters.startupCycles / clock + times[bound]
+    return Estimate(f"{instruction.opcode} {instruction.tile}", instruction.tile, instruction.opcode,
+                    instruction.streamSetting, ops, memoryBytes, streamInBytes, streamOutBytes, seconds, bound)
+
+def estimateHostCopy(instruction, parameters):
+    return Estimate(f"{instruction.opcode} {instruction.name}", None, instruction.opcode, "", 0, 4 * instruction.size,
+                    0, 0, 4 * instruction.size / (parameters.hostGBps * 1e9), "host")
+
+def estimateReconfiguration(instruction, parameters):
+    return Estimate(f"program {instruction.tile}", instruction.tile, instruction.kernel, "", 0, 0, 0, 0,
+                    parameters.reconfigureSeconds, "reconfigure")
+
+def dependencyGraph(program):
+    """The scheduler's dependency graph of program, nodes[i] is instructions[i] followed by the gathers.
+
+    Reprogramming a tile also waits for the instructions that ran on it before."""
+    graph = dataflow.DataflowScheduler(None, 0)
+    ranOnTile = {}
+    for index, instruction in enumerate(program.instructions):
+        if isinstance(instruction, isa.ProgramTile):
+            graph.add(f"program {instruction.tile}", None, streamReads=[isa.streamPath("", instruction.tile)])
+            graph.nodes[-1].dependencies.update(graph.nodes[earlier] for earlier in ranOnTile.pop(instruction.tile, []))
+        elif isinstance(instruction, isa.Memcpy2Device):
+            graph.add(f"memcpy2device {instruction.name}", None, memoryWrites=[(instruction.address, 4 * instruction.size)])
+        elif isinstance(instruction, isa.Memcpy2Host):
+            graph.add(f"memcpy2host {instruction.name}", None, memoryReads=[(instruction.address, 4 * instruction.size)])
+        else:
+            graph.addTile(f"{instruction.opcode} {instruction.tile}", instruction.commandLine("", "mainmemory", ""))
+            ranOnTile.setdefault(instruction.tile, []).append(index)
+    graph.buildGraph()
+    return graph.nodes
+
+def streamOccupancy(program):
+    """Peak values waiting in each tile's input stream over one pass, tile -> values."""
+    return {tile: values for tile, values in isa.streamCapacities(program).items() if values}
+
+class ProgramModel:
+    """Modeled per-image latency and pipelined throughput of a compiled program.
+
+    Programming the tiles and copying the resident objects (the weights, see snapshot.py) happen
+    once and are left out, the batch objects and outputs are copied for every image. A tile
+    programmed again later in the program (time-multiplexed, see multiplex.py) is reconfigured
+    for every image, which costs reconfigureSeconds on that tile. The latency
+    of one image follows the scheduler's dependency graph: a tile waits for the main memory it
+    reads to be written, but consumes a stream while its producer fills it. Streaming images
+    back to back, every tile works on a different image, so a new image can start every
+    initiation interval: the busiest tile, the host link or the main memory all tiles share,
+    whichever is slowest."""
+
+    def __init__(self, program, parameters=DEFAULT_PARAMETERS, batchObjects=snapshot.BATCH_OBJECTS):
+        self.program = program
+        self.parameters = parameters
+        self.estimates = []
+        costs = []
+        programmed = set()
+        for instruction in program.instructions:
+            if isinstance(instruction, isa.ProgramTile) and instruction.tile in programmed:
+                estimate = estimateReconfiguration(instruction, parameters)
+            elif isinstance(instruction, isa.ProgramTile):
+                programmed.add(instruction.tile)
+                costs.append(0.0)
+                continue
+            elif isinstance(instruction, isa.TILE_INSTRUCTIONS):
+                estimate = estimateTile(instruction, parameters)
+            elif isinstance(instruction, isa.Memcpy2Host) or (isinstance(instruction, isa.Memcpy2Device)
+                                                            and instruction.name in batchObjects):
+                estimate = estimateHostCopy(instruction, parameters)
+            else:
+                costs.append(0.0)
+                continue
+            self.estimates.append(estimate)
+            costs.append(estimate.seconds)
+
+        nodes = dependencyGraph(program)
+        gathers = set(nodes[len(program.instructions):])
+        startup = parameters.startupCycles / (parameters.clockMHz * 1e6)
+        times = {}
+
+        def schedule(node):
+            # (start, finish) of node, a stream consumer runs alongside its producers and ends a startup after them
+            if node in times:
+                return times[node]
+            dependencies = [(dependency, schedule(dependency)) for dependency in node.dependencies]
+            if node in gathers:
+                # gathers merge staged packets, on the FPGA that is the stream arbiter and costs nothing
+                times[node] = (max(start for _, (start, _) in dependencies), max(finish for _, (_, finish) in dependencies))
+                return times[node]
+            start = finish = 0.0
+            for dependency, (dependencyStart, dependencyFinish) in dependencies:
+                if dependency in gathers or set(dependency.streamWrites) & set(node.streamReads):
+                    start = max(start, dependencyStart + startup)
+                    finish = max(finish, dependencyFinish + startup)
+                else:
+                    start = max(start, dependencyFinish)
+            times[node] = (start, max(finish, start + costs[node.index]))
+            return times[node]
+
+        self.latency = max((schedule(node)[1] for node in nodes), default=0.0)
+        self.streams = streamOccupancy(program)
+
+        # a time-multiplexed tile is one stage for all the programs it runs
+        tileKernels = {}
+        for estimate in self.estimates:
+            if estimate.tile is not None and estimate.kernel not in tileKernels.setdefault(estimate.tile, []):
+                tileKernels[estimate.tile].append(estimate.kernel)
+        stages = {}
+        for estimate in self.estimates:
+            stage = "host" if estimate.tile is None else f"tile {estimate.tile} ({'+'.join(tileKernels[estimate.tile])})"
+            stages[stage] = stages.get(stage, 0.0) + estimate.seconds
+        memoryBytes = sum(estimate.memoryBytes for estimate in self.estimates if estimate.tile is not None)
+        stages["main memory"] = memoryBytes / (parameters.memoryGBps * 1e9)
+        self.stages = stages
+        self.bottleneck = max(stages, key=stages.get)
+        self.interval = stages[self.bottleneck]
+
+    @property
+    def throughput(self):
+        return 1.0 / self.interval if self.interval > 0 else float("inf")
+
+    def time(self, numImages):
+        """Seconds to push numImages through the pipeline."""
+        return self.latency + (numImages - 1) * self.interval if numImages > 0 else 0.0
+
+    def printReport(self, numImages):
+        print(f"{'instruction':<22} {'mode':>4} {'ops':>10} {'memory KB':>10} {'stream in':>10} {'stream out':>10} "
+              f"{'time us':>9}  bound")
+        for estimate in self.estimates:
+            print(f"{estimate.name:<22} {estimate.mode:>4} {estimate.ops:10d} {estimate.memoryBytes / 1024:10.1f} "
+                  f"{estimate.streamInBytes / 1024:10.1f} {estimate.streamOutBytes / 1024:10.1f} "
+                  f"{estimate.seconds * 1e6:9.2f}  {estimate.bound}")
+        for tile, values in sorted(self.streams.items()):
+            print(f"stream{tile}: {values} values peak, {values / kernels.MAX_STREAM_ELEMENTS * 100:.1f}% of "
+                  f"{kernels.MAX_STREAM_ELEMENTS}" + (" (overflows)" if values > kernels.MAX_STREAM_ELEMENTS else ""))
+        for stage, seconds in sorted(self.stages.items(), key=lambda item: -item[1]):
+            print(f"{stage:<28} {seconds * 1e6:9.2f} us per image")
+        print(f"latency {self.latency * 1e3:.4f}ms per image, initiation interval {self.interval * 1e6:.2f}us "
+              f"(bottleneck {self.bottleneck}), {self.throughput:.0f} images/s, "
+              f"{numImages} images in {self.time(numImages) * 1e3:.2f}ms")
+
+def parseVariant(variant):
+    """'conv5=4,conv1=MM' -> ({'conv5': 4}, {'conv1'}): tiles per layer, layers forced to write main memory."""
+    tiles = {}
+    memoryLayers = set()
+    for item in filter(None, variant.split(",")):
+        name, _, value = item.partition("=")
+        if value == "MM":
+            memoryLayers.add(name)
+        elif value.isdigit():
+            tiles[name] = int(value)
+        else:
+            raise ValueError(f"invalid variant {item}, expected LAYER=TILES or LAYER=MM")
+    return tiles, memoryLayers
+
+def loadModelProgram(path, variant=""):
+    """Compile an ISA file, or a layer description with the mapping changes of variant."""
+    if not path.endswith(".layers"):
+        if variant:
+            raise ValueError(f"{path}: variants need a .layers file, an ISA file fixes the mapping")
+        return isa.loadProgram(path)
+    tiles, memoryLayers = parseVariant(variant)
+    compiled = netCompiler.compileNet(open(path).read(), source=path, tiles=tiles, memoryLayers=memoryLayers)
+    return isa.compileISA(compiled.text, source=path)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Estimate the FPGA latency and throughput of ISA programs without running them")
+    parser.add_argument("programs", nargs="+", help="ISA files or .layers descriptions")
+    parser.add_argument("--variant", action="append", default=[], metavar="LAYER=TILES|LAYER=MM[,...]",
+                        help="for .layers files: split LAYER over TILES tiles or make it write main memory, "
+                             "repeat to compare several mappings")
+    parser.add_argument("--images", type=int, default=10000, help="images for the pipelined time estimate (default: 10000)")
+    parser.add_argument("--clock", type=float, default=DEFAULT_PARAMETERS.clockMHz, help="tile clock in MHz")
+    parser.add_argument("--ops", action="append", default=[], metavar="KERNEL=N",
+                        help="MACs (comparisons for maxp2_2) per cycle of a tile program")
+    parser.add_argument("--memory-bandwidth", type=float, default=DEFAULT_PARAMETERS.memoryGBps,
+                        help="main memory GB/s shared by all tiles")
+    parser.add_argument("--stream-bandwidth", type=float, default=DEFAULT_PARAMETERS.streamGBps, help="GB/s of one stream link")
+    parser.add_argument("--host-bandwidth", type=float, default=DEFAULT_PARAMETERS.hostGBps,
+                        help="GB/s of the host memcpy link")
+    parser.add_argument("--startup", type=int, default=DEFAULT_PARAMETERS.startupCycles, help="cycles to start a tile")
+    parser.add_argument("--reconfigure", type=float, default=DEFAULT_PARAMETERS.reconfigureSeconds * 1e6,
+                        help="microseconds to reprogram a tile of a time-multiplexed program")
+    args = parser.parse_args()
+
+    opsPerCycle = dict(DEFAULT_PARAMETERS.opsPerCycle)
+    for item in args.ops:
+        kernel, _, value = item.partition("=")
+        if kernel not in opsPerCycle or not value.isdigit() or int(value) == 0:
+            print(f"Error: invalid --ops {item}, expected one of {', '.join(opsPerCycle)}=N")
+            sys.exit(1)
+        opsPerCycle[kernel] = int(value)
+    parameters = ModelParameters(args.clock, opsPerCycle, args.memory_bandwidth, args.stream_bandwidth,
+                                 args.host_bandwidth, args.startup, args.reconfigure * 1e-6)
+
+    models = []
+    for path in args.programs:
+        for variant in args.variant if path.endswith(".layers") and args.variant else [""]:
+            try:
+                program = loadModelProgram(path, variant)
+            except (ValueError, OSError) as error:
+                print("Error:", error)
+                sys.exit(1)
+            label = f"{path} {variant}".strip()
+            models.append((label, ProgramModel(program, parameters)))
+
+    for label, model in models:
+        print(f"== {label}")
+        model.printReport(args.images)
+    if len(models) > 1:
+        print(f"{'mapping':<36} {'latency ms':>10} {'interval us':>11} {'images/s':>9}  bottleneck")
+        for label, model in models:
+            print(f"{label:<36} {model.latency * 1e3:10.4f} {model.interval * 1e6:11.2f} {model.throughput:9.0f}  {model.bottleneck}")
@@ -0,0 +1,102 @@
+import numpy as np
+
+# bytes per stored element of each precision, fp32 is the float32 of the tile programs
+PRECISIONS = {"fp32": 4, "fp16": 2, "int8": 1}
+
+# dtype of the stored codes
+STORAGE_DTYPES = {"fp32": np.float32, "fp16": np.float16, "int8": np.int8}
+
+# symmetric int8: codes -127..127 times one scale per tensor
+INT8_MAX = 127
+
+def elementBytes(precision):
+    if precision not in PRECISIONS:
+        raise ValueError(f"unknown precision {precision}, choose from {', '.join(PRECISIONS)}")
+    return PRECISIONS[precision]
+
+def int8Scale(data, perSample=False):
+    """Per-tensor int8 step max|data| / 127, one per row of data with perSample (1.0 for an all-zero tensor)."""
+    magnitude = np.abs(data).reshape(len(data), -1).max(axis=1, initial=0.0) if perSample else np.abs(data).max(initial=0.0)
+    scale = np.where(magnitude > 0, magnitude / INT8_MAX, 1.0).astype(np.float32)
+    return scale.reshape((-1,) + (1,) * (data.ndim - 1)) if perSample else scale
+
+def quantize(data, precision, perSample=False):
+    """data as stored at precision, (codes, scale) with scale None for the float precisions."""
+    data = np.asarray(data, dtype=np.float32)
+    if precision == "fp32":
+        return data, None
+    if precision == "fp16":
+        return data.astype(np.float16), None
+    elementBytes(precision)
+    scale = int8Scale(data, perSample)
+    return np.clip(np.rint(data / scale), -INT8_MAX, INT8_MAX).astype(np.int8), scale
+
+def dequantize(codes, scale, precision):
+    """float32 values of stored codes."""
+    if precision == "int8":
+        return codes.astype(np.float32) * scale
+    return codes.astype(np.float32, copy=False)
+
+def storedBytes(codes, scale):
+    """Bytes a quantized tensor takes: its codes plus its int8 scales."""
+    return codes.nbytes + (0 if scale is None else np.asarray(scale).nbytes)
+
+class ScaleMap:
+    """The int8 scales of a memory: (start, end, scale) element ranges, each written as one tensor.
+
+    A write replaces the scales of the range it covers, a read multiplies every piece of the
+    codes it got by the scale of the tensor that piece came from. Scales are () for shared
+    memory and (batchSize, 1) for per-sample memory."""
+
+    def __init__(self, regions=()):
+        self.regions = list(regions)
+
+    def set(self, start, end, scale):
+        kept = []
+        for regionStart, regionEnd, regionScale in self.regions:
+            if regionEnd <= start or end <= regionStart:
+                kept.append((regionStart, regionEnd, regionScale))
+                continue
+            if regionStart < start:
+                kept.append((regionStart, start, regionScale))
+            if end < regionEnd:
+                kept.append((end, regionEnd, regionScale))
+        kept.append((start, end, scale))
+        self.regions = kept
+
+    def overlapping(self, start, end):
+        """The (start, end, scale) pieces of start..end, clipped to it."""
+        return [(max(regionStart, start), min(regionEnd, end), scale) for regionStart, regionEnd, scale in self.regions
+                if regionStart < end and start < regionEnd]
+
+    def apply(self, values, start):
+        """Scale the float32 codes of elements start.. in place, values is (..., n)."""
+        for pieceStart, pieceEnd, scale in self.overlapping(start, start + values.shape[-1]):
+            values[..., pieceStart - start : pieceEnd - start] *= scale
+        return values
+
+    def nbytes(self, start=None, end=None):
+        regions = self.regions if start is None else self.overlapping(start, end)
+        return sum(np.asarray(scale, dtype=np.float32).nbytes for _, _, scale in regions)
+
+def printAccuracyReport(precision, outputs, referenceOutputs, labels, footprint, referenceFootprint):
+    """Top-1 accuracy of a reduced-precision run against the fp32 reference run of the same images.
+
+    footprint and referenceFootprint are the bytes each run's backend actually stored: the
+    parameters, the whole main memory and what the images wrote to memory and to streams."""
+    labels = np.frombuffer(labels, dtype=np.uint8)[:len(outputs)]
+    predictions = outputs.argmax(axis=1)
+    referencePredictions = referenceOutputs.argmax(axis=1)
+    accuracy = np.mean(predictions == labels) * 100
+    referenceAccuracy = np.mean(referencePredictions == labels) * 100
+    print(f"precision {precision}: top-1 {accuracy:.2f}% vs fp32 {referenceAccuracy:.2f}% "
+          f"(delta {accuracy - referenceAccuracy:+.2f} points), same prediction for "
+          f"{np.mean(predictions == referencePredictions) * 100:.2f}% of {len(outputs)} images")
+    print(f"precision {precision}: max |output - fp32| {np.abs(outputs - referenceOutputs).max():.6g}")
+    for name, what in (("parameters", "parameters"), ("memory", "main memory"),
+                       ("memoryTraffic", "written to main memory per image"), ("streamTraffic", "streamed per image")):
+        stored, reference = footprint[name], referenceFootprint[name]
+        if name.endswith("Traffic"):
+            stored, reference = stored / max(len(outputs), 1), reference / max(len(outputs), 1)
+        print(f"precision {precision}: {what} {stored:.0f} bytes vs {reference:.0f} at fp32"
+              + (f" ({stored / reference:.2f}x)" if reference else ""))
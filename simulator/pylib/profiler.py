@@ -0,0 +1,201 @@
+import json
+import os
+import threading
+import time
+from collections import namedtuple
+
+from pylib import isa
+from pylib import streams
+
+# one timed step inside an instruction, times are time.monotonic() seconds (CLOCK_MONOTONIC, shared with the tiles)
+Phase = namedtuple("Phase", "phase file bytes start end")
+
+# one executed instruction, phases are only filled in for tile programs
+Record = namedtuple("Record", "name kind start end thread phases")
+
+def parseTileProfile(stdout):
+    """Phases from the "profile <phase> <file> <bytes> <start> <end>" lines a tile prints with TILE_PROFILE set."""
+    phases = []
+    for line in stdout.splitlines():
+        fields = line.split()
+        if len(fields) == 6 and fields[0] == "profile":
+            phases.append(Phase(fields[1], fields[2], int(fields[3]), float(fields[4]), float(fields[5])))
+    return phases
+
+class BackendWrapper:
+    """Base of the wrappers ProfilingBackend can wrap in turn: everything they do not override goes
+    to the wrapped backend, and turning on profiling turns it on for the wrapped backend."""
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    def __getattr__(self, name):
+        return getattr(self.backend, name)
+
+    # ProfilingBackend turns on profiling of the wrapped backend
+    @property
+    def profiling(self):
+        return self.backend.profiling
+
+    @profiling.setter
+    def profiling(self, value):
+        self.backend.profiling = value
+
+class ProfilingBackend:
+    """Wraps a backend and records the wall time of every instruction it executes.
+
+    Every backend call is one ISA instruction (setupStream or setupSharedStream for program, writeMemory for
+    memcpy2device, readMemory for memcpy2host, run for a tile, moveStream for a scheduler
+    gather), so this works for sequential and scheduled runs alike. Tile programs report their
+    read, compute and write phases, the subprocess tiles through TILE_PROFILE, and the time
+    before and after their main() is process spawn and exit."""
+
+    def __init__(self, backend, program=None):
+        self.backend = backend
+        backend.profiling = True
+        self.records = []
+        self.lock = threading.Lock()
+        self.threads = {}
+        # memcpy instructions are named after their data object
+        self.objectNames = {}
+        if program is not None:
+            for instruction in program.instructions:
+                if isinstance(instruction, (isa.Memcpy2Device, isa.Memcpy2Host)):
+                    self.objectNames[(instruction.opcode, instruction.address)] = instruction.name
+
+    def __getattr__(self, name):
+        # everything not timed (setBatch, snapshots, ...) goes straight to the backend
+        return getattr(self.backend, name)
+
+    def record(self, name, kind, function, *args, phasesOf=None):
+        start = time.monotonic()
+        result = function(*args)
+        end = time.monotonic()
+        with self.lock:
+            thread = self.threads.setdefault(threading.get_ident(), len(self.threads))
+            self.records.append(Record(name, kind, start, end, thread, phasesOf(result, start, end) if phasesOf else []))
+        return result
+
+    def setupMemory(self, memorySize, mainMemoryFile):
+        return self.record("setupMemory", "setup", self.backend.setupMemory, memorySize, mainMemoryFile)
+
+    def setupStream(self, streamDepth, streamFile):
+        return self.record(f"program {os.path.basename(streamFile)}", "program", self.backend.setupStream,
+                           streamDepth, streamFile)
+
+    def setupSharedStream(self, streamDepth, streamFiles):
+        return self.record(f"program {'+'.join(os.path.basename(streamFile) for streamFile in streamFiles)}", "program",
+                           self.backend.setupSharedStream, streamDepth, streamFiles)
+
+    def moveStream(self, sourceFile, streamFile):
+        return self.record(f"gather {os.path.basename(streamFile)}", "gather", self.backend.moveStream, sourceFile, streamFile)
+
+    def hostCopy(self, opcode, function, *args):
+        # a host copy is a single write (memcpy2device) or read (memcpy2host) of main memory
+        mainMemoryFile, address, size = args[0], args[-2], args[-1]
+        name = self.objectNames.get((opcode, address), str(address))
+        phase = "write" if opcode == "memcpy2device" else "read"
+        bytes = self.backend.transferBytes(mainMemoryFile, size)
+        return self.record(f"{opcode} {name}", opcode, function, *args,
+                           phasesOf=lambda result, start, end: [Phase(phase, mainMemoryFile, bytes, start, end)])
+
+    def writeMemory(self, mainMemoryFile, data, address, size):
+        return self.hostCopy("memcpy2device", self.backend.writeMemory, mainMemoryFile, data, address, size)
+
+    def writeBatchMemory(self, mainMemoryFile, data, address, size):
+        return self.hostCopy("memcpy2device", self.backend.writeBatchMemory, mainMemoryFile, data, address, size)
+
+    def readMemory(self, mainMemoryFile, address, size):
+        return self.hostCopy("memcpy2host", self.backend.readMemory, mainMemoryFile, address, size)
+
+    def run(self, command):
+        # the input stream names the tile, stream<N>
+        name = f"{os.path.basename(command[0])} {streams.streamTile(command[2])}"
+        return self.record(name, "tile", self.backend.run, command, phasesOf=lambda phases, start, end: phases or [])
+
+    def profile(self):
+        return Profile(self.records)
+
+class Profile:
+    """The records of a profiled run with per-instruction breakdowns, a summary table and a Chrome trace."""
+
+    def __init__(self, records):
+        self.records = sorted(records, key=lambda record: record.start)
+
+    @staticmethod
+    def breakdown(record):
+        """Seconds spent in process (spawn and exit), read, compute and write, and bytes read and written."""
+        phases = {"process": 0.0, "read": 0.0, "compute": 0.0, "write": 0.0}
+        readBytes = writeBytes = 0
+        main = None
+        for phase in record.phases:
+            if phase.phase == "main":
+                main = phase
+                continue
+            phases[phase.phase] += phase.end - phase.start
+            if phase.phase == "read":
+                readBytes += phase.bytes
+            elif phase.phase == "write":
+                writeBytes += phase.bytes
+        if main is not None:
+            phases["process"] = (record.end - record.start) - (main.end - main.start)
+        return phases, readBytes, writeBytes
+
+    def fileTotals(self):
+        """file -> [bytes read, bytes written] over the run."""
+        totals = {}
+        for record in self.records:
+            for phase in record.phases:
+                if phase.phase in ("read", "write"):
+                    totals.setdefault(phase.file, [0, 0])[phase.phase == "write"] += phase.bytes
+        return totals
+
+    def summary(self):
+        rows = []
+        for record in self.records:
+            phases, readBytes, writeBytes = self.breakdown(record)
+            rows.append({"name": record.name, "kind": record.kind, "wall": record.end - record.start,
+                         "readBytes": readBytes, "writeBytes": writeBytes, **phases})
+        return rows
+
+    def printSummary(self):
+        rows = self.summary()
+        columns = ("wall", "process", "read", "compute", "write")
+        print(f"{'instruction':<26} " + " ".join(f"{column + ' ms':>10}" for column in columns)
+              + f" {'read KB':>9} {'write KB':>9}")
+        for row in rows:
+            print(f"{row['name'][:26]:<26} " + " ".join(f"{row[column] * 1e3:10.3f}" for column in columns)
+                  + f" {row['readBytes'] / 1024:9.1f} {row['writeBytes'] / 1024:9.1f}")
+        totals = {column: sum(row[column] for row in rows) for column in columns + ("readBytes", "writeBytes")}
+        print(f"{'total (' + str(len(rows)) + ' instructions)':<26} " + " ".join(f"{totals[column] * 1e3:10.3f}" for column in columns)
+              + f" {totals['readBytes'] / 1024:9.1f} {totals['writeBytes'] / 1024:9.1f}")
+        if totals["wall"] > 0:
+            print("share of wall time: " + ", ".join(f"{column} {totals[column] / totals['wall'] * 100:.1f}%"
+                                                    for column in columns[1:]))
+
+        print(f"{'file':<26} {'read KB':>9} {'write KB':>9}")
+        for file, (readBytes, writeBytes) in sorted(self.fileTotals().items()):
+            print(f"{file[-26:]:<26} {readBytes / 1024:9.1f} {writeBytes / 1024:9.1f}")
+
+    def chromeTrace(self):
+        """Chrome/Perfetto trace events: an instruction span per record with its phases nested inside."""
+        origin = min((record.start for record in self.records), default=0.0)
+
+        def event(name, category, start, end, thread, args=None):
+            return {"name": name, "cat": category, "ph": "X", "pid": 0, "tid": thread,
+                    "ts": (start - origin) * 1e6, "dur": max(end - start, 0.0) * 1e6, "args": args or {}}
+
+        events = []
+        for record in self.records:
+            phases, readBytes, writeBytes = self.breakdown(record)
+            events.append(event(record.name, record.kind, record.start, record.end, record.thread,
+                                {"readBytes": readBytes, "writeBytes": writeBytes}))
+            for phase in record.phases:
+                name = "tile process" if phase.phase == "main" else phase.phase
+                events.append(event(name, phase.phase, phase.start, phase.end, record.thread,
+                                    {"file": phase.file, "bytes": phase.bytes}))
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def writeChromeTrace(self, traceFile):
+        with open(traceFile, 'w') as file:
+            json.dump(self.chromeTrace(), file)
@@ -1,10 +1,13 @@
+import os
 import struct
+import threading
 import numpy as np
 
-def parse_mnist_images(filename):
+def parse_mnist_images(filename, verbose=False):
     try:
         with open(filename, "rb") as fil:
-            print("Opened mnist images data file")
+            if verbose:
+                print("Opened mnist images data file")
 
             # Read and unpack the header
             header = struct.unpack('>IIII', fil.read(16))
@@ -13,25 +16,27 @@ def parse_mnist_images(filename):
             cols = header[3]
 
             # Assuming NUM_TESTS is num_images read from the header
-            image_data = fil.read(num_images * rows * cols)
-            if len(image_data) != num_images * rows * cols:
+            if os.fstat(fil.fileno()).st_size - 16 < num_images * rows * cols:
                 print("Can't read images from file")
-                return -1
-            else:
+                return -1, None
+            elif verbose:
                 print("Read images from file")
 
-            print("Closed images file")
-            images = np.frombuffer(image_data, dtype=np.uint8)
+            if verbose:
+                print("Closed images file")
+            # the pixels are mapped, not read
+            images = np.memmap(filename, dtype=np.uint8, mode='r', offset=16, shape=(num_images * rows * cols,))
             return images, (num_images, rows, cols)
 
     except IOError as e:
         print(f"ERROR when opening mnist images data file: {e}")
         return -1, None  
         
-def parse_mnist_labels(filename):
+def parse_mnist_labels(filename, verbose=False):
     try:
         with open(filename, "rb") as fil:
-            print("Opened mnist labels data file")
+            if verbose:
+                print("Opened mnist labels data file")
 
             # Read and unpack the header
             header = struct.unpack('>II', fil.read(8))
@@ -41,86 +46,124 @@ def parse_mnist_labels(filename):
             if len(labels) != num_labels:
                 print("Can't read labels from file")
                 return -1
-            else:
+            elif verbose:
                 print("Read labels from file")
 
-            print("Closed labels file")
+            if verbose:
+                print("Closed labels file")
             return labels
 
     except IOError as e:
         print(f"ERROR when opening mnist labels data file: {e}")
         return -1
 
-def parse_parameters(filename):
+# params.bin is float32 sections back to back in this order, (dataObject, shape)
+PARAMETER_LAYOUT = (
+    ("conv1_weights", (6, 1, 5, 5)),
+    ("conv1_bias", (6,)),
+    ("conv3_weights", (16, 6, 5, 5)),
+    ("conv3_bias", (16,)),
+    ("conv5_weights", (120, 16, 5, 5)),
+    ("conv5_bias", (120,)),
+    ("fc6_weights", (10, 120)),
+    ("fc6_bias", (10,)),
+)
+
+def load_parameters(filename, layout=PARAMETER_LAYOUT, verbose=False):
+    """Map params.bin and return {dataObject: float32 view} of every section in layout, nothing is copied."""
     try:
-        with open(filename, "rb") as fil:
-            print("Opened parameter file")
-
-            # Assuming conv1_weights is a 3D array-like structure
-            conv1_weights_size = 150  # Total number of floats
-            conv1_weights = struct.unpack('f' * conv1_weights_size, fil.read(4 * conv1_weights_size))
-            print("Read conv1_weights from file")
-
-            conv1_bias_size = 6
-            conv1_bias = struct.unpack('f' * conv1_bias_size, fil.read(4 * conv1_bias_size))
-            print("Read conv1_bias from file")
-
-            # Assuming conv3_weights is a 3D array-like structure
-            conv3_weights_size = 2400
-            conv3_weights = struct.unpack('f' * conv3_weights_size, fil.read(4 * conv3_weights_size))
-            print("Read conv3_weights from file")
-
-            conv3_bias_size = 16
-            conv3_bias = struct.unpack('f' * conv3_bias_size, fil.read(4 * conv3_bias_size))
-            print("Read conv3_bias from file")
-
-            # Assuming conv5_weights is a 3D array-like structure
-            conv5_weights_size = 48000
-            conv5_weights = struct.unpack('f' * conv5_weights_size, fil.read(4 * conv5_weights_size))
-            print("Read conv5_weights from file")
-
-            conv5_bias_size = 120
-            conv5_bias = struct.unpack('f' * conv5_bias_size, fil.read(4 * conv5_bias_size))
-            print("Read conv5_bias from file")
-
-            # Assuming fc6_weights is a 2D array-like structure
-            fc6_weights_size = 1200
-            fc6_weights = struct.unpack('f' * fc6_weights_size, fil.read(4 * fc6_weights_size))
-            print("Read fc6_weights from file")
-
-            fc6_bias_size = 10
-            fc6_bias = struct.unpack('f' * fc6_bias_size, fil.read(4 * fc6_bias_size))
-            print("Read fc6_bias from file")
-
-            print("Closed labels file")
-            
-            conv1_weights = np.array(conv1_weights).reshape((6, 1, 5, 5))
-            conv1_bias = np.array(conv1_bias)
-            conv3_weights = np.array(conv3_weights).reshape((16, 6, 5, 5))
-            conv3_bias = np.array(conv3_bias)
-            conv5_weights = np.array(conv5_weights).reshape((120, 16, 5, 5))
-            conv5_bias = np.array(conv5_bias)
-            fc6_weights = np.array(fc6_weights).reshape((10, 120))
-            fc6_bias = np.array(fc6_bias)            
-            
-            return conv1_weights, conv1_bias, conv3_weights, conv3_bias, conv5_weights, conv5_bias, fc6_weights, fc6_bias
-
-    except IOError as e:
+        data = np.memmap(filename, dtype=np.float32, mode='r')
+    except (IOError, ValueError) as e:
         print(f"ERROR when opening parameter file: {e}")
         return -1
+
+    parameters = {}
+    offset = 0
+    for name, shape in layout:
+        size = int(np.prod(shape))
+        if offset + size > data.size:
+            print(f"Can't read {name} from file")
+            return -1
+        parameters[name] = data[offset : offset + size].reshape(shape)
+        offset += size
+    if verbose:
+        print("Read parameters from file")
+    return parameters
+
+def load_parameter(filename, name):
+    """One section of params.bin by name (a provider of registry.DataRegistry)."""
+    parameters = load_parameters(filename)
+    if parameters == -1:
+        raise IOError(f"can't read {name} from {filename}")
+    return parameters[name]
+
+def load_images(filename, preprocessed=False):
+    """All images of an MNIST images file, raw pixels or the preprocessed .npy cache (a provider of registry.DataRegistry)."""
+    if preprocessed:
+        return load_preprocessed_images(filename)
+    images, dims = parse_mnist_images(filename)
+    if dims is None:
+        raise IOError(f"can't read images from {filename}")
+    return images
+
+def load_image(filename, idx):
+    """Image idx of an MNIST images file as get_image returns it (a provider of registry.DataRegistry)."""
+    return get_image(load_images(filename), idx)
+
+def load_labels(filename):
+    labels = parse_mnist_labels(filename)
+    if labels == -1:
+        raise IOError(f"can't read labels from {filename}")
+    return labels
+
+def count_images(images):
+    """Images in a raw pixel array or a preprocessed set."""
+    return images.shape[0] if images.ndim == 4 else images.size // (28 * 28)
+
+def parse_parameters(filename, verbose=False):
+    parameters = load_parameters(filename, verbose=verbose)
+    if parameters == -1:
+        return -1
+    return tuple(parameters[name] for name, _ in PARAMETER_LAYOUT)
     
 def get_image(images, idx):
-    # Create an empty 1x32x32 array filled with -1.0 (for padding)
-    image = np.full((1, 32, 32), -1.0, dtype=np.float32)
-    
-    # Extract the idx-th 28x28 image from the flat array
-    # and reshape it to 28x28
-    original_image = images[idx * 28 * 28 : (idx + 1) * 28 * 28].reshape((28, 28))
-    
-    # Normalize pixel values to [-1.0, 1.0] and place the image in the center of the 1x32x32 array
-    image[0, 2:30, 2:30] = original_image / 255.0 * 2.0 - 1.0
-    
-    return image
+    return get_images(images, [idx])[0]
+
+def get_images(images, indices):
+    """(N, 1, 32, 32) float32 batch of the images at indices, normalized to [-1.0, 1.0] and padded with -1.0.
+
+    images is the flat uint8 array of parse_mnist_images, or an already preprocessed set
+    (load_preprocessed_images) that is just indexed."""
+    indices = np.asarray(indices, dtype=np.intp)
+    if images.ndim == 4:
+        return np.asarray(images[indices])
+
+    # Create an empty Nx1x32x32 array filled with -1.0 (for padding)
+    batch = np.full((len(indices), 1, 32, 32), -1.0, dtype=np.float32)
+
+    # Extract the 28x28 images and place them normalized in the center of the 1x32x32 arrays
+    original_images = images.reshape(-1, 28, 28)[indices]
+    batch[:, 0, 2:30, 2:30] = original_images / 255.0 * 2.0 - 1.0
+
+    return batch
+
+def load_preprocessed_images(filename, cacheFile=None):
+    """Every image of an MNIST images file as get_images returns them, memory-mapped from a .npy cache.
+
+    The cache (filename + ".npy" by default) is rebuilt when it is older than filename, it is
+    written to a temporary file first so concurrent jobs never load half of it."""
+    cacheFile = cacheFile or filename + ".npy"
+    if os.path.exists(cacheFile) and os.path.getmtime(cacheFile) >= os.path.getmtime(filename):
+        return np.load(cacheFile, mmap_mode='r')
+
+    images, dims = parse_mnist_images(filename)
+    if dims is None:
+        raise IOError(f"can't read images from {filename}")
+    # one temporary file per process and thread, registries in two threads may both rebuild it
+    temporaryFile = f"{cacheFile}.{os.getpid()}.{threading.get_ident()}.tmp.npy"
+    np.save(temporaryFile, get_images(images, np.arange(dims[0])))
+    os.replace(temporaryFile, cacheFile)
+    return np.load(cacheFile, mmap_mode='r')
 
 # Example usage
 if __name__ == "__main__":
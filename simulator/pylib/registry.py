@@ -0,0 +1,75 @@
+import threading
+from collections.abc import MutableMapping
+
+from pylib import readbins
+
+class DataRegistry(MutableMapping):
+    """The data objects an ISA program names in its memcpy2device lines, loaded when first used.
+
+    Each name has a provider, a module level function and its arguments, that is called on the
+    first lookup and memoized, or a value set directly (the image of a batch pass). copy() gives
+    a registry sharing the providers and everything loaded so far, values set on the copy stay
+    on the copy. Lookups from several threads load every object once. Pickling keeps the providers
+    but not the loaded objects, so worker processes load what they use themselves."""
+
+    def __init__(self, providers=None, loaded=None, lock=None):
+        self.providers = dict(providers or {})
+        # provider -> object, shared with copies and guarded by lock
+        self.loaded = {} if loaded is None else loaded
+        self.lock = threading.Lock() if lock is None else lock
+        self.values = {}
+
+    def register(self, name, function, *args):
+        self.providers[name] = (function, args)
+        self.values.pop(name, None)
+
+    def __getitem__(self, name):
+        if name in self.values:
+            return self.values[name]
+        provider = self.providers[name]
+        with self.lock:
+            if provider not in self.loaded:
+                function, args = provider
+                self.loaded[provider] = function(*args)
+            return self.loaded[provider]
+
+    def __setitem__(self, name, value):
+        self.values[name] = value
+
+    def __delitem__(self, name):
+        if name not in self:
+            raise KeyError(name)
+        self.values.pop(name, None)
+        self.providers.pop(name, None)
+
+    def __contains__(self, name):
+        # without loading the object (Mapping would look it up)
+        return name in self.values or name in self.providers
+
+    def __iter__(self):
+        return iter(dict.fromkeys(list(self.providers) + list(self.values)))
+
+    def __len__(self):
+        return len(set(self.providers) | set(self.values))
+
+    def copy(self):
+        registry = DataRegistry(self.providers, self.loaded, self.lock)
+        registry.values = dict(self.values)
+        return registry
+
+    def __getstate__(self):
+        return {"providers": self.providers, "values": self.values}
+
+    def __setstate__(self, state):
+        self.__init__(state["providers"])
+        self.values = state["values"]
+
+def mnistRegistry(dataDir, preprocessed=False):
+    """images, labels, image (the first test image) and the LeNet parameters of data/, nothing is read yet."""
+    registry = DataRegistry()
+    registry.register('images', readbins.load_images, dataDir + "images.bin", preprocessed)
+    registry.register('labels', readbins.load_labels, dataDir + "labels.bin")
+    registry.register('image', readbins.load_image, dataDir + "images.bin", 0)
+    for name, _ in readbins.PARAMETER_LAYOUT:
+        registry.register(name, readbins.load_parameter, dataDir + "params.bin", name)
+    return registry
@@ -0,0 +1,166 @@
+import hashlib
+import os
+import threading
+import zipfile
+import numpy as np
+
+from pylib import backends
+from pylib import profiler
+from pylib import streams
+
+# default bound of the cache directory
+MAX_CACHE_BYTES = 256 * 1024 * 1024
+
+ENTRY_SUFFIX = ".npz"
+
+class ResultCache:
+    """Tile results on disk, one .npz of arrays per key.
+
+    A hit refreshes the modification time of its entry, once the entries exceed maxBytes the
+    least recently used ones are removed."""
+
+    def __init__(self, cacheDir, maxBytes=MAX_CACHE_BYTES):
+        self.cacheDir = cacheDir
+        self.maxBytes = maxBytes
+        self.lock = threading.Lock()
+        self.evicted = 0
+        os.makedirs(cacheDir, exist_ok=True)
+
+    def entryPath(self, key):
+        return os.path.join(self.cacheDir, key + ENTRY_SUFFIX)
+
+    def get(self, key):
+        """The arrays stored under key, None on a miss (or an entry another run is evicting)."""
+        path = self.entryPath(key)
+        try:
+            with np.load(path) as entry:
+                arrays = {name: entry[name] for name in entry.files}
+            os.utime(path)
+        except (OSError, ValueError, EOFError, zipfile.BadZipFile):
+            return None
+        return arrays
+
+    def put(self, key, **arrays):
+        path = self.entryPath(key)
+        temporaryFile = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temporaryFile, 'wb') as file:
+            np.savez(file, **arrays)
+        os.replace(temporaryFile, path)
+        self.evict()
+
+    def entries(self):
+        """(mtime, bytes, path) of every entry, least recently used first."""
+        entries = []
+        for name in os.listdir(self.cacheDir):
+            if not name.endswith(ENTRY_SUFFIX):
+                continue
+            path = os.path.join(self.cacheDir, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime_ns, stat.st_size, path))
+        return sorted(entries)
+
+    def size(self):
+        return sum(size for _, size, _ in self.entries())
+
+    def evict(self):
+        with self.lock:
+            entries = self.entries()
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in entries:
+                if total <= self.maxBytes:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+                self.evicted += 1
+
+class CachingBackend(profiler.BackendWrapper):
+    """Wraps a backend and replays tile results from a ResultCache instead of running the tile.
+
+    The key of a tile command hashes the program (the tile binary, or the settings of an
+    in-process backend), its arguments and tile number, the main memory it reads (parameters,
+    and its input unless it streams it in) and the packets of its input stream. A hit writes the
+    cached output range or appends the cached packets to the destination streams and consumes
+    the input stream as the tile would. Re-running a program replays every tile whose inputs
+    are unchanged, only the tiles downstream of a change (new weights, other arguments) run."""
+
+    def __init__(self, backend, cache):
+        super().__init__(backend)
+        self.cache = cache
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.programDigests = {}
+
+    def programDigest(self, program):
+        # the tile binary itself, a rebuilt program invalidates its results
+        if not isinstance(self.backend, backends.FileBackend):
+            return repr((type(self.backend).__name__, getattr(self.backend, "exact", None),
+                         getattr(self.backend, "precision", None))).encode()
+        stat = os.stat(program)
+        version = (program, stat.st_mtime_ns, stat.st_size)
+        with self.lock:
+            if version not in self.programDigests:
+                with open(program, 'rb') as file:
+                    self.programDigests[version] = hashlib.sha256(file.read()).digest()
+            return self.programDigests[version]
+
+    def key(self, command):
+        program, mainMemoryFile, streamInput, streamDest, streamingSetting, arguments = backends.splitTileCommand(command)
+        parameters, (inputAddress, inputSize), _ = backends.tileRanges(command)
+        digest = hashlib.sha256(self.programDigest(command[0]))
+        # packets carry the tile number, the output goes to every destination
+        digest.update(repr((program, streams.streamTile(streamInput), len(streamDest), streamingSetting, arguments)).encode())
+        ranges = parameters if streamingSetting // 10 else parameters + [(inputAddress, inputSize)]
+        for address, size in ranges:
+            digest.update(np.ascontiguousarray(self.backend.readMemory(mainMemoryFile, address, size), dtype=np.float32))
+        if streamingSetting // 10:
+            srcTiles, values = self.backend.streamPackets(streamInput)
+            digest.update(np.ascontiguousarray(srcTiles, dtype=np.uint8))
+            digest.update(np.ascontiguousarray(values, dtype=np.float32))
+        return digest.hexdigest()
+
+    def run(self, command):
+        program, mainMemoryFile, streamInput, streamDest, streamingSetting, arguments = backends.splitTileCommand(command)
+        readStream = streamingSetting // 10
+        writeStream = streamingSetting % 10
+        _, _, (outputAddress, outputSize) = backends.tileRanges(command)
+        key = self.key(command)
+
+        entry = self.cache.get(key)
+        if entry is not None:
+            with self.lock:
+                self.hits += 1
+            if readStream:
+                self.backend.streamPackets(streamInput, consume=True)
+            if writeStream:
+                self.backend.appendStreams(streamDest, entry["srcTiles"], entry["values"])
+            else:
+                self.backend.writeMemory(mainMemoryFile, entry["output"], outputAddress, outputSize)
+            return [] if self.profiling else None
+
+        with self.lock:
+            self.misses += 1
+        # every destination gets the same packets, they are read back from the first one,
+        # a tile writing the stream it reads consumes what was there and starts from an empty one
+        before = 0
+        if writeStream and not (readStream and streamDest[0] == streamInput):
+            before = len(self.backend.streamPackets(streamDest[0])[0])
+        result = self.backend.run(command)
+        if writeStream:
+            srcTiles, values = self.backend.streamPackets(streamDest[0])
+            self.cache.put(key, srcTiles=srcTiles[before:], values=values[..., before:])
+        else:
+            self.cache.put(key, output=self.backend.readMemory(mainMemoryFile, outputAddress, outputSize))
+        return result
+
+    def printReport(self):
+        total = self.hits + self.misses
+        print(f"result cache: {self.hits} of {total} tiles replayed, {self.misses} run, "
+              f"{self.cache.size() / 2**20:.1f} of {self.cache.maxBytes / 2**20:.0f} MB in {self.cache.cacheDir}"
+              + (f", {self.cache.evicted} evicted" if self.cache.evicted else ""))
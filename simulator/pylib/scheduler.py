@@ -0,0 +1,190 @@
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from pylib import backends
+
+def tileAccesses(command):
+    """Memory ranges (address, bytes) and stream files a tile program command reads and writes."""
+    program, mainMemoryFile, streamInput, streamDest, streamingSetting, arguments = backends.splitTileCommand(command)
+    readStream = streamingSetting // 10
+    writeStream = streamingSetting % 10
+    parameters, (inputAddress, inputSize), (outputAddress, outputSize) = backends.tileRanges(command)
+
+    memoryReads = [(address, 4 * size) for address, size in parameters]
+    if readStream == 0:
+        memoryReads.append((inputAddress, 4 * inputSize))
+    memoryWrites = [(outputAddress, 4 * outputSize)] if writeStream == 0 else []
+    streamReads = [streamInput] if readStream else []
+    streamWrites = list(streamDest) if writeStream else []
+    return memoryReads, memoryWrites, streamReads, streamWrites
+
+def overlaps(ranges, otherRanges):
+    return any(address < otherAddress + otherSize and otherAddress < address + size
+               for address, size in ranges for otherAddress, otherSize in otherRanges)
+
+def stagingPath(streamFile, node):
+    root, extension = os.path.splitext(streamFile)
+    return f"{root}.stage{node}{extension}"
+
+class Node:
+    def __init__(self, index, name, action, memoryReads, memoryWrites, streamReads, streamWrites, command):
+        self.index = index
+        self.name = name
+        self.action = action
+        self.memoryReads = memoryReads
+        self.memoryWrites = memoryWrites
+        # consuming a stream (tile input) or setting it up empties it, both are exclusive accesses
+        self.streamReads = streamReads
+        self.streamWrites = streamWrites
+        self.command = command
+        self.dependencies = set()
+        self.start = None
+        self.end = None
+
+class DataflowScheduler:
+    """Collects the instructions of a parseISA run and executes them as a dependency graph.
+
+    Memory edges come from overlapping address ranges (read after write, write after read and
+    write after write), stream edges from the outTiles field: a tile consuming a stream waits
+    for everything appended to it, an append waits for the previous consumer. Tiles appending
+    to the same stream (conv5 on tiles 5 and 6 into tile 7) run concurrently on private staging
+    streams, a gather step then appends the staged packets in program order before the stream
+    is consumed. Ready instructions run on a thread pool, the tile binaries as parallel
+    subprocesses."""
+
+    def __init__(self, backend, streamDepth, numThreads=None):
+        self.backend = backend
+        self.streamDepth = streamDepth
+        self.numThreads = numThreads or os.cpu_count()
+        self.nodes = []
+        # staging stream file -> streamDepth, each holds the output of one tile
+        self.stagingStreams = {}
+        self.wallTime = None
+
+    def add(self, name, action, memoryReads=(), memoryWrites=(), streamReads=(), streamWrites=(), command=None):
+        """Queue one instruction, command is the tile program command line (staging rewrites its destinations)."""
+        self.nodes.append(Node(len(self.nodes), name, action, list(memoryReads), list(memoryWrites),
+                               list(streamReads), list(streamWrites), command))
+
+    def addTile(self, name, command):
+        memoryReads, memoryWrites, streamReads, streamWrites = tileAccesses(command)
+        node = Node(len(self.nodes), name, None, memoryReads, memoryWrites, streamReads, streamWrites, list(command))
+        node.action = lambda: self.backend.run(node.command)
+        self.nodes.append(node)
+
+    def buildGraph(self):
+        nodes = list(self.nodes)
+
+        # memory edges
+        for node in nodes:
+            for earlier in nodes[: node.index]:
+                if (overlaps(node.memoryWrites, earlier.memoryReads + earlier.memoryWrites)
+                        or overlaps(node.memoryReads, earlier.memoryWrites)):
+                    node.dependencies.add(earlier)
+
+        # stream edges, appends between two exclusive accesses form a group
+        streamFiles = {stream for node in nodes for stream in node.streamReads + node.streamWrites}
+        for streamFile in sorted(streamFiles):
+            lastExclusive = None
+            group = []
+            for node in nodes + [None]:
+                if node is not None and streamFile in node.streamWrites and streamFile not in node.streamReads:
+                    if lastExclusive is not None:
+                        node.dependencies.add(lastExclusive)
+                    group.append(node)
+                    continue
+                if node is not None and streamFile not in node.streamReads:
+                    continue
+
+                # an exclusive access (or the end of the program) closes the group of appends
+                if len(group) > 1:
+                    group = [self.addGather(streamFile, group)]
+                if node is None:
+                    break
+                node.dependencies.update(group)
+                if lastExclusive is not None:
+                    node.dependencies.add(lastExclusive)
+                lastExclusive = node
+                group = []
+
+        for node in self.nodes:
+            node.successors = []
+        for node in self.nodes:
+            for dependency in node.dependencies:
+                dependency.successors.append(node)
+
+    def addGather(self, streamFile, group):
+        """Redirect each appending tile to its own staging stream and add the step that merges them in order."""
+        staging = []
+        for node in group:
+            stagingFile = stagingPath(streamFile, node.index)
+            # output streams follow the input stream in the tile command line
+            position = 3 + node.streamWrites.index(streamFile)
+            node.command[position] = stagingFile
+            self.stagingStreams[stagingFile] = 4 * max(backends.tileRanges(node.command)[2][1], 1)
+            staging.append(stagingFile)
+
+        def gather():
+            for stagingFile in staging:
+                self.backend.moveStream(stagingFile, streamFile)
+
+        gatherNode = Node(len(self.nodes), f"gather {os.path.basename(streamFile)}", gather, [], [], [], [], None)
+        gatherNode.dependencies.update(group)
+        self.nodes.append(gatherNode)
+        return gatherNode
+
+    def run(self):
+        self.buildGraph()
+        remaining = {node: len(node.dependencies) for node in self.nodes}
+
+        def execute(node):
+            node.start = time.perf_counter()
+            node.action()
+            node.end = time.perf_counter()
+            return node
+
+        # the staging streams go away even when an instruction fails, the next pass sets them up again
+        stagingFiles = []
+        try:
+            for stagingFile, streamDepth in self.stagingStreams.items():
+                self.backend.setupStream(streamDepth, stagingFile)
+                stagingFiles.append(stagingFile)
+
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=self.numThreads) as pool:
+                running = {pool.submit(execute, node) for node in self.nodes if remaining[node] == 0}
+                while running:
+                    done, running = wait(running, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        node = future.result()
+                        for successor in node.successors:
+                            remaining[successor] -= 1
+                            if remaining[successor] == 0:
+                                running.add(pool.submit(execute, successor))
+            self.wallTime = time.perf_counter() - start
+        finally:
+            for stagingFile in stagingFiles:
+                self.backend.removeStream(stagingFile)
+
+    def criticalPath(self):
+        """Longest chain of dependent instructions by measured duration, as (nodes, seconds)."""
+        longest = {}
+        for node in sorted(self.nodes, key=lambda node: node.start):
+            previous = max(node.dependencies, key=lambda dependency: longest[dependency][1], default=None)
+            chain, length = longest[previous] if previous is not None else ([], 0.0)
+            longest[node] = (chain + [node], length + node.end - node.start)
+        return max(longest.values(), key=lambda entry: entry[1])
+
+    def report(self):
+        work = sum(node.end - node.start for node in self.nodes)
+        path, pathTime = self.criticalPath()
+        return {"wallTime": self.wallTime, "workTime": work, "parallelism": work / self.wallTime,
+                "criticalPath": [node.name for node in path], "criticalPathTime": pathTime}
+
+    def printReport(self):
+        report = self.report()
+        print(f"{len(self.nodes)} instructions on {self.numThreads} threads")
+        print(f"wall {report['wallTime'] * 1e3:.2f}ms, work {report['workTime'] * 1e3:.2f}ms, "
+              f"achieved parallelism {report['parallelism']:.2f}")
+        print(f"critical path {report['criticalPathTime'] * 1e3:.2f}ms: " + " -> ".join(report['criticalPath']))
@@ -0,0 +1,41 @@
+import hashlib
+import os
+
+from pylib import isa
+
+# per-image objects, written by every run and never part of a snapshot
+BATCH_OBJECTS = ('image',)
+
+def residentLayout(program, batchObjects=BATCH_OBJECTS):
+    """memcpy2device instructions of the objects that stay in device memory between runs (weights, biases)."""
+    return [instruction for instruction in program.instructions
+            if isinstance(instruction, isa.Memcpy2Device) and instruction.name not in batchObjects]
+
+def snapshotKey(paramsFile, program, memorySize, batchObjects=BATCH_OBJECTS):
+    """Hash of the parameter file and where the program copies it, any change gives a new snapshot."""
+    digest = hashlib.sha256()
+    with open(paramsFile, 'rb') as file:
+        for block in iter(lambda: file.read(1024 * 1024), b''):
+            digest.update(block)
+    digest.update(repr((memorySize, residentLayout(program, batchObjects))).encode())
+    return digest.hexdigest()[:16]
+
+def setupResidentMemory(backend, program, memorySize, mainMemoryFile, dataObjects, snapshotDir, key,
+                        batchObjects=BATCH_OBJECTS):
+    """Set up main memory holding the resident objects of program, cloned from a snapshot when one exists.
+
+    On a miss the memory is set up and written as usual, then saved for the next run. Returns
+    the names of the resident objects (residentObjects of parseISA, so they are not copied
+    again) and whether the snapshot was hit."""
+    layout = residentLayout(program, batchObjects)
+    snapshotFile = os.path.join(snapshotDir, "mainmemory-" + key + backend.snapshotSuffix(mainMemoryFile))
+    hit = os.path.exists(snapshotFile)
+    if hit:
+        backend.loadMemory(snapshotFile, mainMemoryFile)
+    else:
+        backend.setupMemory(memorySize, mainMemoryFile)
+        for name, address, size in layout:
+            backend.writeMemory(mainMemoryFile, dataObjects[name], address, size)
+        os.makedirs(snapshotDir, exist_ok=True)
+        backend.saveMemory(mainMemoryFile, snapshotFile)
+    return {instruction.name for instruction in layout}, hit
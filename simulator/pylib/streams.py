@@ -0,0 +1,216 @@
+import argparse
+import os
+import re
+import struct
+from collections import namedtuple
+from contextlib import contextmanager
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from pylib import memManage
+
+# binary stream files (ending in memManage.BINARY_SUFFIX) are a bounded ring buffer shared by up to
+# MAX_READERS reader tiles, the StreamHeader of src/*.c: magic, capacity, a bit mask of the reader tiles,
+# tail (next free record) and a read cursor (head, count) per reader, followed by capacity packed records
+# of one srcTile byte and a little-endian float32
+STREAM_MAGIC = b"STRM"
+MAX_READERS = 16
+STREAM_HEADER = struct.Struct(f"<4sIII{MAX_READERS}I{MAX_READERS}I")
+STREAM_RECORD = np.dtype([("srcTile", np.uint8), ("value", "<f4")])
+
+StreamHeader = namedtuple("StreamHeader", "capacity readers tail heads counts")
+
+class StreamError(ValueError):
+    """A file that is not a stream, a reader it does not have, or a write that does not fit."""
+
+def isBinaryStream(streamFile):
+    return streamFile.endswith(memManage.BINARY_SUFFIX)
+
+def streamTile(streamFile):
+    """Tile number of a stream<N> (or stream<N>.bin) file, 0 for any other name like the tile programs."""
+    match = re.match(r"stream(\d+)", os.path.basename(streamFile))
+    return int(match.group(1)) if match else 0
+
+def streamCapacity(streamDepth):
+    # streamDepth counts 4 bytes per value, the 1MB default holds as many as a tile reads in one go (MAX_STREAM_ELEMENTS)
+    return streamDepth // 4
+
+def ringRuns(capacity, first, count):
+    # records [first, first + count) of a ring as at most two (record, length) runs, wrapping past the end
+    firstPart = min(capacity - first, count)
+    return [(record, length) for record, length in ((first, firstPart), (0, count - firstPart)) if length]
+
+def packHeader(header):
+    return STREAM_HEADER.pack(STREAM_MAGIC, header.capacity, header.readers, header.tail, *header.heads, *header.counts)
+
+@contextmanager
+def lockedStream(streamFile):
+    # the tiles take the same flock before touching the header of a (possibly shared) binary stream
+    with open(streamFile, 'r+b') as stream_file:
+        if fcntl is not None:
+            fcntl.flock(stream_file.fileno(), fcntl.LOCK_EX)
+        yield stream_file
+
+class Stream:
+    """Inspect, produce and consume a stream file the way the tile programs do.
+
+    Text streams ("%08X\\n" count, then hex lines) grow without bound and have one reader. Binary .bin
+    streams are a ring buffer of fixed capacity with a read cursor per reader tile: reads go through
+    the cursor of reader (the tile named by the file by default), a write is seen by every reader and
+    raises StreamError when the slowest reader has no room left."""
+
+    def __init__(self, streamFile, reader=None):
+        self.streamFile = streamFile
+        self.binary = isBinaryStream(streamFile)
+        self.reader = streamTile(streamFile) if reader is None else reader
+
+    @classmethod
+    def create(cls, streamDepth, streamFile, readers=None):
+        """An empty stream with room for streamDepth / 4 packets read by readers.
+
+        A text stream is written out as zero lines for its count and that many packets (appends
+        past them still grow the file), a binary stream is a ring of exactly that capacity."""
+        capacity = streamCapacity(streamDepth)
+        if not isBinaryStream(streamFile):
+            memManage.setupMemory((memManage.STREAM_HEADER_SIZE + capacity * memManage.STREAM_RECORD_SIZE)
+                                  // memManage.HEX_LINE_SIZE, streamFile)
+            return cls(streamFile)
+        readers = [streamTile(streamFile)] if readers is None else readers
+        header = StreamHeader(capacity, sum(1 << reader for reader in set(readers)), 0,
+                              [0] * MAX_READERS, [0] * MAX_READERS)
+        # a new file, truncating in place would also reset the streams still linked to the old one
+        if os.path.lexists(streamFile):
+            os.remove(streamFile)
+        with open(streamFile, 'wb') as stream_file:
+            stream_file.write(packHeader(header))
+            stream_file.truncate(STREAM_HEADER.size + capacity * STREAM_RECORD.itemsize)
+        return cls(streamFile)
+
+    @classmethod
+    def createShared(cls, streamDepth, streamFiles):
+        """One binary stream read by the tiles of all streamFiles, the other files are hard links to the first."""
+        first = cls.create(streamDepth, streamFiles[0], [streamTile(streamFile) for streamFile in streamFiles])
+        for streamFile in streamFiles[1:]:
+            linkFile = f"{streamFile}.{os.getpid()}.link"
+            os.link(streamFiles[0], linkFile)
+            os.replace(linkFile, streamFile)
+        return [first] + [cls(streamFile) for streamFile in streamFiles[1:]]
+
+    def header(self, stream_file=None):
+        """The StreamHeader of a binary stream."""
+        if stream_file is None:
+            with open(self.streamFile, 'rb') as stream_file:
+                return self.header(stream_file)
+        stream_file.seek(0)
+        magic, capacity, readers, tail, *cursors = STREAM_HEADER.unpack(stream_file.read(STREAM_HEADER.size))
+        if magic != STREAM_MAGIC:
+            raise StreamError(f"{self.streamFile} is not a binary stream")
+        return StreamHeader(capacity, readers, tail, cursors[:MAX_READERS], cursors[MAX_READERS:])
+
+    def readerTiles(self, header=None):
+        header = header or self.header()
+        return [reader for reader in range(MAX_READERS) if header.readers >> reader & 1]
+
+    def checkReader(self, header):
+        if not 0 <= self.reader < MAX_READERS or not header.readers >> self.reader & 1:
+            raise StreamError(f"tile {self.reader} does not read {self.streamFile}")
+        return self.reader
+
+    @property
+    def capacity(self):
+        """Records a binary stream holds, None for a text stream."""
+        return self.header().capacity if self.binary else None
+
+    def __len__(self):
+        """Packets left for this reader."""
+        if self.binary:
+            header = self.header()
+            return header.counts[self.checkReader(header)]
+        with open(self.streamFile, 'rb') as stream_file:
+            return memManage.readStreamCount(stream_file)
+
+    def read(self, consume=True):
+        """Every packet left for this reader as (srcTiles, values), consume advances its cursor like readArrayFromStream."""
+        if not self.binary:
+            return memManage.readStreamFile(self.streamFile, consume)
+        with lockedStream(self.streamFile) as stream_file:
+            header = self.header(stream_file)
+            reader = self.checkReader(header)
+            head, count = header.heads[reader], header.counts[reader]
+            parts = []
+            for record, length in ringRuns(header.capacity, head, count):
+                stream_file.seek(STREAM_HEADER.size + record * STREAM_RECORD.itemsize)
+                parts.append(np.frombuffer(stream_file.read(length * STREAM_RECORD.itemsize), dtype=STREAM_RECORD))
+            if consume:
+                header.heads[reader] = (head + count) % header.capacity
+                header.counts[reader] = 0
+                stream_file.seek(0)
+                stream_file.write(packHeader(header))
+        records = np.concatenate(parts) if parts else np.empty(0, dtype=STREAM_RECORD)
+        return records["srcTile"].copy(), records["value"].astype(np.float32)
+
+    def peek(self):
+        return self.read(consume=False)
+
+    def write(self, srcTiles, values):
+        """Append packets for every reader like writeArrayToStream, srcTiles is one tile or one per value."""
+        values = np.asarray(values, dtype=np.float32).reshape(-1)
+        if not self.binary:
+            memManage.appendStreamFile(self.streamFile, srcTiles, values)
+            return
+        records = np.empty(values.size, dtype=STREAM_RECORD)
+        records["srcTile"] = srcTiles
+        records["value"] = values
+        with lockedStream(self.streamFile) as stream_file:
+            header = self.header(stream_file)
+            readers = self.readerTiles(header)
+            # the slowest reader decides how much of the ring is still in use
+            used = max((header.counts[reader] for reader in readers), default=0)
+            if used + values.size > header.capacity:
+                raise StreamError(f"{self.streamFile}: {values.size} values do not fit in "
+                                  f"{header.capacity - used} free records")
+            written = 0
+            for record, length in ringRuns(header.capacity, header.tail, values.size):
+                stream_file.seek(STREAM_HEADER.size + record * STREAM_RECORD.itemsize)
+                stream_file.write(records[written : written + length].tobytes())
+                written += length
+            for reader in readers:
+                header.counts[reader] += values.size
+            stream_file.seek(0)
+            stream_file.write(packHeader(header._replace(tail=(header.tail + values.size) % header.capacity)))
+
+    def moveTo(self, other):
+        """Append every packet to another stream and empty this one."""
+        srcTiles, values = self.read()
+        other.write(srcTiles, values)
+
+def main():
+    parser = argparse.ArgumentParser(description="Print the header and packets of stream files")
+    parser.add_argument("streams", nargs="+", help="stream files, .bin for binary ring streams")
+    parser.add_argument("--values", type=int, default=8, help="packets to print per stream")
+    parser.add_argument("--reader", type=int, help="reader tile of binary streams (default: the tile of the file name)")
+    args = parser.parse_args()
+
+    for streamFile in args.streams:
+        stream = Stream(streamFile, args.reader)
+        try:
+            if stream.binary:
+                header = stream.header()
+                cursors = ", ".join(f"tile {reader} head {header.heads[reader]} count {header.counts[reader]}"
+                                    for reader in stream.readerTiles(header))
+                print(f"{streamFile}: binary, capacity {header.capacity}, tail {header.tail}, readers: {cursors}")
+            else:
+                print(f"{streamFile}: text, {len(stream)} packets")
+            srcTiles, values = stream.peek()
+        except (OSError, StreamError) as error:
+            print("Error:", error)
+            raise SystemExit(1)
+        for srcTile, value in list(zip(srcTiles, values))[:args.values]:
+            print(f"  from tile {srcTile}: {float(value)!r}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+import threading
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from pylib import backends
+from pylib import isa
+from pylib import kernels
+from pylib import profiler
+from pylib import streams
+
+# largest |tile - reference| accepted, the threshold of the old sanity check in runDev.py
+TOLERANCE = 1e-3
+
+def referenceConvolution(inputImage, convWeight, convBias):
+    """convR8_32_5 in float64: valid stride 1 convolution with ReLU as one einsum over the 5x5 windows."""
+    windows = sliding_window_view(inputImage, convWeight.shape[-2:], axis=(-2, -1))
+    output = np.einsum("...chwij,ocij->...ohw", windows, convWeight) + convBias[:, None, None]
+    return np.maximum(output, 0)
+
+def referenceMaxPooling(inputImage, poolSize, stride):
+    """maxp2_2 in float64: the maximum of the poolSize * poolSize strided shifts of the input."""
+    height, width = inputImage.shape[-2:]
+    outputHeight = (height - poolSize) // stride + 1
+    outputWidth = (width - poolSize) // stride + 1
+    shifts = [inputImage[..., i : i + stride * (outputHeight - 1) + 1 : stride, j : j + stride * (outputWidth - 1) + 1 : stride]
+              for i in range(poolSize) for j in range(poolSize)]
+    return np.max(shifts, axis=0)
+
+def referenceFullyConnected(inputData, fcWeight, fcBias):
+    """fc128_64 in float64: matmul with bias and ReLU."""
+    return np.maximum(np.einsum("...i,oi->...o", inputData, fcWeight) + fcBias, 0)
+
+def referenceOutput(command, inputData, parameters):
+    """Flat (samples, outputSize) float64 reference of a tile command for its (samples, inputSize) input."""
+    program, _, _, _, _, arguments = backends.splitTileCommand(command)
+    inputData = inputData.astype(np.float64)
+    samples = len(inputData)
+    if program == "convR8_32_5":
+        _, _, _, _, inputChannels, height, width, outputChannels = arguments
+        weight, bias = (parameter.astype(np.float64) for parameter in parameters)
+        weight = weight.reshape(outputChannels, inputChannels, kernels.FILTER_SIZE, kernels.FILTER_SIZE)
+        output = referenceConvolution(inputData.reshape(samples, inputChannels, height, width), weight, bias)
+    elif program == "maxp2_2":
+        _, _, inputChannels, height, width, poolSize, stride = arguments
+        output = referenceMaxPooling(inputData.reshape(samples, inputChannels, height, width), poolSize, stride)
+    else:
+        _, _, _, _, inputChannels, outputChannels = arguments
+        weight, bias = (parameter.astype(np.float64) for parameter in parameters)
+        output = referenceFullyConnected(inputData, weight.reshape(outputChannels, inputChannels), bias)
+    return output.reshape(samples, -1)
+
+class ValidationError(ValueError):
+    """A tile output that differs from the reference by more than the tolerance."""
+
+    def __init__(self, name, error, tolerance):
+        maxAbs, maxRel, sample, element = error
+        super().__init__(f"{name} diverges from the reference: max |error| {maxAbs:.6g} (relative {maxRel:.6g}) "
+                         f"at value {element} of image {sample} of the pass, tolerance {tolerance:g}")
+        self.name = name
+        self.error = error
+
+class ValidatingBackend(profiler.BackendWrapper):
+    """Wraps a backend and checks every tile it runs against a float64 NumPy reference of the layer.
+
+    Before a tile runs its input is captured from main memory or from the packets waiting in its
+    stream, after it ran its output from main memory or from the packets it appended to its
+    destination stream, and the reference computed from the same input and parameters. So every
+    instruction is checked on its own: the first one over the tolerance raises ValidationError
+    there, instead of the error showing up layers later. printReport gives the max absolute and
+    relative error of every instruction over all images it ran on."""
+
+    def __init__(self, backend, program, tolerance=TOLERANCE):
+        super().__init__(backend)
+        self.tolerance = tolerance
+        self.lock = threading.Lock()
+        # (opcode, tile, arguments) -> line and instruction, in program order
+        self.instructions = {}
+        for lineNumber, instruction in zip(program.lineNumbers, program.instructions):
+            if isinstance(instruction, isa.TileInstruction):
+                key = (instruction.opcode, instruction.tile, tuple(instruction.arguments()))
+                self.instructions.setdefault(key, (lineNumber, instruction))
+        # name -> [images, max |error|, max relative error, max |reference|]
+        self.errors = {}
+
+    def instructionName(self, command):
+        program, _, streamInput, _, _, arguments = backends.splitTileCommand(command)
+        tile = streams.streamTile(streamInput)
+        lineNumber, _ = self.instructions.get((program, tile, tuple(arguments)), (None, None))
+        return f"line {lineNumber} {program} tile {tile}" if lineNumber is not None else f"{program} tile {tile}"
+
+    def samples(self, data, size):
+        # (samples, size): one row per image of a batch, shared memory read by a batch counts for every image
+        data = np.asarray(data, dtype=np.float32)
+        batchSize = getattr(self.backend, "batchSize", None)
+        if data.ndim == 1 and batchSize is not None:
+            return np.broadcast_to(data[:size], (batchSize, size))
+        return data.reshape(-1, data.shape[-1])[:, :size]
+
+    def run(self, command):
+        _, mainMemoryFile, streamInput, streamDest, streamingSetting, _ = backends.splitTileCommand(command)
+        readStream = streamingSetting // 10
+        writeStream = streamingSetting % 10
+        parameterRanges, (inputAddress, inputSize), (outputAddress, outputSize) = backends.tileRanges(command)
+
+        parameters = [self.backend.readMemory(mainMemoryFile, address, size) for address, size in parameterRanges]
+        if readStream:
+            inputData = self.backend.streamPackets(streamInput)[1]
+        else:
+            inputData = self.backend.readMemory(mainMemoryFile, inputAddress, inputSize)
+        inputData = self.samples(inputData, inputSize)
+        # a tile writing the stream it reads starts from an empty one
+        before = 0
+        if writeStream and streamDest[0] != streamInput:
+            before = len(self.backend.streamPackets(streamDest[0])[0])
+
+        result = self.backend.run(command)
+
+        if writeStream:
+            output = self.backend.streamPackets(streamDest[0])[1][..., before : before + outputSize]
+        else:
+            output = self.backend.readMemory(mainMemoryFile, outputAddress, outputSize)
+        output = self.samples(output, outputSize)
+        self.check(self.instructionName(command), output, referenceOutput(command, inputData, parameters))
+        return result
+
+    def check(self, name, output, reference):
+        if output.shape != reference.shape:
+            raise ValidationError(name, (np.inf, np.inf, 0, min(output.shape[-1], reference.shape[-1])), self.tolerance)
+        difference = np.abs(output.astype(np.float64) - reference)
+        sample, element = np.unravel_index(np.argmax(difference), difference.shape)
+        maxAbs = float(difference[sample, element])
+        scale = float(np.abs(reference).max(initial=0.0))
+        maxRel = maxAbs / scale if scale > 0 else maxAbs
+        with self.lock:
+            images, worstAbs, worstRel, worstScale = self.errors.get(name, (0, 0.0, 0.0, 0.0))
+            self.errors[name] = (images + len(output), max(worstAbs, maxAbs), max(worstRel, maxRel),
+                                 max(worstScale, scale))
+        if not maxAbs <= self.tolerance:
+            raise ValidationError(name, (maxAbs, maxRel, int(sample), int(element)), self.tolerance)
+
+    def printReport(self):
+        """Worst error of every tile instruction over all passes, relative to the largest reference value."""
+        print(f"validation against the float64 reference, tolerance {self.tolerance:g}:")
+        for name, (images, maxAbs, maxRel, scale) in self.errors.items():
+            print(f"  {name:<30} {images:6d} images  max |error| {maxAbs:.3g}  relative {maxRel:.3g}  "
+                  f"(max |reference| {scale:.3g})" + ("  DIVERGES" if not maxAbs <= self.tolerance else ""))
@@ -1,228 +1,376 @@
+import argparse
+import atexit
+import os
 import struct
-import subprocess
+import time
 import numpy as np
 
 from pylib import readbins
+from pylib import registry
 from pylib import memManage
+from pylib import backends
+from pylib import capacity
+from pylib import feeder
+from pylib import isa
+from pylib import parallel
+from pylib import precision
+from pylib import profiler
+from pylib import resultCache
+from pylib import snapshot
+from pylib import validate
+from pylib import scheduler as dataflow
+from pylib.backends import exeCommand
 
-def exeCommand(command):
-    # print("Executing command:", ' '.join(command))
-    # return
+def parseISA(source_file_path, binDir, dataDir, memoryDir, streamDepth, dataObjects, memoryFormat="text", backend=None,
+             batchObjects=(), residentObjects=None, scheduler=None):
     
-    result = subprocess.run(command, capture_output=True, text=True)
-    # Check if the command was executed successfully
-    if result.returncode == 0:
-        # Command executed successfully, print stdout
-        print("Output:")
-        print(result.stdout)
+    # source_file_path may also be a program already compiled by isa.loadProgram
+    program = isa.loadProgram(source_file_path) if isinstance(source_file_path, str) else source_file_path
+    
+    # tile programs run as src/ binaries unless an in-process backend is given
+    if backend is None:
+        backend = backends.FileBackend()
+    
+    executor = isa.Executor(backend, binDir, memoryDir, streamDepth, dataObjects, memoryFormat,
+                            batchObjects, residentObjects, scheduler)
+    return executor.run(program)
+
+def runBatch(program, binDir, dataDir, memoryDir, streamDepth, dataObjects, images, labels, numImages, batchSize,
+             memoryFormat="text", backend=None, outputName="output", numThreads=None, residentObjects=None,
+             prefetch=4, imageFeeder=None):
+    """Run a compiled program over the first numImages images, copying the weights to the device once.
+
+    Backends with setBatch (NumPy) run batchSize images per pass with a batch dimension in every
+    tile, the subprocess backend runs one image per pass on the same main memory.
+    With numThreads every pass runs on the dataflow scheduler. residentObjects names objects
+    already in device memory (a restored snapshot).
+    The images are read and preprocessed up to prefetch passes ahead on a feeder thread, pass an
+    imageFeeder to read its stats afterwards.
+    Returns the (numImages, outputs) results, top-1 accuracy against labels and images/second."""
+    if backend is None:
+        backend = backends.FileBackend(verbose=False)
+    batched = hasattr(backend, "setBatch")
+    if not batched:
+        batchSize = 1
+
+    residentObjects = set() if residentObjects is None else set(residentObjects)
+    outputs = []
+    start = time.perf_counter()
+    if imageFeeder is None:
+        imageFeeder = feeder.ImageFeeder(images, numImages, batchSize, prefetch)
+    for indices, batch in imageFeeder:
+        if batched:
+            backend.setBatch(len(indices))
+        dataObjects['image'] = batch
+        scheduler = dataflow.DataflowScheduler(backend, streamDepth, numThreads) if numThreads else None
+        outdata = parseISA(program, binDir, dataDir, memoryDir, streamDepth, dataObjects, memoryFormat, backend,
+                           batchObjects={'image'}, residentObjects=residentObjects, scheduler=scheduler)
+        outputs.append(np.reshape(outdata[outputName], (len(indices), -1)))
+    elapsed = time.perf_counter() - start
+
+    outputs = np.concatenate(outputs)
+    predictions = outputs.argmax(axis=1)
+    accuracy = np.mean(predictions == np.frombuffer(labels, dtype=np.uint8)[:numImages])
+    return outputs, accuracy, numImages / elapsed
+
+def measureFootprint(backend, program, mainMemoryFile, trafficBefore):
+    """Bytes a numpy backend actually stored: the parameters, main memory and the traffic since trafficBefore."""
+    return {"parameters": sum(backend.storedBytes(mainMemoryFile, address, size)
+                              for _, address, size in snapshot.residentLayout(program)),
+            "memory": backend.memoryBytes(mainMemoryFile),
+            "memoryTraffic": backend.traffic["memory"] - trafficBefore["memory"],
+            "streamTraffic": backend.traffic["stream"] - trafficBefore["stream"]}
+
+def mergeFootprints(results):
+    # every worker holds the same parameters and memory, the traffic adds up
+    footprints = [result["footprint"] for result in results]
+    return dict(footprints[0], memoryTraffic=sum(footprint["memoryTraffic"] for footprint in footprints),
+                streamTraffic=sum(footprint["streamTraffic"] for footprint in footprints))
+
+def runShard(first, count, shardImages, shardLabels, program, binDir, streamDepth, sizeOfmainMemory, dataObjects,
+             batchSize, memoryFormat, backendName, exact, snapshotDir=None, snapshotKey=None, precisionName="fp32"):
+    """Worker side of runParallel: run images first..first+count in a private memory/stream workspace."""
+    start = time.perf_counter()
+    memoryDir = parallel.makeWorkspace()
+    backend = backends.makeBackend(backendName, verbose=False, exact=exact, precision=precisionName)
+    try:
+        mainMemoryFile = memManage.mainMemoryPath(memoryDir, memoryFormat)
+        residentObjects = None
+        if snapshotKey is None:
+            backend.setupMemory(sizeOfmainMemory, mainMemoryFile)
+        else:
+            residentObjects, _ = snapshot.setupResidentMemory(backend, program, sizeOfmainMemory, mainMemoryFile,
+                                                              dataObjects, snapshotDir, snapshotKey)
+        setupTime = time.perf_counter() - start
+        trafficBefore = dict(getattr(backend, "traffic", {}))
+        outputs, _, throughput = runBatch(program, binDir, None, memoryDir, streamDepth, dataObjects.copy(), shardImages,
+                                          shardLabels, count, batchSize, memoryFormat, backend,
+                                          residentObjects=residentObjects)
+        # the numpy backend counts the bytes it stores
+        footprint = measureFootprint(backend, program, mainMemoryFile, trafficBefore) if trafficBefore else None
+    finally:
+        backend.close()
+        parallel.removeWorkspace(memoryDir)
+    return {"first": first, "count": count, "outputs": outputs, "pid": os.getpid(),
+            "setupTime": setupTime, "runTime": count / throughput, "throughput": throughput, "footprint": footprint}
+
+def runParallel(program, binDir, streamDepth, sizeOfmainMemory, dataObjects, images, labels, numImages, numWorkers,
+                batchSize, memoryFormat="text", backendName="subprocess", exact=False, snapshotDir=None, snapshotKey=None,
+                precisionName="fp32"):
+    """Shard the first numImages images over numWorkers processes, each with its own workspace.
+
+    Returns the merged (numImages, outputs) results, top-1 accuracy, images/second over the
+    wall time of the pool and the per-shard results of runShard. With snapshotKey every worker
+    clones the weights from the snapshot in snapshotDir instead of copying them itself."""
+    # the parameters go to every worker, each gets only its own slice of the images and labels
+    weights = dataObjects.copy()
+    for name in ('images', 'labels', 'image'):
+        if name in weights:
+            del weights[name]
+
+    def shardData(first, count):
+        # raw pixels are flat, a preprocessed set has one (1, 32, 32) entry per image
+        if images.ndim == 4:
+            shardImages = images[first : first + count]
+        else:
+            shardImages = images[first * 28 * 28 : (first + count) * 28 * 28]
+        return np.ascontiguousarray(shardImages), labels[first : first + count]
+
+    shards = parallel.shardRanges(numImages, numWorkers)
+    results, wallTime = parallel.runSharded(runShard, shards, numWorkers, program, binDir, streamDepth, sizeOfmainMemory,
+                                            weights, batchSize, memoryFormat, backendName, exact, snapshotDir,
+                                            snapshotKey, precisionName, shardData=shardData)
+
+    outputs = np.concatenate([result['outputs'] for result in results])
+    accuracy = np.mean(outputs.argmax(axis=1) == np.frombuffer(labels, dtype=np.uint8)[:numImages])
+    return outputs, accuracy, numImages / wallTime, results, wallTime
+
+def runReference(args, program, binDir, memoryDir, streamDepth, sizeOfmainMemory, dataObjects, images, labels,
+                 numImages, snapshotKey):
+    """Outputs and measured footprint of the same images on an fp32 numpy backend, the baseline of a
+    reduced-precision run."""
+    if args.workers:
+        outputs, _, _, results, _ = runParallel(program, binDir, streamDepth, sizeOfmainMemory, dataObjects, images,
+                                                labels, numImages, args.workers, args.batch_size, args.memory_format,
+                                                "numpy", args.exact, args.snapshot_dir, snapshotKey)
+        return outputs, mergeFootprints(results)
+    backend = backends.makeBackend("numpy", exact=args.exact)
+    mainMemoryFile = memManage.mainMemoryPath(memoryDir, args.memory_format)
+    residentObjects = None
+    if snapshotKey is None:
+        backend.setupMemory(sizeOfmainMemory, mainMemoryFile)
     else:
-        # There was an error, print stderr
-        print("Error:")
-        print(result.stderr)
-
-def parseISA(source_file_path, binDir, dataDir, memoryDir, streamDepth, dataObjects):
-    
-    programedTiles = [None] * 16
-    outdata= {}
-    
-    # Open the source file to read from
-    with open(source_file_path, 'r') as file:
-        for line in file:
-            # skip empty lines and comments
-            if not line.strip() or line.strip().startswith('#'):
-                    continue  # Skip the line
-            
-            data = line.strip().split()            
-            if data[0] == "program":
-                # print("program", "memory/stream" + data[1], data[2])
-                programedTiles[int(data[1])] = data[2]
-                memManage.setupMemory(streamDepth, "memory/stream" + data[1]) #conv1
-            elif data[0] == "memcpy2device":
-                # print("memcpy2device", memoryDir + "mainmemory", data[1], data[2], data[3])
-                memManage.writeFloatArrayToMemory(memoryDir + "mainmemory", dataObjects[data[1]], int(data[2]), int(data[3]))
-            elif data[0] == "memcpy2host":
-                # print("memcpy2host", memoryDir + "mainmemory", data[1], data[2], data[3])
-                outdata[data[1]] = memManage.readArrayFromMemory(memoryDir + "mainmemory", int(data[2]), int(data[3]))
-            elif data[0] == "convR8_32_5":
-                if (not programedTiles[int(data[1])] == data[0]):
-                    print("Error: Tile not programmed")
-                    return
-                # FPGA program
-                command = []
-                # program name
-                command.append(binDir + data[0])
-                # main device memory
-                command.append(memoryDir + "mainmemory")
-                # input stream
-                command.append(memoryDir + "stream" + data[1])                
-                # output stream
-                destTiles = data[2].split("-")
-                for tile in destTiles:
-                    command.append("memory/stream" + tile)
-                
-                # stream setting
-                if data[3] == "MM":
-                    command.append("00")
-                elif data[3] == "MS":
-                    command.append("01")
-                elif data[3] == "SM":
-                    command.append("10")
-                elif data[3] == "SS":
-                    command.append("11")
-                else:
-                    print("Error: Invalid stream configuration")
-                    return
-                
-                # input start address
-                command.append(data[4])
-                # conv weights start address
-                command.append(data[5])
-                # conv bias start address
-                command.append(data[6])
-                # output start address
-                command.append(data[7])
-                
-                # input channel
-                command.append(data[8])
-                # input height
-                command.append(data[9])
-                # input width
-                command.append(data[10])
-                # output channel
-                command.append(data[11])
-                    
-                exeCommand(command)
-            elif data[0] == "maxp2_2":
-                if (not programedTiles[int(data[1])] == data[0]):
-                    print("Error: Tile not programmed")
-                    return
-                # FPGA program
-                command = []
-                # program name
-                command.append(binDir + data[0])
-                # main device memory
-                command.append(memoryDir + "mainmemory")
-                # input stream
-                command.append(memoryDir + "stream" + data[1])                
-                # output stream
-                destTiles = data[2].split("-")
-                for tile in destTiles:
-                    command.append("memory/stream" + tile)
-                
-                # stream setting
-                if data[3] == "MM":
-                    command.append("00")
-                elif data[3] == "MS":
-                    command.append("01")
-                elif data[3] == "SM":
-                    command.append("10")
-                elif data[3] == "SS":
-                    command.append("11")
-                else:
-                    print("Error: Invalid stream configuration")
-                    return
-                
-                # input start address
-                command.append(data[4])
-                # output start address
-                command.append(data[5])
-                
-                # input channel
-                command.append(data[6])
-                # input height
-                command.append(data[7])
-                # input width
-                command.append(data[8])
-                # poolsize
-                command.append(data[9])
-                # stride 
-                command.append(data[10])
-                    
-                exeCommand(command)
-            elif data[0] == "fc128_64":
-                if (not programedTiles[int(data[1])] == data[0]):
-                    print("Error: Tile not programmed")
-                    return
-                # FPGA program
-                command = []
-                # program name
-                command.append(binDir + data[0])
-                # main device memory
-                command.append(memoryDir + "mainmemory")
-                # input stream
-                command.append(memoryDir + "stream" + data[1])                
-                # output stream
-                destTiles = data[2].split("-")
-                for tile in destTiles:
-                    command.append("memory/stream" + tile)
-                
-                # stream setting
-                if data[3] == "MM":
-                    command.append("00")
-                elif data[3] == "MS":
-                    command.append("01")
-                elif data[3] == "SM":
-                    command.append("10")
-                elif data[3] == "SS":
-                    command.append("11")
-                else:
-                    print("Error: Invalid stream configuration")
-                    return
-                
-                # input start address
-                command.append(data[4])
-                # conv weights start address
-                command.append(data[5])
-                # conv bias start address
-                command.append(data[6])
-                # output start address
-                command.append(data[7])
-                
-                # input channel
-                command.append(data[8])
-                # output channel
-                command.append(data[9])
-                    
-                exeCommand(command)    
-            else:
-                print("Error: Invalid Instruction")
-                returns        
-    # print(programedTiles)
-    return outdata
+        residentObjects, _ = snapshot.setupResidentMemory(backend, program, sizeOfmainMemory, mainMemoryFile,
+                                                          dataObjects, args.snapshot_dir, snapshotKey)
+    trafficBefore = dict(backend.traffic)
+    outputs = runBatch(program, binDir, None, memoryDir, streamDepth, dataObjects, images, labels, numImages,
+                       args.batch_size, args.memory_format, backend, numThreads=args.schedule,
+                       residentObjects=residentObjects, prefetch=args.prefetch)[0]
+    return outputs, measureFootprint(backend, program, mainMemoryFile, trafficBefore)
+
+def writeProfile(backend, traceFile):
+    profile = backend.profile()
+    profile.printSummary()
+    profile.writeChromeTrace(traceFile)
+    print("trace written to", traceFile, "(open in chrome://tracing or ui.perfetto.dev)")
 
 if __name__ == "__main__":
     
+    parser = argparse.ArgumentParser(description="Run an ISA program on the FPGA tile simulator")
+    parser.add_argument("--isa", default="./lenetFPGA.ISA", help="ISA program to run")
+    parser.add_argument("--data-dir", default="data/", help="directory holding images.bin, labels.bin and params.bin")
+    parser.add_argument("--memory-format", choices=["text", "binary"], default="text",
+                        help="main memory file format, binary is memory-mapped (default: text)")
+    parser.add_argument("--backend", choices=sorted(backends.BACKENDS), default="subprocess",
+                        help="run tile programs as src/ binaries (a process per instruction, or persistent: one "
+                             "process per tile that keeps its weights resident) or in-process with NumPy (default: subprocess)")
+    parser.add_argument("--exact", action="store_true",
+                        help="numpy backend: accumulate in the order of the C loops for bit identical results")
+    parser.add_argument("--precision", choices=list(precision.PRECISIONS), default="fp32",
+                        help="numpy backend: store weights, activations, stream packets and snapshots as fp16 or per-tensor "
+                             "int8 codes, with --batch also run fp32 and report the accuracy delta and the bytes "
+                             "stored (default: fp32)")
+    parser.add_argument("--batch", type=int, metavar="N",
+                        help="run the first N test images (0 for all) and report top-1 accuracy and images/second")
+    parser.add_argument("--batch-size", type=int, default=1000, help="images per pass of the numpy backend (default: 1000)")
+    parser.add_argument("--cache-images", action="store_true",
+                        help="with --batch: load the preprocessed images from images.bin.npy, creating it on the first run")
+    parser.add_argument("--prefetch", type=int, default=4, metavar="PASSES",
+                        help="with --batch: passes of images read and preprocessed ahead on a feeder thread, 0 reads "
+                             "every pass on the run's thread when it starts (default: 4)")
+    parser.add_argument("--workers", type=int, metavar="N",
+                        help="with --batch: shard the images over N worker processes, each with its own memory workspace")
+    parser.add_argument("--schedule", type=int, metavar="THREADS",
+                        help="run independent instructions concurrently on THREADS threads and report the critical path")
+    parser.add_argument("--snapshot-dir", default="memory/snapshots/",
+                        help="where main memory snapshots with the weights already copied are kept (default: memory/snapshots/)")
+    parser.add_argument("--no-snapshot", action="store_true", help="set up main memory and copy the weights on every run")
+    parser.add_argument("--result-cache", metavar="DIR",
+                        help="replay the results of tiles whose program, arguments and inputs are unchanged since an "
+                             "earlier run from DIR, only the tiles downstream of a change run")
+    parser.add_argument("--result-cache-size", type=int, default=resultCache.MAX_CACHE_BYTES // 2**20, metavar="MB",
+                        help="bound of the result cache, least recently used results are evicted (default: %(default)s)")
+    parser.add_argument("--capacity", action="store_true",
+                        help="track the high-water mark of main memory and every stream and compare it with the plan")
+    parser.add_argument("--validate", action="store_true",
+                        help="check the output of every tile instruction against a float64 NumPy reference of its layer, "
+                             "report the error per instruction and stop at the first one over --tolerance")
+    parser.add_argument("--tolerance", type=float, default=validate.TOLERANCE,
+                        help="with --validate: largest absolute error accepted (default: %(default)s)")
+    parser.add_argument("--profile", metavar="TRACE",
+                        help="time every instruction, print a read/compute/write breakdown and write a Chrome trace (JSON) to TRACE")
+    parser.add_argument("--export-text", metavar="FILE", help="after the run dump main memory as text for debugging")
+    args = parser.parse_args()
+    
     binDir = "src/"
-    dataDir = "data/"
+    dataDir = args.data_dir
     memoryDir = "memory/"
     
     sizeOfmainMemory = 4 * 1024 * 1024 # 8MB
     streamDepth = 1 *1024 * 1024 # 1MB 
     
-    #get data for Lenet Test
-    images, (num_images, rows, cols) = readbins.parse_mnist_images(dataDir + "images.bin")
-    labels = readbins.parse_mnist_labels(dataDir + "labels.bin")
-    conv1_weights, conv1_bias, conv3_weights, conv3_bias, conv5_weights, conv5_bias, fc6_weights, fc6_bias = readbins.parse_parameters(dataDir + "params.bin")
+    # compile the program (or load it from the cache) first, a bad ISA file fails before any data is read
+    try:
+        program = isa.loadProgram(args.isa, sizeOfmainMemory)
+    except isa.ISAError as error:
+        print("Error:", error)
+        raise SystemExit(1)
+    # main memory is allocated up to the highest byte the program uses, the streams as deep as they get
+    memorySize = isa.memoryHighWater(program)
     
-    dataObjects = {}
-    # Parsing image data and storing in dictionary
-    dataObjects['images'], (dataObjects['num_images'], dataObjects['rows'], dataObjects['cols']) = readbins.parse_mnist_images(dataDir + "images.bin")
-    # Parsing label data and storing in dictionary
-    dataObjects['labels'] = readbins.parse_mnist_labels(dataDir + "labels.bin")
-    # Parsing network parameters and storing in dictionary
-    (dataObjects['conv1_weights'], dataObjects['conv1_bias'], dataObjects['conv3_weights'], dataObjects['conv3_bias'],
-     dataObjects['conv5_weights'], dataObjects['conv5_bias'], dataObjects['fc6_weights'], dataObjects['fc6_bias']
-    ) = readbins.parse_parameters(dataDir + "params.bin")
+    # data objects are loaded when the program (or the batch run) first uses them
+    dataObjects = registry.mnistRegistry(dataDir, args.cache_images)
     
-    dataObjects['image'] = readbins.get_image(dataObjects['images'], 0)
+    if args.precision != "fp32" and args.backend != "numpy":
+        print(f"Error: --precision {args.precision} needs --backend numpy, the tile programs compute in float32")
+        raise SystemExit(1)
+    if args.prefetch < 0:
+        print("Error: --prefetch must not be negative")
+        raise SystemExit(1)
+    if args.export_text and args.batch is not None:
+        print("Error: --export-text dumps the memory of a single run, every pass of --batch overwrites the images")
+        raise SystemExit(1)
     
     #setup main memory
-    memManage.setupMemory(sizeOfmainMemory, memoryDir + "mainmemory")
+    backend = backends.makeBackend(args.backend, verbose=args.batch is None, exact=args.exact, precision=args.precision)
+    # persistent tile workers exit with the run
+    atexit.register(backend.close)
+    # the wrappers report separately, whichever of them wraps the others
+    cachingBackend = capacityMonitor = validator = None
+    if args.result_cache:
+        if args.batch is not None:
+            print("Error: --result-cache replays a single run, every pass of --batch has new images")
+            raise SystemExit(1)
+        backend = cachingBackend = resultCache.CachingBackend(backend, resultCache.ResultCache(args.result_cache,
+                                                                                               args.result_cache_size * 2**20))
+    if args.capacity:
+        if args.workers:
+            print("Error: --capacity measures the backend of this process, it cannot be combined with --workers")
+            raise SystemExit(1)
+        backend = capacityMonitor = capacity.CapacityMonitor(backend)
+    if args.validate:
+        if args.workers:
+            print("Error: --validate checks the backend of this process, it cannot be combined with --workers")
+            raise SystemExit(1)
+        backend = validator = validate.ValidatingBackend(backend, program, args.tolerance)
+    if args.profile:
+        if args.workers:
+            print("Error: --profile times the instructions of this process, it cannot be combined with --workers")
+            raise SystemExit(1)
+        backend = profiler.ProfilingBackend(backend, program)
+    mainMemoryFile = memManage.mainMemoryPath(memoryDir, args.memory_format)
+    snapshotKey = None
+    residentObjects = None
+    if args.no_snapshot:
+        backend.setupMemory(memorySize, mainMemoryFile)
+    else:
+        # weights and biases at their ISA addresses are cloned from the snapshot of an earlier run
+        snapshotKey = snapshot.snapshotKey(dataDir + "params.bin", program, memorySize)
+        residentObjects, _ = snapshot.setupResidentMemory(backend, program, memorySize, mainMemoryFile,
+                                                          dataObjects, args.snapshot_dir, snapshotKey)
+    
+    if args.batch is not None:
+        images = dataObjects['images']
+        labels = dataObjects['labels']
+        num_images = readbins.count_images(images)
+    
+    if args.batch is not None and args.workers:
+        numImages = min(args.batch or num_images, num_images)
+        outputs, accuracy, throughput, results, wallTime = runParallel(program, binDir, streamDepth, memorySize,
+                                                                       dataObjects, images, labels, numImages, args.workers,
+                                                                       args.batch_size, args.memory_format, args.backend, args.exact,
+                                                                       args.snapshot_dir, snapshotKey, args.precision)
+        parallel.printShardTimings(results, wallTime)
+        print("outputs:", outputs.shape)
+        print(f"top-1 accuracy: {accuracy * 100:.2f}% ({numImages} images)")
+        if args.precision != "fp32":
+            referenceOutputs, referenceFootprint = runReference(args, program, binDir, memoryDir, streamDepth, memorySize,
+                                                                dataObjects, images, labels, numImages, snapshotKey)
+            precision.printAccuracyReport(args.precision, outputs, referenceOutputs, labels, mergeFootprints(results),
+                                          referenceFootprint)
+        raise SystemExit
+    
+    if args.batch is not None:
+        numImages = min(args.batch or num_images, num_images)
+        # the tile binaries run one image per pass
+        batchSize = args.batch_size if hasattr(backend, "setBatch") else 1
+        imageFeeder = feeder.ImageFeeder(images, numImages, batchSize, args.prefetch)
+        trafficBefore = dict(getattr(backend, "traffic", {}))
+        try:
+            outputs, accuracy, throughput = runBatch(program, binDir, dataDir, memoryDir, streamDepth, dataObjects,
+                                                     images, labels, numImages, batchSize, args.memory_format, backend,
+                                                     numThreads=args.schedule, residentObjects=residentObjects,
+                                                     imageFeeder=imageFeeder)
+        except validate.ValidationError as error:
+            validator.printReport()
+            print("Error:", error)
+            raise SystemExit(1)
+        print("outputs:", outputs.shape)
+        print(f"top-1 accuracy: {accuracy * 100:.2f}% ({numImages} images)")
+        print(f"throughput: {throughput:.1f} images/s")
+        imageFeeder.printStats()
+        if args.validate:
+            validator.printReport()
+        if args.capacity:
+            capacityMonitor.printReport(program, sizeOfmainMemory, streamDepth)
+        if args.precision != "fp32":
+            footprint = measureFootprint(backend, program, mainMemoryFile, trafficBefore)
+            referenceOutputs, referenceFootprint = runReference(args, program, binDir, memoryDir, streamDepth, memorySize,
+                                                                dataObjects, images, labels, numImages, snapshotKey)
+            precision.printAccuracyReport(args.precision, outputs, referenceOutputs, labels, footprint, referenceFootprint)
+        if args.profile:
+            writeProfile(backend, args.profile)
+        raise SystemExit
     
-    outdata = parseISA("./lenetFPGA.ISA", binDir, dataDir, memoryDir, streamDepth, dataObjects)
+    scheduler = dataflow.DataflowScheduler(backend, streamDepth, args.schedule) if args.schedule else None
+    try:
+        outdata = parseISA(program, binDir, dataDir, memoryDir, streamDepth, dataObjects, args.memory_format, backend,
+                           residentObjects=residentObjects, scheduler=scheduler)
+    except validate.ValidationError as error:
+        validator.printReport()
+        print("Error:", error)
+        raise SystemExit(1)
     
     for i in range(10):
         print(outdata['output'][i])
+    
+    if scheduler is not None:
+        scheduler.printReport()
+    
+    if args.result_cache:
+        cachingBackend.printReport()
+    
+    if args.capacity:
+        capacityMonitor.printReport(program, sizeOfmainMemory, streamDepth)
+    
+    if args.validate:
+        validator.printReport()
+    
+    if args.profile:
+        writeProfile(backend, args.profile)
+    
+    if args.export_text:
+        backend.exportTextMemory(mainMemoryFile, args.export_text)
 
 # correct out      
 # 0.008176647
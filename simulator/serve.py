@@ -0,0 +1,220 @@
+import argparse
+import concurrent.futures
+import json
+import signal
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+
+import run
+from pylib import backends
+from pylib import batcher
+from pylib import isa
+from pylib import memManage
+from pylib import parallel
+from pylib import precision
+from pylib import readbins
+from pylib import registry
+from pylib import snapshot
+from pylib import scheduler as dataflow
+
+class InferenceEngine:
+    """A compiled program with its weights resident in device memory, running batches of images.
+
+    The program is compiled and the weights copied (or cloned from a snapshot) once, in a private
+    memory/stream workspace, every batch then only copies its images. Backends with setBatch
+    (NumPy) run a whole batch per pass, the tile binaries one image per pass."""
+
+    def __init__(self, program, backend, dataObjects, streamDepth, memoryFormat="text", snapshotDir=None,
+                 snapshotKey=None, numThreads=None, binDir="src/"):
+        self.program = program
+        self.backend = backend
+        self.dataObjects = dataObjects
+        self.streamDepth = streamDepth
+        self.memoryFormat = memoryFormat
+        self.numThreads = numThreads
+        self.binDir = binDir
+        self.batched = hasattr(backend, "setBatch")
+        self.memoryDir = parallel.makeWorkspace("tilesim-serve-")
+        memorySize = isa.memoryHighWater(program)
+        mainMemoryFile = memManage.mainMemoryPath(self.memoryDir, memoryFormat)
+        if snapshotKey is None:
+            # copied once here, every batch after that finds them resident
+            layout = snapshot.residentLayout(program)
+            self.residentObjects = {instruction.name for instruction in layout}
+            backend.setupMemory(memorySize, mainMemoryFile)
+            for name, address, size in layout:
+                backend.writeMemory(mainMemoryFile, dataObjects[name], address, size)
+        else:
+            self.residentObjects, _ = snapshot.setupResidentMemory(backend, program, memorySize, mainMemoryFile,
+                                                                   dataObjects, snapshotDir, snapshotKey)
+
+    def runImages(self, images):
+        """(N, 10) outputs of a (N, 1, 32, 32) batch of preprocessed images."""
+        passes = [images] if self.batched else [images[index : index + 1] for index in range(len(images))]
+        outputs = []
+        for batch in passes:
+            if self.batched:
+                self.backend.setBatch(len(batch))
+            self.dataObjects['image'] = batch
+            scheduler = dataflow.DataflowScheduler(self.backend, self.streamDepth, self.numThreads) if self.numThreads else None
+            outdata = run.parseISA(self.program, self.binDir, None, self.memoryDir, self.streamDepth, self.dataObjects,
+                                   self.memoryFormat, self.backend, batchObjects={'image'},
+                                   residentObjects=self.residentObjects, scheduler=scheduler)
+            outputs.append(np.reshape(outdata['output'], (len(batch), -1)))
+        return np.concatenate(outputs)
+
+    def close(self):
+        self.backend.close()
+        parallel.removeWorkspace(self.memoryDir)
+
+def parseImage(request, dataObjects):
+    """The (1, 32, 32) preprocessed image of a request body.
+
+    {"pixels": [784 values 0..255]} is a raw 28x28 MNIST image, {"image": [1024 values]} an
+    already preprocessed 32x32 one and {"index": n} test image n of the data directory."""
+    if "index" in request:
+        images = dataObjects['images']
+        index = int(request["index"])
+        if not 0 <= index < readbins.count_images(images):
+            raise ValueError(f"index {index} is not a test image, there are {readbins.count_images(images)}")
+        return readbins.get_image(images, index)
+    if "pixels" in request:
+        pixels = np.asarray(request["pixels"], dtype=np.float64).reshape(-1)
+        if pixels.size != 28 * 28 or pixels.min(initial=0) < 0 or pixels.max(initial=0) > 255:
+            raise ValueError("pixels must be 784 values in 0..255")
+        return readbins.get_image(pixels.astype(np.uint8), 0)
+    if "image" in request:
+        image = np.asarray(request["image"], dtype=np.float32)
+        if image.size != 32 * 32:
+            raise ValueError("image must be 1024 preprocessed values (1x32x32)")
+        return image.reshape(1, 32, 32)
+    raise ValueError('the request needs "pixels", "image" or "index"')
+
+class InferenceServer(ThreadingHTTPServer):
+    # every waiting client holds a connection, the default backlog of 5 resets concurrent ones
+    request_queue_size = 128
+    daemon_threads = True
+
+class InferenceHandler(BaseHTTPRequestHandler):
+    """POST /infer runs one image through the server's batcher, GET /stats returns the batcher statistics."""
+
+    protocol_version = "HTTP/1.1"
+
+    def sendJSON(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path == "/stats":
+            self.sendJSON(200, self.server.batcher.stats())
+        else:
+            self.sendJSON(404, {"error": f"no {self.path}, use POST /infer or GET /stats"})
+
+    def do_POST(self):
+        if self.path != "/infer":
+            self.sendJSON(404, {"error": f"no {self.path}, use POST /infer or GET /stats"})
+            return
+        start = time.perf_counter()
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            image = parseImage(json.loads(self.rfile.read(length) or b"{}"), self.server.dataObjects)
+        except (ValueError, TypeError, KeyError, IOError) as error:
+            self.sendJSON(400, {"error": str(error)})
+            return
+        try:
+            request = self.server.batcher.submit(image)
+            output = request.future.result(timeout=self.server.resultTimeout)
+        except concurrent.futures.TimeoutError:
+            self.sendJSON(503, {"error": f"no result within {self.server.resultTimeout}s"})
+            return
+        except Exception as error:
+            self.sendJSON(500, {"error": str(error)})
+            return
+        self.sendJSON(200, {"output": output.tolist(), "prediction": int(output.argmax()),
+                            "batchSize": request.batchSize, "queueMs": request.queueTime * 1e3,
+                            "latencyMs": (time.perf_counter() - start) * 1e3})
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Serve an ISA program on the FPGA tile simulator over HTTP, "
+                                                 "batching concurrent single-image requests")
+    parser.add_argument("--isa", default="./lenetFPGA.ISA", help="ISA program to run")
+    parser.add_argument("--data-dir", default="data/", help="directory holding images.bin, labels.bin and params.bin")
+    parser.add_argument("--host", default="127.0.0.1", help="address to listen on (default: %(default)s)")
+    parser.add_argument("--port", type=int, default=8526, help="port to listen on (default: %(default)s)")
+    parser.add_argument("--memory-format", choices=["text", "binary"], default="text",
+                        help="main memory file format, binary is memory-mapped (default: text)")
+    parser.add_argument("--backend", choices=sorted(backends.BACKENDS), default="numpy",
+                        help="numpy runs a whole batch per pass, the tile binaries one image per pass (default: numpy)")
+    parser.add_argument("--exact", action="store_true",
+                        help="numpy backend: accumulate in the order of the C loops for bit identical results")
+    parser.add_argument("--precision", choices=list(precision.PRECISIONS), default="fp32",
+                        help="numpy backend: store weights, activations, stream packets and snapshots as fp16 or per-tensor "
+                             "int8 codes")
+    parser.add_argument("--max-batch-size", type=int, default=32,
+                        help="most requests run in one batch (default: %(default)s)")
+    parser.add_argument("--max-wait", type=float, default=5.0, metavar="MS",
+                        help="longest the first request of a batch waits for more to arrive (default: %(default)s)")
+    parser.add_argument("--schedule", type=int, metavar="THREADS",
+                        help="run independent instructions of every batch concurrently on THREADS threads")
+    parser.add_argument("--snapshot-dir", default="memory/snapshots/",
+                        help="where main memory snapshots with the weights already copied are kept (default: memory/snapshots/)")
+    parser.add_argument("--no-snapshot", action="store_true", help="copy the weights at startup instead of cloning a snapshot")
+    parser.add_argument("--timeout", type=float, default=30.0, metavar="S",
+                        help="longest a request waits for its result before it fails with 503 (default: %(default)s)")
+    parser.add_argument("--verbose", action="store_true", help="log every request")
+    args = parser.parse_args()
+
+    dataDir = args.data_dir
+    sizeOfmainMemory = 4 * 1024 * 1024
+    streamDepth = 1 * 1024 * 1024
+
+    try:
+        program = isa.loadProgram(args.isa, sizeOfmainMemory)
+    except isa.ISAError as error:
+        print("Error:", error)
+        raise SystemExit(1)
+    if args.precision != "fp32" and args.backend != "numpy":
+        print(f"Error: --precision {args.precision} needs --backend numpy, the tile programs compute in float32")
+        raise SystemExit(1)
+    if args.max_batch_size < 1 or args.max_wait < 0:
+        print("Error: --max-batch-size must be at least 1 and --max-wait not negative")
+        raise SystemExit(1)
+
+    dataObjects = registry.mnistRegistry(dataDir)
+    backend = backends.makeBackend(args.backend, verbose=False, exact=args.exact, precision=args.precision)
+    snapshotKey = None if args.no_snapshot else snapshot.snapshotKey(dataDir + "params.bin", program,
+                                                                     isa.memoryHighWater(program))
+    engine = InferenceEngine(program, backend, dataObjects, streamDepth, args.memory_format, args.snapshot_dir,
+                             snapshotKey, args.schedule)
+    imageBatcher = batcher.DynamicBatcher(engine.runImages, args.max_batch_size, args.max_wait / 1e3)
+
+    server = InferenceServer((args.host, args.port), InferenceHandler)
+    server.batcher = imageBatcher
+    server.dataObjects = dataObjects
+    server.verbose = args.verbose
+    server.resultTimeout = args.timeout
+    print(f"serving {args.isa} on the {args.backend} backend at http://{args.host}:{server.server_port}/ "
+          f"(POST /infer, GET /stats), batches of at most {args.max_batch_size} after {args.max_wait}ms")
+    # stopped by Ctrl-C or a SIGTERM of the test harness, either way the statistics are printed
+    def stop(signum, frame):
+        raise KeyboardInterrupt
+    signal.signal(signal.SIGTERM, stop)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        imageBatcher.close()
+        imageBatcher.printStats()
+        engine.close()
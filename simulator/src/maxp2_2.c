@@ -4,6 +4,8 @@
 #include <stdio.h>
 #include <stdlib.h>
 #include <string.h>
+#include <sys/file.h>
+#include <sys/stat.h>
 #include <time.h>
 
 typedef float dataType;
@@ -44,6 +46,184 @@ void maxPooling(int inputChannels, int height, int width, int pool_size, int str
     }
 }
 
+// main memory files ending in .bin hold raw bytes instead of one hex byte per line
+int isBinaryFile(const char *fileName) {
+    size_t length = strlen(fileName);
+    return length > 4 && strcmp(fileName + length - 4, ".bin") == 0;
+}
+
+// phase timings for the Python profiler, printed only when TILE_PROFILE is set in the environment
+int profiling = 0;
+
+// CLOCK_MONOTONIC, the clock of Python's time.monotonic, so phases line up with the host timeline
+double now() {
+    struct timespec time;
+    clock_gettime(CLOCK_MONOTONIC, &time);
+    return time.tv_sec + time.tv_nsec * 1e-9;
+}
+
+// file bytes moved for size values: 4 per value in a binary file, four "XX\n" lines in a text file
+long memoryBytes(const char *fileName, int size) {
+    return isBinaryFile(fileName) ? 4L * size : 12L * size;
+}
+
+void profile(const char *phase, const char *fileName, long bytes, double start) {
+    if (profiling) {
+        printf("profile %s %s %ld %.9f %.9f\n", phase, fileName, bytes, start, now());
+    }
+}
+
+// tile number from the stream<N> (or stream<N>.bin) input stream name
+int streamTile(const char *streamFile) {
+    const char *name = strrchr(streamFile, '/');
+    name = name ? name + 1 : streamFile;
+    return strncmp(name, "stream", 6) == 0 ? atoi(name + 6) : 0;
+}
+
+// stream files ending in .bin are a ring buffer shared by up to MAX_READERS reader tiles: a header with
+// a read cursor (head, count) per reader, followed by capacity packed records of one srcTile byte and a
+// 4 byte value. A write appends once for every reader and only reuses records all readers consumed.
+#define STREAM_MAGIC "STRM"
+#define STREAM_RECORD_SIZE 5
+#define MAX_READERS 16
+
+typedef struct {
+    char magic[4];
+    unsigned int capacity;
+    unsigned int readers; // bit t set when tile t reads the stream
+    unsigned int tail;    // next record written
+    unsigned int heads[MAX_READERS];
+    unsigned int counts[MAX_READERS];
+} StreamHeader;
+
+unsigned char streamRecords[MAX_STREAM_ELEMENTS * STREAM_RECORD_SIZE];
+
+// readers of a shared stream run concurrently, the header is only updated under an exclusive lock
+int readStreamHeader(FILE *file, StreamHeader *header) {
+    flock(fileno(file), LOCK_EX);
+    fseek(file, 0, SEEK_SET);
+    if (fread(header, sizeof(StreamHeader), 1, file) != 1 || memcmp(header->magic, STREAM_MAGIC, 4) != 0) {
+        printf("Error: Not a binary stream file.\n");
+        return 0;
+    }
+    return 1;
+}
+
+// records [first, first + count) of the ring, wrapping past the end of the file
+void ringRecords(FILE *file, StreamHeader *header, unsigned int first, unsigned int count, int writing) {
+    unsigned int firstPart = header->capacity - first < count ? header->capacity - first : count;
+    unsigned int parts[2][3] = {{first, 0, firstPart}, {0, firstPart, count - firstPart}};
+    for (int i = 0; i < 2; i++) {
+        if (parts[i][2] == 0) {
+            continue;
+        }
+        fseek(file, sizeof(StreamHeader) + (long)parts[i][0] * STREAM_RECORD_SIZE, SEEK_SET);
+        if (writing) {
+            fwrite(streamRecords + parts[i][1] * STREAM_RECORD_SIZE, STREAM_RECORD_SIZE, parts[i][2], file);
+        } else {
+            fread(streamRecords + parts[i][1] * STREAM_RECORD_SIZE, STREAM_RECORD_SIZE, parts[i][2], file);
+        }
+    }
+}
+
+unsigned int readRingStream(FILE *file, unsigned int reader, dataType *array) {
+    StreamHeader header;
+    if (!readStreamHeader(file, &header)) {
+        fclose(file);
+        return 0;
+    }
+
+    if (reader >= MAX_READERS || !(header.readers >> reader & 1)) {
+        printf("Error: Tile %u does not read this stream.\n", reader);
+        fclose(file);
+        return 0;
+    }
+
+    unsigned int size = header.counts[reader];
+    if (size > MAX_STREAM_ELEMENTS) {
+        printf("Error: Size read from file exceeds the maximum array size.\n");
+        fclose(file);
+        return 0;
+    }
+
+    ringRecords(file, &header, header.heads[reader], size, 0);
+    for (int i = 0; i < size; i++) {
+        // srcTile at streamRecords[i * STREAM_RECORD_SIZE] -> for later update
+        memcpy(&array[i], streamRecords + i * STREAM_RECORD_SIZE + 1, sizeof(dataType));
+    }
+
+    // consume everything read by this reader
+    header.heads[reader] = (header.heads[reader] + size) % header.capacity;
+    header.counts[reader] = 0;
+    fseek(file, 0, SEEK_SET);
+    fwrite(&header, sizeof(StreamHeader), 1, file);
+
+    fclose(file);
+    return size;
+}
+
+void writeRingStream(FILE *file, unsigned char srcTile, dataType *array, unsigned int size) {
+    StreamHeader header;
+    if (!readStreamHeader(file, &header)) {
+        fclose(file);
+        return;
+    }
+
+    // the slowest reader decides how much of the ring is still in use
+    unsigned int used = 0;
+    for (int reader = 0; reader < MAX_READERS; reader++) {
+        if ((header.readers >> reader & 1) && header.counts[reader] > used) {
+            used = header.counts[reader];
+        }
+    }
+    if (used + size > header.capacity || size > MAX_STREAM_ELEMENTS) {
+        printf("Error: Stream full, %u values do not fit in %u free records.\n", size, header.capacity - used);
+        fclose(file);
+        return;
+    }
+
+    for (int i = 0; i < size; i++) {
+        streamRecords[i * STREAM_RECORD_SIZE] = srcTile;
+        memcpy(streamRecords + i * STREAM_RECORD_SIZE + 1, &array[i], sizeof(dataType));
+    }
+    ringRecords(file, &header, header.tail, size, 1);
+
+    header.tail = (header.tail + size) % header.capacity;
+    for (int reader = 0; reader < MAX_READERS; reader++) {
+        if (header.readers >> reader & 1) {
+            header.counts[reader] += size;
+        }
+    }
+    fseek(file, 0, SEEK_SET);
+    fwrite(&header, sizeof(StreamHeader), 1, file);
+
+    fclose(file);
+}
+
+// true when stream destination i is the same file (a link to one shared stream) as an earlier one
+int sharesStream(const char **streamDest, int i) {
+    struct stat stream, earlier;
+    if (stat(streamDest[i], &stream) != 0) {
+        return 0;
+    }
+    for (int j = 0; j < i; j++) {
+        if (stat(streamDest[j], &earlier) == 0 && stream.st_dev == earlier.st_dev && stream.st_ino == earlier.st_ino) {
+            return 1;
+        }
+    }
+    return 0;
+}
+
+// stream bytes moved for size values: header plus packed records in a binary stream, a "%08X\n" size and
+// five "XX\n" lines per value in a text stream
+long streamBytes(const char *fileName, unsigned int size) {
+    return isBinaryFile(fileName) ? (long)sizeof(StreamHeader) + 5L * size : 9 + 15L * size;
+}
+
+// a tile server (see serve) sets these, max pooling has no parameters to keep resident
+int serving = 0;
+int reloadParameters = 1;
+
 unsigned int readArrayFromStream(const char *mainMemoryFile, dataType *array) {
     FILE *file = fopen(mainMemoryFile, "r+");
     if (!file) {
@@ -51,6 +231,10 @@ unsigned int readArrayFromStream(const char *mainMemoryFile, dataType *array) {
         return 0;
     }
 
+    if (isBinaryFile(mainMemoryFile)) {
+        return readRingStream(file, streamTile(mainMemoryFile), array);
+    }
+
     // Move to the position where we want to start reading
     fseek(file, 0, SEEK_SET); // Each byte is 2 hex digits plus a newline
 
@@ -99,6 +283,11 @@ void writeArrayToStream(const char *mainMemoryFile, unsigned char srcTile, dataT
         return;
     }
 
+    if (isBinaryFile(mainMemoryFile)) {
+        writeRingStream(file, srcTile, array, size);
+        return;
+    }
+
     // Move to start where the lengh metadata is stored
     unsigned int oldStreamSize;
     fseek(file, 0, SEEK_SET); // Each byte is 2 hex digits plus a newline
@@ -133,6 +322,14 @@ float readFloatFromMemory(const char *mainMemoryFile, int address) {
         return -1;
     }
 
+    if (isBinaryFile(mainMemoryFile)) {
+        float value;
+        fseek(file, address, SEEK_SET);
+        fread(&value, sizeof(float), 1, file);
+        fclose(file);
+        return value;
+    }
+
     // Move to the position where we want to start reading
     fseek(file, address * 3, SEEK_SET); // Each byte is 2 hex digits plus a newline
 
@@ -156,6 +353,13 @@ void readArrayFromMemory(const char *mainMemoryFile, int address, dataType *arra
         return;
     }
 
+    if (isBinaryFile(mainMemoryFile)) {
+        fseek(file, address, SEEK_SET);
+        fread(array, sizeof(dataType), size, file);
+        fclose(file);
+        return;
+    }
+
     // Move to the position where we want to start reading
     fseek(file, address * 3, SEEK_SET); // Each byte is 2 hex digits plus a newline
 
@@ -180,6 +384,13 @@ void writeArrayToMemory(const char *mainMemoryFile, int address, dataType *array
         return;
     }
 
+    if (isBinaryFile(mainMemoryFile)) {
+        fseek(file, address, SEEK_SET);
+        fwrite(array, sizeof(dataType), size, file);
+        fclose(file);
+        return;
+    }
+
     // Move to the position where we want to start writing
     fseek(file, address * 3, SEEK_SET); // Each byte is 2 hex digits plus a newline
 
@@ -193,7 +404,9 @@ void writeArrayToMemory(const char *mainMemoryFile, int address, dataType *array
     fclose(file);
 }
 
-int main(int argc, char **argv) {
+int runTile(int argc, char **argv) {
+    double mainStart = now();
+    double start;
 
     int extraDest = 0;
 
@@ -223,8 +436,7 @@ int main(int argc, char **argv) {
     int poolSize = atoi(argv[extraDest + 10]);
     int stride = atoi(argv[extraDest + 11]);
 
-    // ASCII value of 0 is 48
-    int tileNumber = (int)streamInput[strlen(streamInput) - 1] - 48;
+    int tileNumber = streamTile(streamInput);
 
     printf("MaxPoolRelu\n");
     printf("memoryFileName: %s\n", memoryFileName);
@@ -259,24 +471,69 @@ int main(int argc, char **argv) {
     int writeStream = streamingSetting % 10;
 
     if (readStream == 0) { // memory
+        start = now();
         readArrayFromMemory(memoryFileName, inputAddress, inputImage, inputChannels * height * width);
+        profile("read", memoryFileName, memoryBytes(memoryFileName, inputChannels * height * width), start);
     } else { // stream
         // readArrayFromMemory(streamInput, 0, inputImage, inputChannels * height * width);
-        readArrayFromStream(streamInput, inputImage);
+        start = now();
+        unsigned int streamSize = readArrayFromStream(streamInput, inputImage);
+        profile("read", streamInput, streamBytes(streamInput, streamSize), start);
     }
 
+    start = now();
     maxPooling(inputChannels, height, width, poolSize, stride);
-
-    writeArrayToMemory(memoryFileName, outputAddress, outputImage, inputChannels * hout * wout);
+    profile("compute", "-", 0, start);
 
     // output
     if (writeStream == 0) { // memory
+        start = now();
         writeArrayToMemory(memoryFileName, outputAddress, outputImage, inputChannels * hout * wout);
+        profile("write", memoryFileName, memoryBytes(memoryFileName, inputChannels * hout * wout), start);
     } else { // stream
         for (int i = 0; i <= extraDest; i++) {
+            // destinations linked to one shared stream get a single copy
+            if (sharesStream(streamDest, i)) {
+                continue;
+            }
+            start = now();
             writeArrayToStream(streamDest[i], (unsigned char)tileNumber, outputImage, inputChannels * hout * wout);
+            profile("write", streamDest[i], streamBytes(streamDest[i], inputChannels * hout * wout), start);
         }
     }
 
+    profile("main", "-", 0, mainStart);
+    return 0;
+}
+
+// tile server: "<program> --serve" runs one command per stdin line, "<reload> <arguments...>" with the
+// arguments of a single run, and answers each with a "done <status>" line
+#define MAX_COMMAND_LINE 4096
+#define MAX_ARGUMENTS 64
+
+int serve(char *program) {
+    char line[MAX_COMMAND_LINE];
+    char *arguments[MAX_ARGUMENTS];
+    serving = 1;
+    while (fgets(line, sizeof(line), stdin)) {
+        int argc = 0;
+        arguments[argc++] = program;
+        char *token = strtok(line, " \n");
+        reloadParameters = token ? atoi(token) : 1;
+        while ((token = strtok(NULL, " \n")) && argc < MAX_ARGUMENTS) {
+            arguments[argc++] = token;
+        }
+        int status = runTile(argc, arguments);
+        printf("done %d\n", status);
+        fflush(stdout);
+    }
     return 0;
 }
+
+int main(int argc, char **argv) {
+    profiling = getenv("TILE_PROFILE") != NULL;
+    if (argc == 2 && strcmp(argv[1], "--serve") == 0) {
+        return serve(argv[0]);
+    }
+    return runTile(argc, argv);
+}
@@ -0,0 +1,31 @@
+import os
+import sys
+import numpy as np
+import pytest
+
+# the tests import pylib from the simulator directory, wherever pytest is started
+SIMULATOR_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SIMULATOR_DIR)
+
+from pylib import isa
+from pylib import memManage
+from pylib import readbins
+
+STREAM_DEPTH = 1 * 1024 * 1024
+
+@pytest.fixture
+def lenetData():
+    """A test image and random LeNet parameters under the data object names of lenetFPGA.ISA."""
+    rng = np.random.default_rng(526)
+    dataObjects = {'image': rng.random((1, 32, 32), dtype=np.float32)}
+    for name, shape in readbins.PARAMETER_LAYOUT:
+        dataObjects[name] = (rng.standard_normal(shape) * 0.2).astype(np.float32)
+    return dataObjects
+
+def runProgram(program, backend, dataObjects, memoryDir, scheduler=None):
+    """Output of one run of a compiled program on a fresh main memory of backend."""
+    memoryDir = str(memoryDir) + os.sep
+    backend.setupMemory(isa.memoryHighWater(program), memManage.mainMemoryPath(memoryDir))
+    executor = isa.Executor(backend, os.path.join(SIMULATOR_DIR, "src") + os.sep, memoryDir, STREAM_DEPTH,
+                            dict(dataObjects), scheduler=scheduler)
+    return np.asarray(executor.run(program)['output'], dtype=np.float32).reshape(-1)
@@ -0,0 +1,55 @@
+import os
+import numpy as np
+import pytest
+
+from conftest import SIMULATOR_DIR, runProgram
+from pylib import backends
+from pylib import isa
+from pylib import multiplex
+from pylib import netCompiler
+from pylib import partition
+from pylib import scheduler as dataflow
+
+LENET = isa.loadProgram(os.path.join(SIMULATOR_DIR, "lenetFPGA.ISA"))
+
+with open(os.path.join(SIMULATOR_DIR, "lenetFPGA.layers")) as file:
+    LENET_LAYERS = file.read()
+
+def compileLenet(numTiles):
+    compiled = netCompiler.compileNet(LENET_LAYERS, source="lenetFPGA.layers", numTiles=numTiles)
+    return compiled, isa.compileISA(compiled.text, source=f"lenet on {numTiles} tiles")
+
+@pytest.mark.parametrize("numTiles, spilled", [(1, 5), (2, 1), (3, 0)])
+def testFewTilesGiveTheSameOutput(lenetData, tmp_path, numTiles, spilled):
+    compiled, program = compileLenet(numTiles)
+    assert compiled.schedule.multiplexed and compiled.schedule.reconfigurations
+    assert len(compiled.spilled) == spilled
+    assert {instruction.tile for instruction in program.instructions
+            if isinstance(instruction, isa.TileInstruction)} == set(range(1, numTiles + 1))
+
+    reference = runProgram(LENET, backends.NumpyBackend(exact=True), lenetData, tmp_path)
+    assert np.array_equal(runProgram(program, backends.NumpyBackend(exact=True), lenetData, tmp_path), reference)
+
+@pytest.mark.parametrize("numTiles", [1, 2, 3])
+def testFewTilesOnTheScheduler(lenetData, tmp_path, numTiles):
+    _, program = compileLenet(numTiles)
+    reference = runProgram(LENET, backends.NumpyBackend(exact=True), lenetData, tmp_path)
+    backend = backends.NumpyBackend(exact=True)
+    scheduler = dataflow.DataflowScheduler(backend, 1024 * 1024, 3)
+    assert np.array_equal(runProgram(program, backend, lenetData, tmp_path, scheduler), reference)
+
+def testReprogrammedTilesOnTheTileBinaries(lenetData, tmp_path):
+    # the C tiles are reprogrammed between parts, their streams set up again
+    _, program = compileLenet(2)
+    reference = runProgram(LENET, backends.NumpyBackend(exact=True), lenetData, tmp_path / "numpy")
+    output = runProgram(program, backends.FileBackend(verbose=False), lenetData, tmp_path)
+    assert np.array_equal(output, reference)
+
+def testOneTileNeedsTheSpills():
+    # every stream of lenet waits across a reconfiguration of the only tile
+    tileLayers = [layer for layer in netCompiler.parseNet(LENET_LAYERS) if layer.kernel is not None]
+    for layer in tileLayers:
+        layer.parts = partition.partitionLayer(layer, layer.fields.get("tiles", 1))
+    netCompiler.chooseModes(tileLayers)
+    with pytest.raises(multiplex.TileOverflow):
+        multiplex.multiplexTiles([part for layer in tileLayers for part in layer.parts], 1)
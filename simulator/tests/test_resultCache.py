@@ -0,0 +1,58 @@
+import os
+import numpy as np
+
+from conftest import SIMULATOR_DIR, runProgram
+from pylib import backends
+from pylib import isa
+from pylib import resultCache
+
+LENET = isa.loadProgram(os.path.join(SIMULATOR_DIR, "lenetFPGA.ISA"))
+
+# tile 1 streams to tile 2, which writes its pooled output back into the stream it reads
+SELF_LOOP = """
+program 1 convR8_32_5
+program 2 maxp2_2
+memcpy2device image 0 1024
+memcpy2device conv1_weights 4096 150
+memcpy2device conv1_bias 4696 6
+convR8_32_5 1 2 MS 0 4096 4696 -1 1 32 32 6
+maxp2_2 2 2 SS -1 -1 6 28 28 2 2
+maxp2_2 2 2 SM -1 8192 6 14 14 2 2
+memcpy2host output 8192 294
+"""
+
+def cachedRun(program, dataObjects, tmp_path):
+    backend = resultCache.CachingBackend(backends.NumpyBackend(), resultCache.ResultCache(str(tmp_path / "cache")))
+    output = runProgram(program, backend, dataObjects, tmp_path)
+    return output, backend.hits, backend.misses
+
+def testRerunReplaysEveryTile(lenetData, tmp_path):
+    reference = runProgram(LENET, backends.NumpyBackend(), lenetData, tmp_path)
+    output, hits, misses = cachedRun(LENET, lenetData, tmp_path)
+    assert (hits, misses) == (0, 7) and np.array_equal(output, reference)
+    output, hits, misses = cachedRun(LENET, lenetData, tmp_path)
+    assert (hits, misses) == (7, 0) and np.array_equal(output, reference)
+
+def testWeightChangeInvalidatesItsTileAndWhatFollows(lenetData, tmp_path):
+    before, _, _ = cachedRun(LENET, lenetData, tmp_path)
+
+    # the first conv5 output channel is computed by tile 5 only, tile 6 has the other half
+    changed = dict(lenetData)
+    changed['conv5_weights'] = lenetData['conv5_weights'].copy()
+    changed['conv5_weights'][0] += 1.0
+    output, hits, misses = cachedRun(LENET, changed, tmp_path)
+    assert (hits, misses) == (5, 2)
+    assert np.array_equal(output, runProgram(LENET, backends.NumpyBackend(), changed, tmp_path))
+    assert not np.array_equal(output, before)
+
+    # the old entries are still there for the old weights
+    output, hits, misses = cachedRun(LENET, lenetData, tmp_path)
+    assert (hits, misses) == (7, 0) and np.array_equal(output, before)
+
+def testSelfLoopReplaysItsOwnOutput(lenetData, tmp_path):
+    program = isa.compileISA(SELF_LOOP)
+    reference = runProgram(program, backends.NumpyBackend(), lenetData, tmp_path)
+    output, _, misses = cachedRun(program, lenetData, tmp_path)
+    assert misses == 3 and np.array_equal(output, reference)
+    output, hits, _ = cachedRun(program, lenetData, tmp_path)
+    assert hits == 3 and np.array_equal(output, reference)
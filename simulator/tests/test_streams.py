@@ -0,0 +1,66 @@
+import numpy as np
+import pytest
+
+from pylib import streams
+
+def testRingBufferWrapsAround(tmp_path):
+    stream = streams.Stream.create(4 * 8, str(tmp_path / "stream3.bin"))
+    assert stream.capacity == 8
+
+    stream.write(1, np.arange(6))
+    srcTiles, values = stream.read()
+    assert list(srcTiles) == [1] * 6 and list(values) == list(range(6))
+
+    # records 6, 7, 0, 1, 2 of the ring
+    stream.write([2, 2, 4, 4, 4], np.arange(10, 15))
+    header = stream.header()
+    assert header.tail == 3 and header.heads[3] == 6 and header.counts[3] == 5
+    srcTiles, values = stream.read()
+    assert list(srcTiles) == [2, 2, 4, 4, 4] and list(values) == list(range(10, 15))
+    assert len(stream) == 0 and stream.header().heads[3] == 3
+
+def testPeekLeavesThePackets(tmp_path):
+    stream = streams.Stream.create(4 * 8, str(tmp_path / "stream3.bin"))
+    stream.write(1, [1.5, 2.5])
+    assert list(stream.peek()[1]) == [1.5, 2.5]
+    assert len(stream) == 2
+
+def testFullRingRaises(tmp_path):
+    stream = streams.Stream.create(4 * 8, str(tmp_path / "stream3.bin"))
+    stream.write(1, np.arange(5))
+    with pytest.raises(streams.StreamError):
+        stream.write(1, np.arange(4))
+    # the failed write changed nothing
+    assert list(stream.read()[1]) == list(range(5))
+    stream.write(1, np.arange(8))
+    assert len(stream) == 8
+
+def testReadersHaveTheirOwnCursors(tmp_path):
+    first, second = streams.Stream.createShared(4 * 8, [str(tmp_path / "stream2.bin"), str(tmp_path / "stream5.bin")])
+    assert first.readerTiles() == [2, 5]
+
+    first.write(1, np.arange(4))
+    assert list(first.read()[1]) == list(range(4))
+    assert len(first) == 0 and len(second) == 4
+
+    # the slowest reader still holds 4 of the 8 records
+    with pytest.raises(streams.StreamError):
+        first.write(1, np.arange(5))
+    first.write(1, np.arange(4, 8))
+    assert list(second.read()[1]) == list(range(8))
+    assert list(first.read()[1]) == list(range(4, 8))
+
+    # both cursors wrap past the end of the ring, records 5, 6, 7, 0, 1, 2
+    second.write(3, np.arange(10, 15))
+    first.read()
+    second.read()
+    second.write(3, np.arange(20, 26))
+    assert list(first.read()[1]) == list(range(20, 26))
+    assert list(second.read()[1]) == list(range(20, 26))
+    header = first.header()
+    assert header.tail == 3 and header.heads[2] == header.heads[5] == 3
+
+def testOtherTilesCannotRead(tmp_path):
+    stream = streams.Stream.create(4 * 8, str(tmp_path / "stream3.bin"))
+    with pytest.raises(streams.StreamError):
+        len(streams.Stream(stream.streamFile, reader=4))